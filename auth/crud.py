@@ -3,6 +3,8 @@ from sqlalchemy.orm import Session
 from models import User
 from auth import schemas
 from db import add_commit_and_refresh
+from auth.services import invalidate_principal
+from response_cache import invalidate_responses
 
 
 def get_user(db: Session, user_schema: schemas.UserSchema):
@@ -22,6 +24,19 @@ def get_user_by_email(db: Session, email: str):
     return db.query(User).filter(User.email == email).first()
 
 
-def create_user(db: Session, user_auth: schemas.UserAuth):
+def create_user(
+    db: Session, user_auth: schemas.UserAuth, hashed_password: str = None
+):
     """Creates and returns user."""
-    return add_commit_and_refresh(db, User(**user_auth.dict()))
+    return add_commit_and_refresh(
+        db, User(**user_auth.dict(), hashed_password=hashed_password)
+    )
+
+
+def update_user_password(db: Session, user: User, hashed_password: str):
+    """Updates user password hash (e.g. after cost factor change)."""
+    user.password = hashed_password
+    email, tag = user.email, f"user:{user.id}"
+    db.commit()
+    invalidate_principal(email)
+    invalidate_responses(tag)
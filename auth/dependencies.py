@@ -2,21 +2,33 @@ from datetime import datetime
 
 from jose import jwt
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import ValidationError
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 
-from dependencies import get_db
+from dependencies import get_async_db
 from auth.crud import get_user_by_email
+from auth.services import cache_principal, get_cached_principal
 from auth.utils import ALGORITHM, JWT_SECRET_KEY
 from auth.schemas import TokenPayload, UserSchema
 
 
-def get_current_user(
+def _get_user_by_subject(db: Session, email: str) -> UserSchema:
+    """Returns user by token subject using principal cache."""
+    if (user := get_cached_principal(db, email)) is not None:
+        return user
+    if (user := get_user_by_email(db, email)) is None:
+        raise HTTPException(status_code=404, detail="Could not find user")
+    cache_principal(user)
+    return user
+
+
+async def get_current_user(
     token: str = Depends(
         OAuth2PasswordBearer(tokenUrl="/api/auth/login", scheme_name="JWT")
     ),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> UserSchema:
     try:
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM])
@@ -34,6 +46,4 @@ def get_current_user(
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if (user := get_user_by_email(db, token_data.sub)) is None:
-        raise HTTPException(status_code=404, detail="Could not find user")
-    return user
+    return await db.run_sync(_get_user_by_subject, token_data.sub)
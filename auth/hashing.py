@@ -0,0 +1,115 @@
+import os
+import asyncio
+import multiprocessing
+from threading import Lock
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from fastapi.exceptions import HTTPException
+
+from metrics import register_metrics
+from auth.utils import get_hashed_password, verify_and_update_password
+
+
+HASHING_WORKERS = int(os.getenv("HASHING_WORKERS", os.cpu_count() or 1))
+HASHING_MAX_QUEUE = int(os.getenv("HASHING_MAX_QUEUE", 64))
+HASHING_TIMEOUT = float(os.getenv("HASHING_TIMEOUT", 5))  # seconds
+
+
+class HashingService:
+    """Bounded process pool for CPU-heavy password hashing."""
+
+    def __init__(self, workers: int, max_queue: int, timeout: float) -> None:
+        """Creates service (the process pool is started on app startup or
+        first use)."""
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.pending = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._executor = None
+        self._lock = Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Returns process pool starting it if needed."""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # Forked app process could pass locks held by its threads
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return self._executor
+
+    def start(self) -> None:
+        """Starts process pool."""
+        with self._lock:
+            self._get_executor()
+
+    def _on_task_done(self, future: Future) -> None:
+        """Decreases queue depth when task is done (even after timeout)."""
+        with self._lock:
+            self.pending -= 1
+
+    def _raise_unavailable(self) -> None:
+        """Raises 503 error asking client to retry later."""
+        raise HTTPException(
+            status_code=503,
+            detail="Password hashing is overloaded, try again later",
+            headers={"Retry-After": str(max(1, round(self.timeout)))},
+        )
+
+    async def run(self, func, *args):
+        """Runs function in process pool with queue depth limit and
+        timeout and returns its result."""
+        with self._lock:
+            if self.pending >= self.max_queue:
+                self.rejected += 1
+                self._raise_unavailable()
+            self.pending += 1
+            future = self._get_executor().submit(func, *args)
+        future.add_done_callback(self._on_task_done)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), self.timeout
+            )
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            self._raise_unavailable()
+
+    def shutdown(self) -> None:
+        """Stops process pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> dict:
+        """Returns queue depth and rejection statistics."""
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+hashing_service = HashingService(
+    HASHING_WORKERS, HASHING_MAX_QUEUE, HASHING_TIMEOUT
+)
+register_metrics("password_hashing", hashing_service.get_stats)
+
+
+async def hash_password(password: str) -> str:
+    """Returns hashed password computed in process pool."""
+    return await hashing_service.run(get_hashed_password, password)
+
+
+async def verify_password(
+    password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    """Verifies password in process pool and returns new hash if
+    configured cost factor changed."""
+    return await hashing_service.run(
+        verify_and_update_password, password, hashed_password
+    )
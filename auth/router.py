@@ -1,4 +1,4 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import APIRouter, Depends
 from fastapi.exceptions import HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
@@ -6,21 +6,25 @@ from fastapi.security import OAuth2PasswordRequestForm
 from auth import crud
 from auth import utils
 from auth import schemas
-from dependencies import get_db
+from auth import hashing
+from dependencies import get_async_db
 
 
 auth_router = APIRouter()
 
 
 @auth_router.post("/signup")
-def create_user(user_auth: schemas.UserSchema, db: Session = Depends(get_db)):
-    user = crud.get_user(db, user_auth)
+async def create_user(
+    user_auth: schemas.UserSchema, db: AsyncSession = Depends(get_async_db)
+):
+    user = await db.run_sync(crud.get_user, user_auth)
     if user is not None:
         raise HTTPException(
             status_code=400,
             detail="User with this email or username already exist.",
         )
-    return crud.create_user(db, user_auth)
+    hashed_password = await hashing.hash_password(user_auth.password)
+    return await db.run_sync(crud.create_user, user_auth, hashed_password)
 
 
 @auth_router.post(
@@ -28,17 +32,25 @@ def create_user(user_auth: schemas.UserSchema, db: Session = Depends(get_db)):
     response_model=schemas.TokenSchema,
     summary="Create access and refresh tokens for user",
 )
-def login(
-    db: Session = Depends(get_db),
+async def login(
+    db: AsyncSession = Depends(get_async_db),
     form_data: OAuth2PasswordRequestForm = Depends(),
 ):
-    user = crud.get_user_by_email(db, form_data.username)
-    if user is None or not user.is_valid_(form_data.password):
+    user = await db.run_sync(crud.get_user_by_email, form_data.username)
+    is_valid, new_hashed_password = (
+        await hashing.verify_password(form_data.password, user.password)
+        if user is not None
+        else (False, None)
+    )
+    if not is_valid:
         raise HTTPException(
             status_code=400, detail="Incorrect email or password"
         )
-    return {
+    tokens = {
         "user_id": user.id,
         "access_token": utils.create_access_token(user.email),
         "refresh_token": utils.create_refresh_token(user.email),
     }
+    if new_hashed_password is not None:
+        await db.run_sync(crud.update_user_password, user, new_hashed_password)
+    return tokens
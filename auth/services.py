@@ -0,0 +1,42 @@
+import os
+
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import User
+from cache import LRUCache
+from metrics import register_metrics
+
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 1024))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", 60))  # seconds
+
+# Cache of token subject (user email) -> user column values
+principal_cache = LRUCache(
+    maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL
+)
+register_metrics("principal_cache", principal_cache.get_stats)
+
+
+def cache_principal(user: User) -> None:
+    """Caches column values of the given user by its email."""
+    principal_cache.set(
+        user.email,
+        {column.key: getattr(user, column.key) for column in User.__table__.c},
+    )
+
+
+def get_cached_principal(db: Session, email: str) -> User | None:
+    """Returns cached user attached to the given session without query."""
+    if (user_values := principal_cache.get(email)) is None:
+        return None
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in user_values.items():
+        setattr(user, key, value)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
+
+def invalidate_principal(*emails: str) -> None:
+    """Removes cached users with the given emails."""
+    for email in emails:
+        principal_cache.delete(email)
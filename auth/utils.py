@@ -11,14 +11,29 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60  # 60 minutes
 REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 JWT_SECRET_KEY = str(os.getenv("JWT_SECRET_KEY"))
 JWT_REFRESH_SECRET_KEY = str(os.getenv("JWT_REFRESH_SECRET_KEY"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes with other cost factor are reported by 'needs_update'
+password_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 
 def get_hashed_password(password: str) -> str:
     return password_context.hash(password)
 
 
+def verify_and_update_password(
+    password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    """Verifies password and returns new hash if cost factor changed."""
+    return password_context.verify_and_update(password, hashed_password)
+
+
 def create_access_token(subject: str | Any, expires_delta: int = None) -> str:
     expires_delta = (
         datetime.utcnow() + expires_delta
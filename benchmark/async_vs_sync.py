@@ -0,0 +1,81 @@
+import json
+import time
+import asyncio
+import argparse
+from typing import Awaitable, Callable
+
+from anyio import to_thread
+
+from blog import crud
+from pagination import PageParams
+from db import SessionLocal, AsyncSessionLocal
+from benchmark.utils import get_latency_stats
+
+
+def _read_home_page_with_sync_session() -> None:
+    """Reads first page of posts like a sync 'def' route handler."""
+    db = SessionLocal()
+    try:
+        crud.get_all_posts(db, None, PageParams())
+    finally:
+        db.close()
+
+
+async def _read_home_page_in_threadpool() -> None:
+    """Reads first page of posts in Starlette's threadpool (sync mode)."""
+    await to_thread.run_sync(_read_home_page_with_sync_session)
+
+
+async def _read_home_page_with_async_session() -> None:
+    """Reads first page of posts with async session (async mode)."""
+    async with AsyncSessionLocal() as db:
+        await db.run_sync(crud.get_all_posts, None, PageParams())
+
+
+async def _measure(
+    read_page: Callable[[], Awaitable], requests: int, concurrency: int
+) -> dict:
+    """Returns throughput and latency percentiles of given read function."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def run_request() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await read_page()
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_request() for _ in range(requests)))
+    duration = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        **get_latency_stats(latencies, duration),
+    }
+
+
+async def compare(requests: int, concurrency: int) -> dict:
+    """Returns measurements of sync and async database modes."""
+    return {
+        "sync": await _measure(
+            _read_home_page_in_threadpool, requests, concurrency
+        ),
+        "async": await _measure(
+            _read_home_page_with_async_session, requests, concurrency
+        ),
+    }
+
+
+def main() -> None:
+    """Prints JSON comparison of sync and async database modes."""
+    parser = argparse.ArgumentParser(
+        description="Compares sync and async database modes"
+    )
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(compare(args.requests, args.concurrency))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import re
+import os
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+
+import models
+from db import Base
+from blog import crud as blog_crud, schemas as blog_schemas
+from blog.tag_index import tag_index
+from user import crud as user_crud, schemas as user_schemas, feed
+from pagination import PageParams, paginate
+from migrations import migrate
+from benchmark.seed import seed
+
+# SQLite plan step reading whole table (not searching by index)
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+
+
+@dataclass
+class Case:
+    """Checked function and tables it may scan (e.g. keyset pagination by
+    primary key of the whole table)."""
+
+    name: str
+    run: Callable[[Session], Any]
+    allowed_scans: set[str] = field(default_factory=set)
+
+
+def _get_table_name_from_(name: str) -> str | None:
+    """Returns name of table by its name or alias (e.g. 'users_1') in plan
+    or None for subqueries."""
+    for table_name in (name, re.sub(r"_\d+$", "", name)):
+        if table_name in Base.metadata.tables:
+            return table_name
+    return None
+
+
+class QueryPlanRecorder:
+    """Records full table scans in plans of statements executed by engine."""
+
+    def __init__(self, engine) -> None:
+        """Starts explaining statements of given engine."""
+        self.full_scans = []
+        event.listen(engine, "before_cursor_execute", self._explain)
+
+    def _explain(self, conn, cursor, statement, params, context, many):
+        """Records full table scans of statement plan."""
+        if many or not statement.lstrip().upper().startswith(
+            ("SELECT", "UPDATE", "DELETE")
+        ):
+            return
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", params)
+        for row in cursor.fetchall():
+            if (match := FULL_SCAN.match(row[3])) and (
+                table := _get_table_name_from_(match[1])
+            ):
+                self.full_scans.append((table, " ".join(statement.split())))
+
+    def reset(self) -> list[tuple[str, str]]:
+        """Returns recorded full scans and forgets them."""
+        full_scans, self.full_scans = self.full_scans, []
+        return full_scans
+
+
+def _get_cases(db: Session) -> list[Case]:
+    """Returns cases covering queries of blog and user crud."""
+    post = db.query(models.Post).filter(models.Post.comment_count > 0).first()
+    comment = post.comments.first()
+    # Liking user follows author of post in feed cases
+    like = (
+        db.query(models.Like)
+        .filter(models.Like.user_id != post.user_id)
+        .first()
+    )
+    user = post.user
+    tag = post.tags[0]
+    other_tag = db.query(models.Tag).filter(models.Tag.id != tag.id).first()
+    page = PageParams(limit=5)
+    like_schema = blog_schemas.LikeSchema(
+        post_id=post.id, user_id=post.user_id
+    )
+    post_schema = blog_schemas.PostSchema(
+        title="Query plans", body="body", tags=f"{tag.title}, plans"
+    )
+    return [
+        Case(
+            "blog.get_all_posts",
+            lambda db: blog_crud.get_all_posts(db, None, page),
+            {"posts"},
+        ),
+        Case(
+            "blog.get_all_posts(summary)",
+            lambda db: blog_crud.get_all_posts(db, None, page, summary=True),
+            {"posts"},
+        ),
+        Case(
+            "blog.get_all_posts(search)",
+            lambda db: blog_crud.get_all_posts(db, "python", page),
+        ),
+        Case(
+            "blog.get_all_tags",
+            lambda db: blog_crud.get_all_tags(db, None, page),
+            {"tags"},
+        ),
+        Case(
+            "blog.get_all_tags(search)",
+            lambda db: blog_crud.get_all_tags(db, tag.title[:2], page),
+        ),
+        Case(
+            "blog.get_all_posts_by_tags(all)",
+            lambda db: blog_crud.get_all_posts_by_tags(
+                db, f"{tag.slug},{other_tag.slug}", "all", None, page
+            ),
+        ),
+        Case(
+            "blog.get_all_posts_by_tags(any, exclude)",
+            lambda db: blog_crud.get_all_posts_by_tags(
+                db, tag.slug, "any", other_tag.slug, page, summary=True
+            ),
+        ),
+        Case(
+            "blog.get_post_by_slug",
+            lambda db: blog_crud.get_post_by_slug(db, post.slug),
+        ),
+        Case(
+            "blog.get_post_id_by_slug",
+            lambda db: blog_crud.get_post_id_by_slug(db, post.slug),
+        ),
+        Case(
+            "blog.get_tag_by_slug",
+            lambda db: blog_crud.get_tag_by_slug(db, tag.slug),
+        ),
+        Case(
+            "blog.get_all_post_comments",
+            lambda db: blog_crud.get_all_post_comments(db, post.slug, page),
+        ),
+        Case(
+            "blog.get_all_post_likes",
+            lambda db: blog_crud.get_all_post_likes(db, post.slug, page),
+        ),
+        Case(
+            "blog.get_all_posts_by_tag_slug",
+            lambda db: blog_crud.get_all_posts_by_tag_slug(
+                db, tag.slug, page, summary=True
+            ),
+        ),
+        Case(
+            "user.get_user_by_id",
+            lambda db: user_crud.get_user_by_id(db, user.id),
+        ),
+        Case(
+            "user.get_avatar_by_username",
+            lambda db: user_crud.get_avatar_by_username(db, user.username),
+        ),
+        Case(
+            "user.get_user_id_by_username",
+            lambda db: user_crud.get_user_id_by_username(db, user.username),
+        ),
+        Case(
+            "user posts tab",
+            lambda db: paginate(
+                db.query(models.Post).filter(models.Post.user_id == user.id),
+                models.Post.id,
+                page,
+            ),
+        ),
+        Case(
+            "user comments tab",
+            lambda db: paginate(
+                db.query(models.Comment).filter(
+                    models.Comment.user_id == user.id
+                ),
+                models.Comment.id,
+                page,
+            ),
+        ),
+        Case(
+            "user likes tab",
+            lambda db: paginate(
+                db.query(models.Like).filter(models.Like.user_id == user.id),
+                models.Like.id,
+                page,
+            ),
+        ),
+        Case(
+            "user.get_user_profile",
+            lambda db: user_crud.get_user_profile(db, user.username, 5),
+        ),
+        Case(
+            "feed.follow_tag",
+            lambda db: feed.follow_tag(db, like.user_id, tag.slug),
+        ),
+        Case(
+            "feed.follow_user",
+            lambda db: feed.follow_user(db, like.user_id, user.username),
+        ),
+        Case(
+            "feed.get_feed",
+            lambda db: feed.get_feed(db, like.user_id, page, summary=True),
+        ),
+        Case(
+            "blog.create_post",
+            lambda db: blog_crud.create_post(
+                db, post_schema.model_copy(update={"user_id": user.id})
+            ),
+        ),
+        Case(
+            "blog.update_post",
+            lambda db: blog_crud.update_post(
+                db, "query-plans", post_schema, user.id
+            ),
+        ),
+        Case(
+            "blog.create_comment",
+            lambda db: blog_crud.create_comment(
+                db,
+                blog_schemas.CommentSchema(
+                    body="plan", post_id=post.id, user_id=user.id
+                ),
+            ),
+        ),
+        Case(
+            "blog.update_comment",
+            lambda db: blog_crud.update_comment(
+                db,
+                blog_schemas.CommentUpdateSchema(id=comment.id, body="plan"),
+                comment.user_id,
+            ),
+        ),
+        Case(
+            "blog.delete_comment",
+            lambda db: blog_crud.delete_comment(
+                db, comment.id, comment.user_id
+            ),
+        ),
+        Case(
+            "blog.create_like",
+            lambda db: blog_crud.create_like(db, like_schema),
+        ),
+        Case(
+            "blog.create_like(repeated)",
+            lambda db: blog_crud.create_like(db, like_schema),
+        ),
+        Case(
+            "blog.delete_like",
+            lambda db: blog_crud.delete_like(db, like_schema, post.user_id),
+        ),
+        Case(
+            "blog.delete_post",
+            lambda db: blog_crud.delete_post(db, "query-plans", user.id),
+        ),
+        Case(
+            "user.update_user_avatar",
+            lambda db: user_crud.update_user_avatar(
+                db, like.user.username, "media/avatars/plan.png"
+            ),
+        ),
+        Case(
+            "user.update_user",
+            lambda db: user_crud.update_user(
+                db,
+                like.user.username,
+                user_schemas.UserSchema(
+                    username="plans",
+                    email="plans@example.com",
+                    password="password",
+                ),
+                hashed_password=like.user.password,
+            ),
+        ),
+        Case(
+            "user.delete_user_by_username",
+            lambda db: user_crud.delete_user_by_username(db, "plans"),
+        ),
+    ]
+
+
+def check_query_plans() -> list[tuple[str, str, str]]:
+    """Returns unexpected full scans (case, table, statement) of queries of
+    blog and user crud run against seeded temporary SQLite database."""
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(
+            f"sqlite:///{os.path.join(directory, 'plans.db')}"
+        )
+        migrate(engine)
+        with Session(engine, autoflush=False) as db:
+            seed(db, users=50, posts=200, tags=20, comments=500, likes=500)
+            # Tag index is filled at startup (and refreshed in background)
+            tag_index.rebuild(db)
+            cases = _get_cases(db)
+            recorder = QueryPlanRecorder(engine)
+            unexpected_scans = []
+            for case in cases:
+                case.run(db)
+                unexpected_scans.extend(
+                    (case.name, table, statement)
+                    for table, statement in recorder.reset()
+                    if table not in case.allowed_scans
+                )
+        engine.dispose()
+    return unexpected_scans
+
+
+def main() -> None:
+    """Prints unexpected full table scans and exits with error if any."""
+    unexpected_scans = check_query_plans()
+    for case_name, table, statement in unexpected_scans:
+        print(f"{case_name}: full scan of '{table}' in {statement}")
+    if unexpected_scans:
+        sys.exit(1)
+    print("No unexpected full table scans.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,479 @@
+import io
+import os
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+import httpx
+from PIL import Image
+
+# Benchmark client sends all requests, so it must not be rate limited
+for _route_class in ("AUTH", "WRITE", "READ"):
+    os.environ.setdefault(f"RATE_LIMIT_{_route_class}", "0")
+
+import models
+from main import app
+from db import SessionLocal, engine, async_engine, replica_engines
+from response_cache import response_cache
+from benchmark.seed import SEED_PASSWORD, WORDS
+from benchmark.utils import QueryCounter, get_latency_stats
+
+
+@dataclass
+class BenchmarkData:
+    """Seeded data and objects created by write endpoints."""
+
+    run_id: int
+    user_id: int
+    headers: dict
+    usernames: list[str]
+    post_slugs: list[str]
+    tag_slugs: list[str]
+    avatar: bytes
+    created_post_slugs: list[str] = field(default_factory=list)
+    created_post_ids: list[int] = field(default_factory=list)
+    created_comment_ids: list[int] = field(default_factory=list)
+    avatar_file_names: list[str] = field(default_factory=list)
+    signup_headers: list[dict] = field(default_factory=list)
+
+
+@dataclass
+class Endpoint:
+    """Benchmarked route and function sending its i-th request."""
+
+    name: str
+    send: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+def _get_avatar_image() -> bytes:
+    """Returns small PNG image for avatar uploads."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 300), "steelblue").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _load_seeded_data(sample_size: int) -> dict:
+    """Returns samples of seeded usernames and post and tag slugs."""
+    db = SessionLocal()
+    try:
+        return {
+            "usernames": [
+                username
+                for (username,) in db.query(models.User.username).limit(
+                    sample_size
+                )
+            ],
+            "post_slugs": [
+                slug
+                for (slug,) in db.query(models.Post.slug)
+                .order_by(models.Post.like_count.desc())
+                .limit(sample_size)
+            ],
+            "tag_slugs": [
+                slug
+                for (slug,) in db.query(models.Tag.slug).limit(sample_size)
+            ],
+        }
+    finally:
+        db.close()
+
+
+async def _prepare_data(client: httpx.AsyncClient) -> BenchmarkData:
+    """Logs in as the first seeded user and loads seeded data samples."""
+    response = await client.post(
+        "/api/auth/login",
+        data={"username": "user0@example.com", "password": SEED_PASSWORD},
+    )
+    if response.status_code != 200:
+        raise SystemExit("Seed the database first: python -m benchmark.seed")
+    tokens = response.json()
+    return BenchmarkData(
+        run_id=int(time.time()),
+        user_id=tokens["user_id"],
+        headers={"Authorization": f"Bearer {tokens['access_token']}"},
+        avatar=_get_avatar_image(),
+        **_load_seeded_data(sample_size=100),
+    )
+
+
+def _get_endpoints(data: BenchmarkData) -> list[Endpoint]:
+    """Returns endpoints of all routers in order respecting dependencies
+    between write endpoints."""
+    pick = lambda items, i: items[i % len(items)]
+    bench_user = lambda i: f"bench{data.run_id}_{i}"
+
+    async def signup(client, i):
+        return await client.post(
+            "/api/auth/signup",
+            json={
+                "username": bench_user(i),
+                "email": f"{bench_user(i)}@example.com",
+                "password": SEED_PASSWORD,
+            },
+        )
+
+    async def login(client, i):
+        response = await client.post(
+            "/api/auth/login",
+            data={
+                "username": f"{bench_user(i)}@example.com",
+                "password": SEED_PASSWORD,
+            },
+        )
+        token = response.json().get("access_token")
+        data.signup_headers.append({"Authorization": f"Bearer {token}"})
+        return response
+
+    async def create_post(client, i):
+        response = await client.post(
+            "/api/blog/post",
+            json={
+                "title": f"Benchmark {data.run_id} {i}",
+                "body": " ".join(WORDS),
+                "tags": ", ".join(WORDS[i % 5 : i % 5 + 3]),
+            },
+            headers=data.headers,
+        )
+        data.created_post_slugs.append(response.json()["slug"])
+        data.created_post_ids.append(response.json()["id"])
+        return response
+
+    async def update_avatar(client, i):
+        response = await client.put(
+            "/api/user/me/avatar",
+            files={"file": ("avatar.png", data.avatar, "image/png")},
+            headers=data.headers,
+        )
+        # Avatar path is returned, while avatar files are served by name
+        data.avatar_file_names.append(
+            os.path.basename(response.json()["avatar"])
+        )
+        return response
+
+    async def create_comment(client, i):
+        response = await client.post(
+            "/api/blog/comment",
+            json={
+                "body": "benchmark",
+                "post_id": pick(data.created_post_ids, i),
+            },
+            headers=data.headers,
+        )
+        data.created_comment_ids.append(response.json()["id"])
+        return response
+
+    return [
+        Endpoint("POST /api/auth/signup", signup),
+        Endpoint("POST /api/auth/login", login),
+        Endpoint(
+            "GET /api/blog/",
+            lambda client, i: client.get("/api/blog/"),
+        ),
+        Endpoint(
+            "GET /api/blog/?summary=true",
+            lambda client, i: client.get("/api/blog/?summary=true"),
+        ),
+        Endpoint(
+            "GET /api/blog/?tab=tags",
+            lambda client, i: client.get("/api/blog/?tab=tags"),
+        ),
+        Endpoint(
+            "GET /api/blog/?tags=",
+            lambda client, i: client.get(
+                f"/api/blog/?tags={pick(data.tag_slugs, i)},"
+                f"{pick(data.tag_slugs, i + 1)}"
+                f"&mode={pick(('any', 'all'), i)}&summary=true"
+            ),
+        ),
+        Endpoint(
+            "GET /api/blog/?q=",
+            lambda client, i: client.get(f"/api/blog/?q={pick(WORDS, i)}"),
+        ),
+        Endpoint(
+            "GET /api/blog/post/{slug}",
+            lambda client, i: client.get(
+                f"/api/blog/post/{pick(data.post_slugs, i)}"
+            ),
+        ),
+        Endpoint(
+            "GET /api/blog/post/{slug}/comments",
+            lambda client, i: client.get(
+                f"/api/blog/post/{pick(data.post_slugs, i)}/comments"
+            ),
+        ),
+        Endpoint(
+            "GET /api/blog/post/{slug}/likes",
+            lambda client, i: client.get(
+                f"/api/blog/post/{pick(data.post_slugs, i)}/likes"
+            ),
+        ),
+        Endpoint(
+            "GET /api/blog/tag/{slug}",
+            lambda client, i: client.get(
+                f"/api/blog/tag/{pick(data.tag_slugs, i)}"
+            ),
+        ),
+        Endpoint(
+            "GET /api/user/{username}",
+            lambda client, i: client.get(
+                f"/api/user/{pick(data.usernames, i)}"
+                f"?tab={pick(('overview', 'posts', 'comments', 'likes'), i)}"
+            ),
+        ),
+        Endpoint(
+            "GET /api/user/{username}/profile",
+            lambda client, i: client.get(
+                f"/api/user/{pick(data.usernames, i)}/profile"
+            ),
+        ),
+        Endpoint(
+            "GET /api/user/me",
+            lambda client, i: client.get(
+                "/api/user/me?tab=posts", headers=data.headers
+            ),
+        ),
+        Endpoint(
+            "GET /api/user/me/feed",
+            lambda client, i: client.get(
+                "/api/user/me/feed?summary=true", headers=data.headers
+            ),
+        ),
+        Endpoint("PUT /api/user/me/avatar", update_avatar),
+        Endpoint(
+            "GET /api/user/avatars/{file_name}",
+            lambda client, i: client.get(
+                f"/api/user/avatars/{pick(data.avatar_file_names, i)}"
+            ),
+        ),
+        Endpoint(
+            "GET /api/user/me/avatar",
+            lambda client, i: client.get(
+                f"/api/user/me/avatar?id={data.user_id}"
+            ),
+        ),
+        Endpoint(
+            "GET /api/user/{username}/avatar",
+            lambda client, i: client.get("/api/user/user0/avatar?size=64"),
+        ),
+        Endpoint("POST /api/blog/post", create_post),
+        Endpoint(
+            "PUT /api/blog/post/{slug}",
+            lambda client, i: client.put(
+                f"/api/blog/post/{pick(data.created_post_slugs, i)}",
+                json={
+                    "title": f"Benchmark {data.run_id} {i}",
+                    "body": " ".join(reversed(WORDS)),
+                    "tags": ", ".join(WORDS[:3]),
+                },
+                headers=data.headers,
+            ),
+        ),
+        Endpoint("POST /api/blog/comment", create_comment),
+        Endpoint(
+            "PUT /api/blog/comment",
+            lambda client, i: client.put(
+                "/api/blog/comment",
+                json={
+                    "id": pick(data.created_comment_ids, i),
+                    "body": "updated",
+                },
+                headers=data.headers,
+            ),
+        ),
+        Endpoint(
+            "DELETE /api/blog/comment",
+            lambda client, i: client.request(
+                "DELETE",
+                "/api/blog/comment",
+                json={"id": data.created_comment_ids[i]},
+                headers=data.headers,
+            ),
+        ),
+        Endpoint(
+            "POST /api/blog/like",
+            lambda client, i: client.post(
+                "/api/blog/like",
+                json={
+                    "post_id": data.created_post_ids[i],
+                    "user_id": data.user_id,
+                },
+                headers=data.headers,
+            ),
+        ),
+        Endpoint(
+            "DELETE /api/blog/like",
+            lambda client, i: client.request(
+                "DELETE",
+                "/api/blog/like",
+                json={
+                    "post_id": data.created_post_ids[i],
+                    "user_id": data.user_id,
+                },
+                headers=data.headers,
+            ),
+        ),
+        Endpoint(
+            "DELETE /api/blog/post/{slug}",
+            lambda client, i: client.delete(
+                f"/api/blog/post/{data.created_post_slugs[i]}",
+                headers=data.headers,
+            ),
+        ),
+        Endpoint(
+            "POST /api/user/me/following/tags/{slug}",
+            lambda client, i: client.post(
+                f"/api/user/me/following/tags/{pick(data.tag_slugs, i)}",
+                headers=data.signup_headers[i],
+            ),
+        ),
+        Endpoint(
+            "DELETE /api/user/me/following/tags/{slug}",
+            lambda client, i: client.delete(
+                f"/api/user/me/following/tags/{pick(data.tag_slugs, i)}",
+                headers=data.signup_headers[i],
+            ),
+        ),
+        Endpoint(
+            "POST /api/user/me/following/users/{username}",
+            lambda client, i: client.post(
+                f"/api/user/me/following/users/{pick(data.usernames, i)}",
+                headers=data.signup_headers[i],
+            ),
+        ),
+        Endpoint(
+            "DELETE /api/user/me/following/users/{username}",
+            lambda client, i: client.delete(
+                f"/api/user/me/following/users/{pick(data.usernames, i)}",
+                headers=data.signup_headers[i],
+            ),
+        ),
+        Endpoint(
+            "PUT /api/user/me",
+            lambda client, i: client.put(
+                "/api/user/me",
+                json={
+                    "username": f"{bench_user(i)}_renamed",
+                    "email": f"{bench_user(i)}@example.com",
+                    "password": SEED_PASSWORD,
+                },
+                headers=data.signup_headers[i],
+            ),
+        ),
+        Endpoint(
+            "DELETE /api/user/me",
+            lambda client, i: client.delete(
+                "/api/user/me", headers=data.signup_headers[i]
+            ),
+        ),
+    ]
+
+
+async def _bypass_response_cache(request: httpx.Request) -> None:
+    """Adds unique query parameter to request, so its response isn't found
+    in response cache ('request' event hook)."""
+    request.url = request.url.copy_add_param(
+        "benchmark_nocache", time.perf_counter_ns()
+    )
+
+
+async def _run_endpoint(
+    client: httpx.AsyncClient,
+    endpoint: Endpoint,
+    requests: int,
+    concurrency: int,
+    query_counter: QueryCounter,
+) -> dict:
+    """Returns throughput, latency percentiles, query count and response
+    cache hits and misses of given endpoint."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+
+    async def run_request(i: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await endpoint.send(client, i)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status_code] += 1
+
+    query_counter.reset()
+    cache_stats = response_cache.get_stats()
+    started = time.perf_counter()
+    await asyncio.gather(*(run_request(i) for i in range(requests)))
+    duration = time.perf_counter() - started
+    new_cache_stats = response_cache.get_stats()
+    return {
+        **get_latency_stats(latencies, duration),
+        "queries_per_request": query_counter.reset() / requests,
+        "response_cache_hits": new_cache_stats["hits"] - cache_stats["hits"],
+        "response_cache_misses": (
+            new_cache_stats["misses"] - cache_stats["misses"]
+        ),
+        "statuses": {str(status): count for status, count in statuses.items()},
+    }
+
+
+async def run(requests: int, concurrency: int) -> dict:
+    """Returns measurements of all endpoints (cached ones are measured
+    again with every request missing response cache)."""
+    query_counter = QueryCounter(
+        engine,
+        async_engine.sync_engine,
+        *(replica_engine.sync_engine for replica_engine in replica_engines),
+    )
+    # Startup handlers build tag index and start like buffer and hashing pool
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+        app=app, base_url="http://benchmark"
+    ) as client, httpx.AsyncClient(
+        app=app,
+        base_url="http://benchmark",
+        event_hooks={"request": [_bypass_response_cache]},
+    ) as uncached_client:
+        data = await _prepare_data(client)
+        results = {}
+        for endpoint in _get_endpoints(data):
+            is_read = endpoint.name.startswith("GET")
+            # Write endpoints depend on objects created by previous ones
+            results[endpoint.name] = await _run_endpoint(
+                client,
+                endpoint,
+                requests,
+                concurrency if is_read else 1,
+                query_counter,
+            )
+            if is_read and results[endpoint.name]["response_cache_hits"]:
+                results[f"{endpoint.name} (cache miss)"] = await _run_endpoint(
+                    uncached_client,
+                    endpoint,
+                    requests,
+                    concurrency,
+                    query_counter,
+                )
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "endpoints": results,
+    }
+
+
+def main() -> None:
+    """Benchmarks all endpoints against DATABASE_URL and prints JSON."""
+    parser = argparse.ArgumentParser(description="Benchmarks all endpoints")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--output", help="Path of JSON report file")
+    args = parser.parse_args()
+
+    report = json.dumps(asyncio.run(run(args.requests, args.concurrency)))
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import json
+import random
+import argparse
+from collections import defaultdict
+from itertools import accumulate
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+import models
+from db import SessionLocal, engine
+from migrations import migrate
+from auth.utils import get_hashed_password
+from blog.search import rebuild_search_index
+from blog.services import set_post_summary
+from user.feed import FEED_LENGTH, _add_timeline_entries
+
+
+SEED_PASSWORD = "password"
+ZIPF_EXPONENT = 1.1  # the bigger the exponent, the stronger the skew
+WORDS = (
+    "python fastapi sqlalchemy async database index cache query api "
+    "server client request response latency throughput worker thread "
+    "process memory disk network linux docker deploy test benchmark "
+    "frontend backend javascript react vue css html design pattern "
+    "refactor review commit branch merge release security token auth"
+).split()
+
+
+def _get_zipf_weights(count: int) -> list[float]:
+    """Returns cumulative Zipf weights (rank 1 is the most popular)."""
+    return list(
+        accumulate(1 / (rank**ZIPF_EXPONENT) for rank in range(1, count + 1))
+    )
+
+
+def _get_text(rng: random.Random, words: int) -> str:
+    """Returns random text with given number of words."""
+    return " ".join(rng.choices(WORDS, k=words))
+
+
+def _create_users(db: Session, count: int) -> list[models.User]:
+    """Creates users sharing one precomputed password hash."""
+    hashed_password = get_hashed_password(SEED_PASSWORD)
+    users = [
+        models.User(
+            username=f"user{i}",
+            email=f"user{i}@example.com",
+            password=SEED_PASSWORD,
+            hashed_password=hashed_password,
+        )
+        for i in range(count)
+    ]
+    db.add_all(users)
+    db.flush()
+    return users
+
+
+def _create_tags(db: Session, count: int) -> list[models.Tag]:
+    """Creates tags."""
+    tags = [
+        models.Tag(title=f"{WORDS[i % len(WORDS)]}{i}") for i in range(count)
+    ]
+    db.add_all(tags)
+    db.flush()
+    return tags
+
+
+def _create_posts(
+    db: Session,
+    rng: random.Random,
+    count: int,
+    users: list[models.User],
+    tags: list[models.Tag],
+) -> list[models.Post]:
+    """Creates posts of skewed authors with skewed tags."""
+    user_weights = _get_zipf_weights(len(users))
+    tag_weights = _get_zipf_weights(len(tags))
+    now = datetime.today()
+    posts = []
+    for i in range(count):
+        post = models.Post(
+            title=f"{_get_text(rng, 4)} {i}".capitalize(),
+            body=_get_text(rng, rng.randint(50, 1500)),
+            user_id=rng.choices(users, cum_weights=user_weights)[0].id,
+            created=now - timedelta(minutes=count - i),
+        )
+        set_post_summary(post)
+        post.tags = list(
+            {
+                tag.id: tag
+                for tag in rng.choices(
+                    tags, cum_weights=tag_weights, k=rng.randint(1, 4)
+                )
+            }.values()
+        )
+        posts.append(post)
+    db.add_all(posts)
+    db.flush()
+    return posts
+
+
+def _create_comments(
+    db: Session,
+    rng: random.Random,
+    count: int,
+    users: list[models.User],
+    posts: list[models.Post],
+) -> None:
+    """Creates comments concentrated on popular posts."""
+    user_weights = _get_zipf_weights(len(users))
+    post_weights = _get_zipf_weights(len(posts))
+    for _ in range(count):
+        post = rng.choices(posts, cum_weights=post_weights)[0]
+        post.comment_count += 1
+        db.add(
+            models.Comment(
+                body=_get_text(rng, rng.randint(5, 60)),
+                post_id=post.id,
+                user_id=rng.choices(users, cum_weights=user_weights)[0].id,
+            )
+        )
+    db.flush()
+
+
+def _create_likes(
+    db: Session,
+    rng: random.Random,
+    count: int,
+    users: list[models.User],
+    posts: list[models.Post],
+) -> None:
+    """Creates unique likes concentrated on popular posts."""
+    post_weights = _get_zipf_weights(len(posts))
+    count = min(count, len(users) * len(posts))
+    likes = set()
+    while len(likes) < count:
+        post = rng.choices(posts, cum_weights=post_weights)[0]
+        likes.add((rng.choice(users).id, post))
+    for user_id, post in likes:
+        post.like_count += 1
+        db.add(models.Like(user_id=user_id, post_id=post.id))
+    db.flush()
+
+
+def _create_follows(
+    db: Session,
+    rng: random.Random,
+    count: int,
+    users: list[models.User],
+    tags: list[models.Tag],
+    posts: list[models.Post],
+) -> int:
+    """Makes each user follow up to count popular tags and authors (half
+    of each), fills their timelines and returns number of follows."""
+    user_weights = _get_zipf_weights(len(users))
+    tag_weights = _get_zipf_weights(len(tags))
+    tag_follows, user_follows = set(), set()
+    for user in users:
+        for tag in rng.choices(tags, cum_weights=tag_weights, k=count // 2):
+            tag_follows.add((user.id, tag))
+        for author in rng.choices(
+            users, cum_weights=user_weights, k=count - count // 2
+        ):
+            if author.id != user.id:
+                user_follows.add((user.id, author.id))
+    for _, tag in tag_follows:
+        tag.follower_count += 1
+    if tag_follows:
+        db.execute(
+            models.tag_follows.insert(),
+            [
+                {"user_id": user_id, "tag_id": tag.id}
+                for user_id, tag in tag_follows
+            ],
+        )
+    if user_follows:
+        db.execute(
+            models.user_follows.insert(),
+            [
+                {"follower_id": follower_id, "followed_id": followed_id}
+                for follower_id, followed_id in user_follows
+            ],
+        )
+    # Timelines hold the newest posts of followed tags and authors
+    followed_tag_ids, followed_user_ids = defaultdict(set), defaultdict(set)
+    for user_id, tag in tag_follows:
+        followed_tag_ids[user_id].add(tag.id)
+    for follower_id, followed_id in user_follows:
+        followed_user_ids[follower_id].add(followed_id)
+    for user in users:
+        post_ids = [
+            post.id
+            for post in reversed(posts)
+            if post.user_id in followed_user_ids[user.id]
+            or any(tag.id in followed_tag_ids[user.id] for tag in post.tags)
+        ][:FEED_LENGTH]
+        _add_timeline_entries(db, {(user.id, post_id) for post_id in post_ids})
+    db.flush()
+    return len(tag_follows) + len(user_follows)
+
+
+def seed(
+    db: Session,
+    users: int,
+    posts: int,
+    tags: int,
+    comments: int,
+    likes: int,
+    follows: int = 0,
+    seed: int = 0,
+) -> dict:
+    """Fills database with synthetic dataset and returns its size."""
+    rng = random.Random(seed)
+    user_models = _create_users(db, users)
+    tag_models = _create_tags(db, tags)
+    post_models = _create_posts(db, rng, posts, user_models, tag_models)
+    _create_comments(db, rng, comments, user_models, post_models)
+    _create_likes(db, rng, likes, user_models, post_models)
+    follow_count = _create_follows(
+        db, rng, follows, user_models, tag_models, post_models
+    )
+    db.commit()
+    rebuild_search_index(db)
+    return {
+        "users": users,
+        "posts": posts,
+        "tags": tags,
+        "comments": comments,
+        "likes": min(likes, users * posts),
+        "follows": follow_count,
+    }
+
+
+def main() -> None:
+    """Seeds database from DATABASE_URL and prints dataset size."""
+    parser = argparse.ArgumentParser(description="Seeds synthetic dataset")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--tags", type=int, default=100)
+    parser.add_argument("--comments", type=int, default=10000)
+    parser.add_argument("--likes", type=int, default=20000)
+    parser.add_argument(
+        "--follows", type=int, default=10, help="Follows per user"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    migrate(engine)
+    db = SessionLocal()
+    try:
+        print(json.dumps(seed(db, **vars(args))))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
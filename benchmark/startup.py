@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+
+
+# Measures cold start of the app in fresh interpreter and prints JSON
+_FIRST_REQUEST_CODE = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    ready = time.perf_counter()
+    status = client.get("/api/blog/").status_code
+    responded = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "first_request_ms": (responded - ready) * 1000,
+    "time_to_first_request_ms": (responded - started) * 1000,
+    "status": status,
+}))
+"""
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess:
+    """Runs fresh Python interpreter in project directory."""
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=PROJECT_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def get_import_times(top: int) -> list[dict]:
+    """Returns modules imported by 'main' with the longest cumulative import
+    times (in milliseconds) reported by '-X importtime'."""
+    import_times = []
+    for line in _run_python(
+        "-X", "importtime", "-c", "import main"
+    ).stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split(
+            "|"
+        )
+        import_times.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    import_times.sort(key=lambda item: item["cumulative_ms"], reverse=True)
+    return import_times[:top]
+
+
+def get_time_to_first_request(runs: int) -> dict:
+    """Returns median import, startup and first request times (in
+    milliseconds) of given number of cold starts."""
+    results = [
+        json.loads(
+            _run_python("-c", _FIRST_REQUEST_CODE).stdout.splitlines()[-1]
+        )
+        for _ in range(runs)
+    ]
+    return {
+        key: median(result[key] for result in results)
+        for key in results[0]
+        if key != "status"
+    } | {"statuses": sorted({result["status"] for result in results})}
+
+
+def main() -> None:
+    """Profiles cold start of the app against DATABASE_URL and prints
+    JSON."""
+    parser = argparse.ArgumentParser(description="Profiles app cold start")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    print(
+        json.dumps(
+            {
+                "runs": args.runs,
+                "cold_start": get_time_to_first_request(args.runs),
+                "slowest_imports": get_import_times(args.top),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+from statistics import quantiles
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def get_latency_stats(latencies: list[float], duration: float) -> dict:
+    """Returns throughput and latency percentiles (in milliseconds)."""
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100)
+        p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else None
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / duration if duration else None,
+        "p50_ms": p50,
+        "p95_ms": p95,
+        "p99_ms": p99,
+    }
+
+
+class QueryCounter:
+    """Counts SQL statements executed by given engines."""
+
+    def __init__(self, *engines: Engine) -> None:
+        """Starts counting statements of given engines."""
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs) -> None:
+        """Counts executed statement."""
+        self.count += 1
+
+    def reset(self) -> int:
+        """Resets counter and returns previous count."""
+        count, self.count = self.count, 0
+        return count
@@ -0,0 +1,282 @@
+import os
+import json
+from itertools import chain
+from collections import Counter
+from typing import AsyncIterator, Callable
+
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.exceptions import HTTPException
+
+import models
+from user import feed
+from blog import schemas, services, search
+from response_cache import invalidate_responses
+
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 500))
+IMPORT_MAX_LINE_SIZE = int(os.getenv("IMPORT_MAX_LINE_SIZE", 1024 * 1024))
+IMPORT_MAX_ERRORS = 1000  # the rest of errors are only counted
+
+IMPORT_SCHEMAS = {
+    "post": schemas.PostSchema,
+    "comment": schemas.CommentSchema,
+    "like": schemas.LikeSchema,
+}
+
+# (line number, record type, validated schema)
+ImportRecord = tuple[int, str, BaseModel]
+
+
+class ImportReport:
+    """Numbers of imported records and per-line errors of one import."""
+
+    def __init__(self) -> None:
+        """Creates empty report."""
+        self.imported = Counter()
+        self.errors = []
+        self.error_count = 0
+
+    def add_error(self, line: int, error: str) -> None:
+        """Records error of given line."""
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def to_dict(self) -> dict:
+        """Returns report as dictionary."""
+        return {
+            "imported": {
+                record_type: self.imported[record_type]
+                for record_type in IMPORT_SCHEMAS
+            },
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+async def _iter_lines_of_(
+    stream: AsyncIterator[bytes],
+) -> AsyncIterator[tuple[int, bytes]]:
+    """Yields numbered non-empty lines of streamed NDJSON body."""
+    buffer, line_number = b"", 0
+    async for chunk in stream:
+        *lines, buffer = (buffer + chunk).split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+        if len(buffer) > IMPORT_MAX_LINE_SIZE:
+            raise HTTPException(
+                status_code=413, detail=f"Line {line_number + 1} is too long"
+            )
+    if buffer.strip():
+        yield line_number + 1, buffer
+
+
+def _get_message_from_(error: ValidationError) -> str:
+    """Returns short message of given validation error."""
+    return "; ".join(
+        f"{'.'.join(map(str, detail['loc']))}: {detail['msg']}"
+        for detail in error.errors()
+    )
+
+
+def _parse_line(line: bytes, user_id: int) -> tuple[str, BaseModel]:
+    """Returns type and validated schema of record (owned by given user)
+    from NDJSON line or raises ValueError."""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        raise ValueError("Invalid JSON")
+    if not isinstance(data, dict):
+        raise ValueError("Line must be JSON object")
+    record_type = data.pop("type", None)
+    if record_type not in IMPORT_SCHEMAS:
+        raise ValueError(f"Type must be one of: {', '.join(IMPORT_SCHEMAS)}")
+    try:
+        return record_type, IMPORT_SCHEMAS[record_type](
+            **{**data, "user_id": user_id}
+        )
+    except ValidationError as error:
+        raise ValueError(_get_message_from_(error))
+
+
+def _insert_posts(
+    db: Session,
+    records: list[ImportRecord],
+    add_error: Callable[[int, str], None],
+) -> list[models.Post]:
+    """Inserts posts with tags resolved in one pass (in db transaction)."""
+    if not records:
+        return []
+    posts, tag_titles, slugs = [], {}, set()
+    for line, _, post_schema in records:
+        post = models.Post(**post_schema.dict(exclude={"tags"}))
+        if post.slug in slugs:
+            add_error(line, "Post with this title is already in import")
+            continue
+        slugs.add(post.slug)
+        services.set_post_summary(post)
+        tag_titles[line] = services._get_tag_titles_from_(
+            post_schema.tags or ""
+        )
+        posts.append((line, post))
+    existing_titles, existing_slugs = set(), set()
+    for title, slug in db.query(models.Post.title, models.Post.slug).filter(
+        models.Post.title.in_([post.title for _, post in posts])
+        | models.Post.slug.in_(slugs)
+    ):
+        existing_titles.add(title)
+        existing_slugs.add(slug)
+    tags = {
+        tag.title: tag
+        for tag in services.resolve_tags(
+            db, list(dict.fromkeys(chain.from_iterable(tag_titles.values())))
+        )
+    }
+    new_posts = []
+    for line, post in posts:
+        if post.title in existing_titles or post.slug in existing_slugs:
+            add_error(line, "Post with this title already exists")
+            continue
+        services.set_post_tags(
+            db,
+            post,
+            [tags[title] for title in tag_titles[line] if title in tags],
+        )
+        new_posts.append(post)
+    db.add_all(new_posts)
+    db.flush()
+    search.index_posts(db, new_posts)
+    feed.fan_out_posts(db, new_posts)
+    return new_posts
+
+
+def _get_existing_post_ids(db: Session, records: list[ImportRecord]) -> set:
+    """Returns ids of existing posts referenced by given records."""
+    return {
+        post_id
+        for (post_id,) in db.query(models.Post.id).filter(
+            models.Post.id.in_({schema.post_id for _, _, schema in records})
+        )
+    }
+
+
+def _insert_comments(
+    db: Session,
+    records: list[ImportRecord],
+    add_error: Callable[[int, str], None],
+) -> list[dict]:
+    """Inserts comments with one 'executemany' (in db transaction)."""
+    if not records:
+        return []
+    existing_post_ids = _get_existing_post_ids(db, records)
+    comments = []
+    for line, _, comment_schema in records:
+        if comment_schema.post_id not in existing_post_ids:
+            add_error(line, "Post not found")
+            continue
+        comments.append(comment_schema.dict())
+    if comments:
+        db.execute(insert(models.Comment), comments)
+    for post_id, count in Counter(
+        comment["post_id"] for comment in comments
+    ).items():
+        services.change_comment_count(db, post_id, count)
+    return comments
+
+
+def _insert_likes(
+    db: Session,
+    records: list[ImportRecord],
+    add_error: Callable[[int, str], None],
+) -> list[dict]:
+    """Inserts likes skipping already liked posts with one 'executemany'
+    (in db transaction)."""
+    if not records:
+        return []
+    existing_post_ids = _get_existing_post_ids(db, records)
+    liked_post_ids = {
+        (user_id, post_id)
+        for user_id, post_id in db.query(
+            models.Like.user_id, models.Like.post_id
+        ).filter(
+            models.Like.post_id.in_(existing_post_ids),
+            models.Like.user_id.in_(
+                {schema.user_id for _, _, schema in records}
+            ),
+        )
+    }
+    likes = []
+    for line, _, like_schema in records:
+        if like_schema.post_id not in existing_post_ids:
+            add_error(line, "Post not found")
+            continue
+        if (like_schema.user_id, like_schema.post_id) in liked_post_ids:
+            add_error(line, "Post is already liked")
+            continue
+        liked_post_ids.add((like_schema.user_id, like_schema.post_id))
+        likes.append(like_schema.dict())
+    if likes:
+        db.execute(insert(models.Like), likes)
+    for post_id, count in Counter(like["post_id"] for like in likes).items():
+        services.change_like_count(db, post_id, count)
+    return likes
+
+
+def _import_batch(
+    db: Session, records: list[ImportRecord], report: ImportReport
+) -> None:
+    """Inserts batch of records in one transaction and reports per-line
+    errors (all lines fail if the transaction fails)."""
+    records_by_type = {record_type: [] for record_type in IMPORT_SCHEMAS}
+    for record in records:
+        records_by_type[record[1]].append(record)
+    line_errors = []
+    add_error = lambda line, error: line_errors.append((line, error))
+    try:
+        posts = _insert_posts(db, records_by_type["post"], add_error)
+        post_ids = [post.id for post in posts]
+        comments = _insert_comments(db, records_by_type["comment"], add_error)
+        likes = _insert_likes(db, records_by_type["like"], add_error)
+        db.commit()
+    except SQLAlchemyError as error:
+        db.rollback()
+        for line, _, _ in records:
+            report.add_error(line, f"Batch failed: {error.__class__.__name__}")
+        return
+    for line, error in line_errors:
+        report.add_error(line, error)
+    report.imported.update(
+        post=len(post_ids), comment=len(comments), like=len(likes)
+    )
+    invalidate_responses(
+        "posts",
+        "tags",
+        *{f"user:{schema.user_id}" for _, _, schema in records},
+        *{f"post:{row['post_id']}" for row in comments + likes},
+    )
+
+
+async def import_ndjson(
+    db: AsyncSession, stream: AsyncIterator[bytes], user_id: int
+) -> dict:
+    """Imports posts, comments and likes of given user from streamed NDJSON
+    body in batches and returns import report."""
+    report, batch = ImportReport(), []
+    async for line_number, line in _iter_lines_of_(stream):
+        try:
+            batch.append((line_number, *_parse_line(line, user_id)))
+        except ValueError as error:
+            report.add_error(line_number, str(error))
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await db.run_sync(_import_batch, batch, report)
+            batch = []
+    if batch:
+        await db.run_sync(_import_batch, batch, report)
+    return report.to_dict()
@@ -1,12 +1,18 @@
 from typing import NoReturn
 
 from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, selectinload
 
 import models
-from blog import schemas, services
-from db import commit_and_refresh, add_commit_and_refresh
+from blog import schemas, services, search, events
+from blog.tag_index import tag_index
+from blog.like_buffer import like_buffer
+from user import feed
+from pagination import PageParams, paginate, make_page
+from response_cache import invalidate_responses
+from db import commit_and_refresh, add_commit_and_refresh, get_insert_for_
 
 
 # * C - create ----------------------------------------------------------------
@@ -15,47 +21,141 @@ from db import commit_and_refresh, add_commit_and_refresh
 def create_post(db: Session, post_schema: schemas.PostSchema):
     """Creates post in database and returns it."""
     post = models.Post(**post_schema.dict(exclude={"tags"}))
-    post.tags = services._get_all_tags_for_post_from_(post_schema, db)
-    return add_commit_and_refresh(db, post)
+    services.set_post_summary(post)
+    services.set_post_tags(
+        db, post, services._get_all_tags_for_post_from_(post_schema, db)
+    )
+    db.add(post)
+    search.index_post(db, post)
+    feed.fan_out_posts(db, [post])
+    post = commit_and_refresh(db, post)
+    invalidate_responses("posts", "tags", f"user:{post.user_id}")
+    return post
 
 
 def create_comment(db: Session, comment_schema: schemas.CommentSchema):
     """Creates comment in database and returns it."""
     comment = models.Comment(**comment_schema.dict())
-    return add_commit_and_refresh(db, comment)
+    services.change_comment_count(db, comment.post_id, 1)
+    try:
+        comment = add_commit_and_refresh(db, comment)
+    except IntegrityError:
+        # Foreign key of comment references non-existent post
+        db.rollback()
+        raise NoResultFound
+    invalidate_responses(f"post:{comment.post_id}", f"user:{comment.user_id}")
+    events.publish_comment_event("comment_created", comment)
+    return comment
 
 
 def create_like(db: Session, like_schema: schemas.LikeSchema):
-    """Creates like in database and returns it."""
-    like = models.Like(**like_schema.dict())
-    return add_commit_and_refresh(db, like)
+    """Creates like in database (if post isn't liked yet) and returns it."""
+    insert = get_insert_for_(db)
+    try:
+        is_created = (
+            db.execute(
+                insert(models.Like)
+                .values(**like_schema.dict())
+                .on_conflict_do_nothing()
+                .returning(models.Like.id)
+            ).first()
+            is not None
+        )
+    except IntegrityError:
+        # Foreign key of like references non-existent post
+        db.rollback()
+        raise NoResultFound
+    if is_created:
+        services.change_like_count(db, like_schema.post_id, 1)
+    db.commit()
+    if is_created:
+        invalidate_responses(
+            f"post:{like_schema.post_id}", f"user:{like_schema.user_id}"
+        )
+        _publish_like_count(db, like_schema.post_id)
+    return _get_like(db, like_schema)
 
 
 # * R - read ------------------------------------------------------------------
 
 
-def _get_all_posts_by_query(db: Session, query: str):
-    """Returns all posts from database by query."""
-    return (
-        db.query(models.Post)
-        .filter(models.Post.title.ilike(f"%{query}%"))
-        .order_by(models.Post.id.desc())
-        .all()
+def get_all_posts(
+    db: Session, query: str, page: PageParams, summary: bool = False
+):
+    """Returns page of posts (or post summaries) from database."""
+    if query:
+        posts_page = search.search_posts(db, query, page, summary)
+        # Search results hold posts with their snippets
+        like_buffer.overlay_like_counts(
+            [item["post"] for item in posts_page["items"]]
+        )
+        return posts_page
+    posts_page = paginate(
+        services.get_posts_query_from_(db.query(models.Post), summary),
+        models.Post.id,
+        page,
     )
+    like_buffer.overlay_like_counts(posts_page["items"])
+    return posts_page
 
 
-def get_all_posts(db: Session, query: str):
-    """Returns all posts from database."""
-    return (
-        db.query(models.Post).order_by(models.Post.id.desc()).all()
-        if not query
-        else _get_all_posts_by_query(db, query)
+def get_all_posts_by_tags(
+    db: Session,
+    tags: str,
+    mode: str,
+    exclude: str,
+    page: PageParams,
+    summary: bool = False,
+):
+    """Returns page of posts (or post summaries) with all or any of tags
+    with given slugs and without excluded tags (filtered in tag index)."""
+    post_ids_page = make_page(
+        tag_index.filter_post_ids(
+            db,
+            services._get_tag_titles_from_(tags),
+            mode == "all",
+            services._get_tag_titles_from_(exclude or ""),
+            page,
+        ),
+        page.limit,
+        lambda post_id: (post_id,),
     )
+    posts = (
+        services.get_posts_query_from_(
+            db.query(models.Post).filter(
+                models.Post.id.in_(post_ids_page["items"])
+            ),
+            summary,
+        )
+        .order_by(models.Post.id.desc())
+        .all()
+        if post_ids_page["items"]
+        else []
+    )
+    like_buffer.overlay_like_counts(posts)
+    return post_ids_page | {"items": posts}
 
 
-def get_all_tags(db: Session, query: str):
-    """Returns all tags from database."""
-    return db.query(models.Tag).all()
+def get_all_tags(
+    db: Session, query: str, page: PageParams, summary: bool = False
+):
+    """Returns page of tags with post counts (tags starting with query
+    from tag index if it is given)."""
+    if query:
+        return tag_index.search(db, query, page)
+    tags_page = paginate(
+        db.query(models.Tag.id, models.Tag.title, models.Tag.slug),
+        models.Tag.id,
+        page,
+    )
+    post_counts = tag_index.get_post_counts(
+        db, [tag.title for tag in tags_page["items"]]
+    )
+    tags_page["items"] = [
+        {**tag._asdict(), "post_count": post_counts.get(tag.title, 0)}
+        for tag in tags_page["items"]
+    ]
+    return tags_page
 
 
 def get_post_by_slug(db: Session, slug: str):
@@ -63,14 +163,36 @@ def get_post_by_slug(db: Session, slug: str):
     post = (
         db.query(models.Post)
         .filter(models.Post.slug == slug)
-        .options(joinedload(models.Post.tags))
+        # Joined many-to-many load makes SQLite scan whole 'post_tags'
+        .options(selectinload(models.Post.tags))
         .first()
     )
     if post is None:
         raise NoResultFound
+    like_buffer.overlay_like_counts([post])
     return post
 
 
+def get_post_id_by_slug(db: Session, slug: str) -> int:
+    """Returns id of post from database by slug."""
+    post_id = (
+        db.query(models.Post.id).filter(models.Post.slug == slug).scalar()
+    )
+    if post_id is None:
+        raise NoResultFound
+    return post_id
+
+
+def _publish_like_count(db: Session, post_id: int) -> None:
+    """Publishes like count of post from database to its event stream."""
+    events.publish_like_count(
+        post_id,
+        db.query(models.Post.like_count)
+        .filter(models.Post.id == post_id)
+        .scalar(),
+    )
+
+
 def get_tag_by_slug(db: Session, slug: str):
     """Returns tag from database by slug."""
     tag = db.query(models.Tag).filter(models.Tag.slug == slug).first()
@@ -79,6 +201,41 @@ def get_tag_by_slug(db: Session, slug: str):
     return tag
 
 
+def get_all_post_comments(db: Session, slug: str, page: PageParams):
+    """Returns page of post comments from database by post slug."""
+    return paginate(
+        get_post_by_slug(db, slug).comments, models.Comment.id, page
+    )
+
+
+def get_all_post_likes(db: Session, slug: str, page: PageParams):
+    """Returns page of ids of users who liked post with given slug."""
+    post = get_post_by_slug(db, slug)
+    likes_page = paginate(post.likes, models.Like.id, page)
+    likes_page["items"] = like_buffer.overlay_user_ids(
+        post.id,
+        [like.user_id for like in likes_page["items"]],
+        is_first_page=page.after is None,
+    )
+    return likes_page
+
+
+def get_all_posts_by_tag_slug(
+    db: Session, slug: str, page: PageParams, summary: bool = False
+):
+    """Returns page of posts (or post summaries) from database by tag
+    slug."""
+    posts_page = paginate(
+        services.get_posts_query_from_(
+            get_tag_by_slug(db, slug).posts, summary
+        ),
+        models.Post.id,
+        page,
+    )
+    like_buffer.overlay_like_counts(posts_page["items"])
+    return posts_page
+
+
 def _get_comment_by_id(db: Session, comment_id: int):
     """Returns comment from database by id."""
     comment = (
@@ -91,6 +248,21 @@ def _get_comment_by_id(db: Session, comment_id: int):
     return comment
 
 
+def _get_like(db: Session, like_schema: schemas.LikeSchema):
+    """Returns like from database by post and user ids."""
+    like = (
+        db.query(models.Like)
+        .filter(
+            models.Like.post_id == like_schema.post_id,
+            models.Like.user_id == like_schema.user_id,
+        )
+        .first()
+    )
+    if like is None:
+        raise NoResultFound
+    return like
+
+
 # * U - update ----------------------------------------------------------------
 
 
@@ -114,8 +286,14 @@ def update_post(
 
     post.title = post_schema.title
     post.body = post_schema.body
-    post.tags = services._get_all_tags_for_post_from_(post_schema, db)
-    return commit_and_refresh(db, post)
+    services.set_post_summary(post)
+    services.set_post_tags(
+        db, post, services._get_all_tags_for_post_from_(post_schema, db)
+    )
+    search.index_post(db, post)
+    post = commit_and_refresh(db, post)
+    invalidate_responses("posts", "tags", f"post:{post.id}")
+    return post
 
 
 def update_comment(
@@ -128,7 +306,10 @@ def update_comment(
     check_if_current_user_if_owner(comment.user_id, current_user_id)
 
     comment.body = comment_update_schema.body
-    return commit_and_refresh(db, comment)
+    comment = commit_and_refresh(db, comment)
+    invalidate_responses(f"user:{comment.user_id}")
+    events.publish_comment_event("comment_updated", comment)
+    return comment
 
 
 # * D - delete ----------------------------------------------------------------
@@ -145,29 +326,43 @@ def delete_post(db: Session, slug: str, current_user_id: int):
     """Deletes post from database and returns it."""
     post = get_post_by_slug(db, slug)
     check_if_current_user_if_owner(post.user_id, current_user_id)
-    return _delete_and_commit(db, post)
+    search.remove_post_from_index(db, post.id)
+    feed.remove_post_from_timelines(db, post.id)
+    services.change_tag_posts(
+        db, post.id, [tag.title for tag in post.tags], False
+    )
+    tags = ("posts", "tags", f"post:{post.id}", f"user:{post.user_id}")
+    post_id = post.id
+    post = _delete_and_commit(db, post)
+    like_buffer.forget_intents_of_([post_id])
+    invalidate_responses(*tags)
+    return post
 
 
 def delete_comment(db: Session, comment_id: int, current_user_id: int):
     """Deletes comment from database and returns it."""
     comment = _get_comment_by_id(db, comment_id)
     check_if_current_user_if_owner(comment.user_id, current_user_id)
-    return _delete_and_commit(db, comment)
+    services.change_comment_count(db, comment.post_id, -1)
+    tags = (f"post:{comment.post_id}", f"user:{comment.user_id}")
+    event_data = {"id": comment.id, "post_id": comment.post_id}
+    comment = _delete_and_commit(db, comment)
+    invalidate_responses(*tags)
+    events.event_broker.publish(
+        event_data["post_id"], "comment_deleted", event_data
+    )
+    return comment
 
 
 def delete_like(
     db: Session, like_schema: schemas.LikeSchema, current_user_id: int
 ):
     """Deletes like from database and returns it."""
-    like = (
-        db.query(models.Like)
-        .filter(
-            models.Like.post_id == like_schema.post_id,
-            models.Like.user_id == like_schema.user_id,
-        )
-        .first()
-    )
-    if like is None:
-        raise NoResultFound
+    like = _get_like(db, like_schema)
     check_if_current_user_if_owner(like.user_id, current_user_id)
-    return _delete_and_commit(db, like)
+    services.change_like_count(db, like.post_id, -1)
+    tags = (f"post:{like.post_id}", f"user:{like.user_id}")
+    like = _delete_and_commit(db, like)
+    invalidate_responses(*tags)
+    _publish_like_count(db, like.post_id)
+    return like
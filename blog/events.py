@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import asyncio
+from threading import Lock
+from collections import deque
+from dataclasses import dataclass
+
+from fastapi.exceptions import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from cache import LRUCache
+from metrics import register_metrics
+
+
+EVENT_HISTORY_SIZE = int(os.getenv("EVENT_HISTORY_SIZE", 100))  # per post
+EVENT_HISTORY_POSTS = int(os.getenv("EVENT_HISTORY_POSTS", 1024))
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 64))  # per subscriber
+EVENT_MAX_SUBSCRIBERS = int(os.getenv("EVENT_MAX_SUBSCRIBERS", 1000))
+EVENT_KEEPALIVE_INTERVAL = float(
+    os.getenv("EVENT_KEEPALIVE_INTERVAL", 15)  # seconds
+)
+EVENT_RETRY_INTERVAL = 3000  # milliseconds before client reconnects
+
+
+@dataclass
+class Event:
+    """Event of post sent to its subscribers."""
+
+    id: int
+    type: str
+    data: dict
+
+    def encode(self) -> str:
+        """Returns event in Server-Sent Events format."""
+        data = json.dumps(jsonable_encoder(self.data), separators=(",", ":"))
+        return f"id: {self.id}\nevent: {self.type}\ndata: {data}\n\n"
+
+
+class Subscriber:
+    """Bounded queue of events of post for one client."""
+
+    def __init__(self, post_id: int) -> None:
+        """Creates subscriber of post events in the running event loop."""
+        self.post_id = post_id
+        self.queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self.loop = asyncio.get_running_loop()
+        self.is_closed = False
+
+    def push(self, event: Event) -> bool:
+        """Puts event to queue or closes the stream and returns False if
+        queue is full, so slow client is disconnected (call in event
+        loop)."""
+        if self.is_closed:
+            return True
+        if self.queue.full():
+            self.close()
+            return False
+        self.queue.put_nowait(event)
+        return True
+
+    def close(self) -> None:
+        """Ends the stream dropping queued events (client resumes from
+        history with 'Last-Event-ID' after reconnecting) (call in event
+        loop)."""
+        if self.is_closed:
+            return
+        self.is_closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class EventBroker:
+    """In-process publish/subscribe of post events with bounded history
+    for resuming streams by last event id."""
+
+    def __init__(self) -> None:
+        """Creates broker without subscribers and history."""
+        # Ids grow across restarts, so old ids are never mistaken for new
+        self._first_id = self._last_id = int(time.time() * 1000)
+        self._forgotten_id = self._first_id
+        self._histories = LRUCache(
+            EVENT_HISTORY_POSTS, on_evict=self._forget_history_of
+        )
+        self._subscribers = {}
+        self._lock = Lock()
+        self.published = 0
+        self.resumed = 0
+        self.reset = 0
+        self.disconnected = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        """Returns number of subscribers of all posts."""
+        return sum(map(len, self._subscribers.values()))
+
+    def _forget_history_of(self, post_id: int) -> None:
+        """Remembers that events up to the last one could be missed by
+        resuming subscribers of post with evicted history."""
+        self._forgotten_id = self._last_id
+
+    def _deliver(self, subscriber: Subscriber, event: Event) -> None:
+        """Pushes event to subscriber counting disconnected slow ones (call
+        in event loop)."""
+        if not subscriber.push(event):
+            self.disconnected += 1
+
+    def publish(self, post_id: int, type: str, data: dict) -> None:
+        """Adds event to history of post and sends it to its subscribers
+        (it is safe to call from any thread)."""
+        with self._lock:
+            self._last_id += 1
+            event = Event(self._last_id, type, data)
+            if (history := self._histories.get(post_id)) is None:
+                history = deque(maxlen=EVENT_HISTORY_SIZE)
+                self._histories.set(post_id, history)
+            history.append(event)
+            subscribers = list(self._subscribers.get(post_id, ()))
+            self.published += 1
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(
+                self._deliver, subscriber, event
+            )
+
+    def _get_missed_events(
+        self, post_id: int, last_event_id: int
+    ) -> list[Event] | None:
+        """Returns events of post after given id or None if some of them
+        aren't in history anymore (call with lock)."""
+        history = self._histories.get(post_id) or deque()
+        if (
+            last_event_id < self._first_id
+            or last_event_id < self._forgotten_id
+            # Full history could have dropped events after the given one
+            or (
+                len(history) == EVENT_HISTORY_SIZE
+                and last_event_id < history[0].id
+            )
+        ):
+            return None
+        return [event for event in history if event.id > last_event_id]
+
+    def subscribe(
+        self, post_id: int, last_event_id: int | None = None
+    ) -> Subscriber:
+        """Returns subscriber of post events with events missed after last
+        event id (or 'reset' event if they aren't available) in queue."""
+        subscriber = Subscriber(post_id)
+        with self._lock:
+            if self.subscriber_count >= EVENT_MAX_SUBSCRIBERS:
+                raise HTTPException(
+                    status_code=503, detail="Too many event streams"
+                )
+            if last_event_id is not None:
+                events = self._get_missed_events(post_id, last_event_id)
+                if events is None or len(events) > EVENT_QUEUE_SIZE:
+                    self.reset += 1
+                    # Client reloads comments instead of applying events
+                    events = [Event(self._last_id, "reset", {})]
+                else:
+                    self.resumed += 1
+                for event in events:
+                    subscriber.queue.put_nowait(event)
+            self._subscribers.setdefault(post_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Removes subscriber of post events."""
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.post_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(subscriber.post_id, None)
+
+    def close_all(self) -> None:
+        """Ends streams of all subscribers."""
+        with self._lock:
+            subscribers = [
+                subscriber
+                for post_subscribers in self._subscribers.values()
+                for subscriber in post_subscribers
+            ]
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.close)
+
+    def get_stats(self) -> dict:
+        """Returns broker statistics."""
+        return {
+            "subscribers": self.subscriber_count,
+            "posts": len(self._subscribers),
+            "published": self.published,
+            "resumed": self.resumed,
+            "reset": self.reset,
+            "disconnected": self.disconnected,
+        }
+
+
+event_broker = EventBroker()
+register_metrics("events", event_broker.get_stats)
+
+
+async def stream_events(subscriber: Subscriber):
+    """Yields events of subscriber in Server-Sent Events format with
+    keep-alive comments until the stream is closed."""
+    try:
+        yield f"retry: {EVENT_RETRY_INTERVAL}\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscriber.queue.get(), EVENT_KEEPALIVE_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                break
+            yield event.encode()
+    finally:
+        event_broker.unsubscribe(subscriber)
+
+
+async def close_event_streams() -> None:
+    """Ends all event streams (so server can shut down)."""
+    event_broker.close_all()
+
+
+def publish_comment_event(type: str, comment) -> None:
+    """Publishes event of created or updated comment."""
+    event_broker.publish(
+        comment.post_id,
+        type,
+        {
+            "id": comment.id,
+            "body": comment.body,
+            "created": comment.created,
+            "updated": comment.updated,
+            "user_id": comment.user_id,
+            "post_id": comment.post_id,
+        },
+    )
+
+
+def publish_like_count(post_id: int, like_count: int) -> None:
+    """Publishes event of changed like count of post."""
+    event_broker.publish(
+        post_id, "like_count", {"post_id": post_id, "like_count": like_count}
+    )
@@ -0,0 +1,361 @@
+import os
+import asyncio
+import logging
+from threading import Lock
+from typing import Iterable
+from collections import defaultdict
+
+from sqlalchemy import delete, select, tuple_, exc
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import NoResultFound
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from metrics import register_metrics
+from models import User, Post, Like
+from blog import services, events
+from db import AsyncSessionLocal, get_insert_for_
+from response_cache import invalidate_responses
+
+
+LIKE_BUFFER_ENABLED = os.getenv("LIKE_BUFFER_ENABLED", "0") == "1"
+LIKE_BUFFER_FLUSH_INTERVAL = float(
+    os.getenv("LIKE_BUFFER_FLUSH_INTERVAL", 0.5)  # seconds
+)
+LIKE_BUFFER_MAX_SIZE = int(os.getenv("LIKE_BUFFER_MAX_SIZE", 1000))
+
+logger = logging.getLogger("itish.likes")
+
+# Post id -> user id -> (is liked in database, is liked)
+Intents = dict[int, dict[int, tuple[bool, bool]]]
+
+
+def _is_post_liked_by_(db: Session, post_id: int, user_id: int) -> bool:
+    """Returns whether post is liked by user in database or raises
+    NoResultFound if there is no such post."""
+    row = (
+        db.query(Post.id, Like.id)
+        .outerjoin(Like, (Like.post_id == Post.id) & (Like.user_id == user_id))
+        .filter(Post.id == post_id)
+        .first()
+    )
+    if row is None:
+        raise NoResultFound
+    return row[1] is not None
+
+
+def _save_intents(db: Session, intents: Intents) -> dict[int, int]:
+    """Inserts and deletes likes of intents and recounts like counts of
+    their posts in one transaction and returns the counts by post ids."""
+    liked, unliked = [], []
+    for post_id, user_intents in intents.items():
+        for user_id, (_, is_liked) in user_intents.items():
+            if is_liked:
+                liked.append({"post_id": post_id, "user_id": user_id})
+            else:
+                unliked.append((user_id, post_id))
+    if liked:
+        # Posts and users could be deleted after their likes were buffered
+        existing_post_ids = set(
+            db.scalars(select(Post.id).where(Post.id.in_(list(intents))))
+        )
+        existing_user_ids = set(
+            db.scalars(
+                select(User.id).where(
+                    User.id.in_({like["user_id"] for like in liked})
+                )
+            )
+        )
+        liked = [
+            like
+            for like in liked
+            if like["post_id"] in existing_post_ids
+            and like["user_id"] in existing_user_ids
+        ]
+    if liked:
+        insert = get_insert_for_(db)
+        db.execute(insert(Like).on_conflict_do_nothing(), liked)
+    if unliked:
+        db.execute(
+            delete(Like).where(tuple_(Like.user_id, Like.post_id).in_(unliked))
+        )
+    services.recount_like_counts_of_(db, list(intents))
+    like_counts = dict(
+        db.query(Post.id, Post.like_count).filter(Post.id.in_(list(intents)))
+    )
+    db.commit()
+    return like_counts
+
+
+def _is_transient(error: Exception) -> bool:
+    """Checks if saving intents could succeed when it is retried (e.g.
+    database was locked or connection was lost)."""
+    return isinstance(error, (exc.OperationalError, exc.TimeoutError)) or (
+        isinstance(error, exc.DBAPIError) and error.connection_invalidated
+    )
+
+
+class LikeBuffer:
+    """In-memory buffer of like/unlike intents saved in batches."""
+
+    def __init__(self, flush_interval: float, max_size: int) -> None:
+        """Creates empty buffer flushed every interval (in seconds) or when
+        it holds max number of intents."""
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._pending: Intents = defaultdict(dict)
+        self._flushing: Intents = {}
+        self._size = 0
+        self._lock = Lock()
+        self._flush_lock = None
+        self._flush_requested = None
+        self._task = None
+        self._is_stopped = False
+        self.intents = 0
+        self.cancelled = 0
+        self.flushes = 0
+        self.flushed_intents = 0
+        self.failed_flushes = 0
+        self.dropped_intents = 0
+
+    def _get_states_of_(self, post_id: int, user_id: int):
+        """Returns (is liked in database after current flush, is liked) of
+        buffered intent or None."""
+        if (states := self._pending.get(post_id, {}).get(user_id)) is not None:
+            return states
+        if (
+            states := self._flushing.get(post_id, {}).get(user_id)
+        ) is not None:
+            return states[1], states[1]
+        return None
+
+    def _set_intent(
+        self, post_id: int, user_id: int, is_liked_in_db: bool, is_liked: bool
+    ) -> None:
+        """Buffers intent dropping it if it cancels out (call with lock)."""
+        self.intents += 1
+        user_intents = self._pending[post_id]
+        if is_liked == is_liked_in_db:
+            if user_intents.pop(user_id, None) is not None:
+                self._size -= 1
+                self.cancelled += 1
+        else:
+            if user_id not in user_intents:
+                self._size += 1
+            user_intents[user_id] = (is_liked_in_db, is_liked)
+        if not user_intents:
+            del self._pending[post_id]
+
+    async def set_like(
+        self, db: AsyncSession, post_id: int, user_id: int, is_liked: bool
+    ) -> None:
+        """Buffers like or unlike of post by user or raises NoResultFound if
+        there is no such post (or like to remove)."""
+        with self._lock:
+            states = self._get_states_of_(post_id, user_id)
+        if states is None:
+            is_liked_in_db = await db.run_sync(
+                _is_post_liked_by_, post_id, user_id
+            )
+            states = (is_liked_in_db, is_liked_in_db)
+        if not is_liked and not states[1]:
+            raise NoResultFound
+        with self._lock:
+            # Intent could be buffered or flushed while database was queried
+            states = self._get_states_of_(post_id, user_id) or states
+            self._set_intent(post_id, user_id, states[0], is_liked)
+            is_full = self._size >= self.max_size
+        invalidate_responses(f"post:{post_id}", f"user:{user_id}")
+        if is_full and self._flush_requested is not None:
+            self._flush_requested.set()
+
+    def _get_changes_of_(self, post_id: int) -> dict[int, bool]:
+        """Returns user id -> is liked of buffered intents changing likes of
+        post in database (call with lock)."""
+        changes = {
+            user_id: states
+            for user_id, states in self._flushing.get(post_id, {}).items()
+        }
+        for user_id, states in self._pending.get(post_id, {}).items():
+            # Flushing intent holds state of database before the flush
+            changes[user_id] = (changes.get(user_id, states)[0], states[1])
+        return {
+            user_id: is_liked
+            for user_id, (is_liked_in_db, is_liked) in changes.items()
+            if is_liked != is_liked_in_db
+        }
+
+    def overlay_like_counts(self, posts: list[Post]) -> None:
+        """Adds buffered likes to like counts of given posts."""
+        if not self._pending and not self._flushing:
+            return
+        with self._lock:
+            for post in posts:
+                if changes := self._get_changes_of_(post.id):
+                    delta = sum(
+                        1 if is_liked else -1 for is_liked in changes.values()
+                    )
+                    # Without history, so the change is never flushed
+                    set_committed_value(
+                        post, "like_count", post.like_count + delta
+                    )
+
+    def overlay_user_ids(
+        self, post_id: int, user_ids: list[int], is_first_page: bool
+    ) -> list[int]:
+        """Returns page of ids of users who liked post with buffered likes
+        (they are the newest) and without buffered unlikes."""
+        if not self._pending and not self._flushing:
+            return user_ids
+        with self._lock:
+            changes = self._get_changes_of_(post_id)
+        return [
+            user_id
+            for user_id, is_liked in reversed(changes.items())
+            if is_liked and is_first_page
+        ] + [user_id for user_id in user_ids if changes.get(user_id, True)]
+
+    def _restore(self, intents: Intents) -> None:
+        """Buffers intents of failed flush again (call with lock)."""
+        for post_id, user_intents in intents.items():
+            for user_id, (is_liked_in_db, is_liked) in user_intents.items():
+                if (
+                    states := self._pending.get(post_id, {}).get(user_id)
+                ) is not None:
+                    is_liked = states[1]
+                self._set_intent(post_id, user_id, is_liked_in_db, is_liked)
+                self.intents -= 1
+
+    def forget_intents_of_(
+        self, post_ids: Iterable[int] = (), user_id: int | None = None
+    ) -> None:
+        """Drops buffered intents of deleted posts and user."""
+        with self._lock:
+            for post_id in post_ids:
+                self._size -= len(self._pending.pop(post_id, {}))
+            if user_id is None:
+                return
+            for post_id in list(self._pending):
+                if self._pending[post_id].pop(user_id, None) is not None:
+                    self._size -= 1
+                    if not self._pending[post_id]:
+                        del self._pending[post_id]
+
+    async def _save(self, intents: Intents) -> dict[int, int]:
+        """Saves intents in one transaction and returns like counts of
+        their posts."""
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(_save_intents, intents)
+
+    async def _save_by_posts(
+        self, intents: Intents
+    ) -> tuple[dict[int, int], int]:
+        """Saves intents of each post in its own transaction, buffers again
+        intents failed with transient errors, drops the others and returns
+        like counts of saved posts and number of saved intents."""
+        like_counts, saved_intents = {}, 0
+        for post_id, user_intents in intents.items():
+            try:
+                like_counts.update(await self._save({post_id: user_intents}))
+                saved_intents += len(user_intents)
+            except Exception as error:
+                with self._lock:
+                    if _is_transient(error):
+                        self._restore({post_id: user_intents})
+                        continue
+                    self.dropped_intents += len(user_intents)
+                logger.exception(
+                    "Dropped %s likes of post %s", len(user_intents), post_id
+                )
+        return like_counts, saved_intents
+
+    async def flush(self) -> int:
+        """Saves buffered intents to database and returns their number."""
+        async with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, defaultdict(
+                    dict
+                )
+                flushed_intents, self._size = self._size, 0
+            try:
+                like_counts = await self._save(self._flushing)
+            except Exception as error:
+                logger.exception("Failed to flush %s likes", flushed_intents)
+                with self._lock:
+                    self.failed_flushes += 1
+                    if _is_transient(error):
+                        self._restore(self._flushing)
+                        self._flushing = {}
+                        return 0
+                # Retrying the batch would fail again, so bad posts are
+                # separated from the others
+                like_counts, flushed_intents = await self._save_by_posts(
+                    self._flushing
+                )
+            with self._lock:
+                post_ids, self._flushing = list(self._flushing), {}
+                self.flushes += 1
+                self.flushed_intents += flushed_intents
+            # Responses computed between commit and now counted likes twice
+            invalidate_responses(*(f"post:{post_id}" for post_id in post_ids))
+            for post_id, like_count in like_counts.items():
+                events.publish_like_count(post_id, like_count)
+            return flushed_intents
+
+    async def _run(self) -> None:
+        """Flushes buffer every interval or when it is full until stopped."""
+        while not self._is_stopped:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Starts periodic flushing."""
+        self._is_stopped = False
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops periodic flushing and flushes the rest of intents."""
+        if self._task is None:
+            return
+        self._is_stopped = True
+        self._flush_requested.set()
+        await self._task
+        self._task = None
+
+    def get_stats(self) -> dict:
+        """Returns buffer statistics."""
+        return {
+            "enabled": LIKE_BUFFER_ENABLED,
+            "pending": self._size,
+            "intents": self.intents,
+            "cancelled": self.cancelled,
+            "flushes": self.flushes,
+            "flushed_intents": self.flushed_intents,
+            "failed_flushes": self.failed_flushes,
+            "dropped_intents": self.dropped_intents,
+        }
+
+
+like_buffer = LikeBuffer(LIKE_BUFFER_FLUSH_INTERVAL, LIKE_BUFFER_MAX_SIZE)
+register_metrics("like_buffer", like_buffer.get_stats)
+
+
+async def start_like_buffer() -> None:
+    """Starts like buffer if write-behind likes are enabled."""
+    if LIKE_BUFFER_ENABLED:
+        like_buffer.start()
+
+
+async def stop_like_buffer() -> None:
+    """Stops like buffer saving buffered likes."""
+    await like_buffer.stop()
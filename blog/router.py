@@ -1,91 +1,157 @@
-from sqlalchemy.orm import Session
-from fastapi import APIRouter, Depends, Body
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends, Body, Header, Request
 from fastapi.exceptions import HTTPException
-
-from blog import crud, schemas
-from dependencies import get_db
-from models import User, Comment
+from fastapi.responses import StreamingResponse
+
+from blog import crud, schemas, bulk
+from blog.like_buffer import LIKE_BUFFER_ENABLED, like_buffer
+from blog.events import event_broker, stream_events
+from models import User
+from pagination import PageParams
+from dependencies import get_async_db, get_read_db, get_page_params
 from decorators import catch_model_not_fount
 from auth.dependencies import get_current_user
+from response_cache import get_cached_response, get_tags_of_
 
 
 blog_router = APIRouter()
 
 
 @blog_router.get("/")
-def home_blog_page(
-    tab: str = "posts", q: str = None, db: Session = Depends(get_db)
+async def home_blog_page(
+    request: Request,
+    tab: str = "posts",
+    q: str = None,
+    tags: str = None,
+    mode: str = "all",
+    exclude: str = None,
+    summary: bool = False,
+    page: PageParams = Depends(get_page_params),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    """Returns all posts or tags from database."""
+    """Returns page of posts (or post summaries) or tags from database.
+    Posts can be filtered by all or any of tags with given slugs (comma
+    separated) without excluded ones."""
     if tab not in ("posts", "tags", ""):
         raise HTTPException(status_code=404, detail="Tab not found")
-    return {
+    if mode not in ("all", "any"):
+        raise HTTPException(status_code=400, detail="Invalid mode")
+    if (tags or exclude) and (tab == "tags" or q or not tags):
+        raise HTTPException(
+            status_code=400,
+            detail="Tag filter needs tags and can't be used with search",
+        )
+    process_function = {
         "": crud.get_all_posts,
         "posts": crud.get_all_posts,
         "tags": crud.get_all_tags,
-    }.get(tab)(db, q)
+    }.get(tab)
+
+    async def get_page():
+        if tags:
+            content = await db.run_sync(
+                crud.get_all_posts_by_tags, tags, mode, exclude, page, summary
+            )
+        else:
+            content = await db.run_sync(process_function, q, page, summary)
+        list_tag = "tags" if tab == "tags" else "posts"
+        return content, {list_tag} | get_tags_of_(content)
+
+    return await get_cached_response(request, get_page)
 
 
 # * Post ----------------------------------------------------------------------
 
 
 @blog_router.post("/post")
-def create_post(
+async def create_post(
     post_schema: schemas.PostSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     """Creates post in database and returns it."""
     post_schema.user_id = user.id
-    return crud.create_post(db, post_schema)
+    return await db.run_sync(crud.create_post, post_schema)
 
 
 @blog_router.get("/post/{slug}")
 @catch_model_not_fount(model="Post")
-def get_post_by_slug(slug: str, db: Session = Depends(get_db)):
+async def get_post_by_slug(
+    slug: str, request: Request, db: AsyncSession = Depends(get_read_db)
+):
     """Returns post from database by slug."""
-    return crud.get_post_by_slug(db, slug)
+
+    async def get_post():
+        post = await db.run_sync(crud.get_post_by_slug, slug)
+        return post, get_tags_of_(post)
+
+    return await get_cached_response(request, get_post)
 
 
 @blog_router.get("/post/{slug}/comments")
 @catch_model_not_fount(model="Post")
-def get_all_post_comments(slug: str, db: Session = Depends(get_db)):
-    """Returns post from database by slug."""
-    return (
-        crud.get_post_by_slug(db, slug)
-        .comments.order_by(Comment.id.desc())
-        .all()
-    )
+async def get_all_post_comments(
+    slug: str,
+    page: PageParams = Depends(get_page_params),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Returns page of post comments by post slug."""
+    return await db.run_sync(crud.get_all_post_comments, slug, page)
 
 
 @blog_router.get("/post/{slug}/likes")
 @catch_model_not_fount(model="Post")
-def get_all_post_likes(slug: str, db: Session = Depends(get_db)):
-    """Returns post from database by slug."""
-    return [like.user_id for like in crud.get_post_by_slug(db, slug).likes]
+async def get_all_post_likes(
+    slug: str,
+    page: PageParams = Depends(get_page_params),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Returns page of ids of users who liked post by post slug."""
+    return await db.run_sync(crud.get_all_post_likes, slug, page)
+
+
+@blog_router.get("/post/{slug}/events")
+@catch_model_not_fount(model="Post")
+async def stream_post_events(
+    slug: str,
+    last_event_id: int = Header(None),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Streams created, updated and deleted comments and like counts of post
+    as Server-Sent Events (resumed after 'Last-Event-ID')."""
+    post_id = await db.run_sync(crud.get_post_id_by_slug, slug)
+    # Connection isn't held while the stream is open
+    await db.close()
+    return StreamingResponse(
+        stream_events(event_broker.subscribe(post_id, last_event_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @blog_router.put("/post/{slug}")
 @catch_model_not_fount(model="Post")
-def update_post(
+async def update_post(
     slug: str,
     post_update_schema: schemas.PostUpdateSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     """Updates post in database and returns it."""
-    return crud.update_post(db, slug, post_update_schema, user.id)
+    return await db.run_sync(
+        crud.update_post, slug, post_update_schema, user.id
+    )
 
 
 @blog_router.delete("/post/{slug}")
 @catch_model_not_fount(model="Post")
-def delete_post_by_slug(
+async def delete_post_by_slug(
     slug: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     """Deletes post from database by slug."""
-    return crud.delete_post(db, slug, user.id)
+    return await db.run_sync(crud.delete_post, slug, user.id)
 
 
 # * Tag -----------------------------------------------------------------------
@@ -93,61 +159,103 @@ def delete_post_by_slug(
 
 @blog_router.get("/tag/{slug}")
 @catch_model_not_fount(model="Tag")
-def get_all_posts_by_tag_slug(slug: str, db: Session = Depends(get_db)):
-    """Returns all posts by tag slug."""
-    return crud.get_tag_by_slug(db, slug).posts.all()
+async def get_all_posts_by_tag_slug(
+    slug: str,
+    request: Request,
+    summary: bool = False,
+    page: PageParams = Depends(get_page_params),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Returns page of posts (or post summaries) by tag slug."""
+
+    async def get_page():
+        content = await db.run_sync(
+            crud.get_all_posts_by_tag_slug, slug, page, summary
+        )
+        return content, {"posts"} | get_tags_of_(content)
+
+    return await get_cached_response(request, get_page)
 
 
 # * Comment -------------------------------------------------------------------
 
 
 @blog_router.post("/comment")
-def create_comment(
+@catch_model_not_fount(model="Post")
+async def create_comment(
     comment_schema: schemas.CommentSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     comment_schema.user_id = user.id
-    return crud.create_comment(db, comment_schema)
+    return await db.run_sync(crud.create_comment, comment_schema)
 
 
 @blog_router.put("/comment")
 @catch_model_not_fount(model="Comment")
-def update_comment(
+async def update_comment(
     comment_update_schema: schemas.CommentUpdateSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    return crud.update_comment(db, comment_update_schema, user.id)
+    return await db.run_sync(
+        crud.update_comment, comment_update_schema, user.id
+    )
 
 
 @blog_router.delete("/comment")
 @catch_model_not_fount(model="Comment")
-def delete_comment(
+async def delete_comment(
     comment_delete_schema: schemas.CommentDeleteSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    return crud.delete_comment(db, comment_delete_schema.id, user.id)
+    return await db.run_sync(
+        crud.delete_comment, comment_delete_schema.id, user.id
+    )
 
 
 # * Like ----------------------------------------------------------------------
 
 
 @blog_router.post("/like")
-def create_like(
+@catch_model_not_fount(model="Post")
+async def create_like(
     like_schema: schemas.LikeSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    return crud.create_like(db, like_schema)
+    like_schema.user_id = user.id
+    if LIKE_BUFFER_ENABLED:
+        # Like is saved later, so there is no like id to return yet
+        await like_buffer.set_like(db, like_schema.post_id, user.id, True)
+        return like_schema
+    return await db.run_sync(crud.create_like, like_schema)
 
 
 @blog_router.delete("/like")
 @catch_model_not_fount(model="Like")
-def delete_like(
+async def delete_like(
     like_schema: schemas.LikeSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    user: User = Depends(get_current_user),
+):
+    if LIKE_BUFFER_ENABLED:
+        crud.check_if_current_user_if_owner(like_schema.user_id, user.id)
+        await like_buffer.set_like(db, like_schema.post_id, user.id, False)
+        return like_schema
+    return await db.run_sync(crud.delete_like, like_schema, user.id)
+
+
+# * Import --------------------------------------------------------------------
+
+
+@blog_router.post("/import")
+async def import_content(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    return crud.delete_like(db, like_schema, user.id)
+    """Imports posts, comments and likes of current user from NDJSON body
+    (one JSON object with 'type' key per line) and returns import report."""
+    return await bulk.import_ndjson(db, request.stream(), user.id)
@@ -0,0 +1,295 @@
+import re
+import logging
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Connection
+from fastapi.exceptions import HTTPException
+
+import models
+from db import Base, engine
+from pagination import PageParams, decode_cursor, make_page, paginate
+from blog.services import get_posts_query_from_
+
+
+SEARCH_TABLE = "posts_search"
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+SNIPPET_TOKENS = 16
+
+_FILL_SEARCH_TABLE_SQL = (
+    f"INSERT INTO {SEARCH_TABLE}(rowid, title, body) "
+    "SELECT id, title, body FROM posts"
+)
+
+# PostgreSQL text search vector of post with weighted title (ranked with
+# default weights 1.0 of 'A' and 0.1 of 'D' like BM25 weights above)
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', title), 'A') || "
+    "setweight(to_tsvector('simple', body), 'D')"
+)
+SEARCH_INDEX = "ix_posts_search_vector"
+SNIPPET_OPTIONS = (
+    "StartSel=<mark>, StopSel=</mark>, FragmentDelimiter=..., "
+    f"MaxFragments=1, MaxWords={SNIPPET_TOKENS}, MinWords=5"
+)
+
+logger = logging.getLogger("itish.search")
+
+
+def _is_sqlite(bind) -> bool:
+    """Checks if given connection or session is bound to SQLite."""
+    return bind.dialect.name == "sqlite"
+
+
+def _is_postgresql(bind) -> bool:
+    """Checks if given connection or session is bound to PostgreSQL."""
+    return bind.dialect.name == "postgresql"
+
+
+def create_search_index(connection: Connection) -> None:
+    """Creates GIN index of text search vectors of posts (PostgreSQL)."""
+    if not _is_postgresql(connection):
+        return
+    connection.exec_driver_sql(
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} ON posts "
+        f"USING gin (({SEARCH_VECTOR_SQL}))"
+    )
+
+
+def _search_table_exists(connection: Connection) -> bool:
+    """Checks if full-text search table exists in database."""
+    return (
+        connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+            {"name": SEARCH_TABLE},
+        ).first()
+        is not None
+    )
+
+
+@event.listens_for(Base.metadata, "after_create")
+def _create_search_table(target, connection: Connection, **kwargs) -> None:
+    """Creates and fills full-text search table for posts (SQLite FTS5) or
+    index of their text search vectors (PostgreSQL)."""
+    create_search_index(connection)
+    if not _is_sqlite(connection) or _search_table_exists(connection):
+        return
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        "title, body, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    connection.exec_driver_sql(
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rank) "
+        f"VALUES ('rank', 'bm25({TITLE_WEIGHT}, {BODY_WEIGHT})')"
+    )
+    connection.exec_driver_sql(_FILL_SEARCH_TABLE_SQL)
+
+
+def rebuild_search_index(db: Session) -> None:
+    """Refills full-text search table from posts table."""
+    if not _is_sqlite(db.get_bind()):
+        return
+    db.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    db.execute(text(_FILL_SEARCH_TABLE_SQL))
+    db.commit()
+
+
+def index_post(db: Session, post: models.Post) -> None:
+    """Adds or replaces post in full-text search table (in db transaction)."""
+    if not _is_sqlite(db.get_bind()):
+        return
+    db.flush()
+    remove_post_from_index(db, post.id)
+    db.execute(
+        text(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, title, body) "
+            "VALUES (:id, :title, :body)"
+        ),
+        {"id": post.id, "title": post.title, "body": post.body},
+    )
+
+
+def index_posts(db: Session, posts: list[models.Post]) -> None:
+    """Adds new flushed posts to full-text search table with one
+    'executemany' (in db transaction)."""
+    if not posts or not _is_sqlite(db.get_bind()):
+        return
+    db.execute(
+        text(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, title, body) "
+            "VALUES (:id, :title, :body)"
+        ),
+        [
+            {"id": post.id, "title": post.title, "body": post.body}
+            for post in posts
+        ],
+    )
+
+
+def remove_post_from_index(db: Session, post_id: int) -> None:
+    """Removes post from full-text search table (in db transaction)."""
+    remove_posts_from_index(db, [post_id])
+
+
+def remove_posts_from_index(db: Session, post_ids: list[int]) -> None:
+    """Removes posts with given ids from full-text search table (in db
+    transaction)."""
+    if not post_ids or not _is_sqlite(db.get_bind()):
+        return
+    db.execute(
+        text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = :id"),
+        [{"id": post_id} for post_id in post_ids],
+    )
+
+
+def _get_match_expression_from_(query: str) -> str:
+    """Returns safe FTS5 match expression (last word is a prefix)."""
+    words = re.findall(r"\w+", query.lower())
+    return " ".join(
+        f'"{word}"*' if i == len(words) - 1 else f'"{word}"'
+        for i, word in enumerate(words)
+    )
+
+
+def _get_tsquery_from_(query: str) -> str:
+    """Returns safe PostgreSQL tsquery matching all words (last word is a
+    prefix)."""
+    words = re.findall(r"\w+", query.lower())
+    return " & ".join(
+        f"'{word}':*" if i == len(words) - 1 else f"'{word}'"
+        for i, word in enumerate(words)
+    )
+
+
+def _get_rank_and_id_from_(cursor: str) -> tuple[float, int]:
+    """Returns rank and post id from the given search cursor."""
+    values = decode_cursor(cursor)
+    if len(values) != 2 or not all(
+        isinstance(value, (int, float)) for value in values
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return float(values[0]), int(values[1])
+
+
+def _search_posts_with_fts(
+    db: Session, query: str, page: PageParams, summary: bool
+):
+    """Returns page of posts ranked by BM25 with snippets."""
+    match = _get_match_expression_from_(query)
+    if not match:
+        return {"items": [], "next_cursor": None}
+    params = {"match": match, "limit": page.limit + 1}
+    after_condition = ""
+    if page.after:
+        params["rank"], params["id"] = _get_rank_and_id_from_(page.after)
+        after_condition = "WHERE rank > :rank OR (rank = :rank AND id < :id)"
+    rows_page = make_page(
+        db.execute(
+            text(
+                "SELECT id, rank, snippet FROM ("
+                f"SELECT rowid AS id, rank, snippet({SEARCH_TABLE}, 1, "
+                f"'<mark>', '</mark>', '...', {SNIPPET_TOKENS}) AS snippet "
+                f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH :match"
+                f") {after_condition} ORDER BY rank, id DESC LIMIT :limit"
+            ),
+            params,
+        ).all(),
+        page.limit,
+        lambda row: (row.rank, row.id),
+    )
+    return _get_posts_page_from_(db, rows_page, summary)
+
+
+def _get_posts_page_from_(db: Session, rows_page: dict, summary: bool):
+    """Returns page of found posts with snippets from page of (id,
+    snippet) rows keeping their order."""
+    posts = {
+        post.id: post
+        for post in get_posts_query_from_(
+            db.query(models.Post), summary
+        ).filter(models.Post.id.in_([row.id for row in rows_page["items"]]))
+    }
+    rows_page["items"] = [
+        {"post": posts[row.id], "snippet": row.snippet}
+        for row in rows_page["items"]
+        if row.id in posts
+    ]
+    return rows_page
+
+
+def _search_posts_with_tsvector(
+    db: Session, query: str, page: PageParams, summary: bool
+):
+    """Returns page of posts ranked by ts_rank with snippets (PostgreSQL,
+    served by GIN index of text search vectors)."""
+    tsquery = _get_tsquery_from_(query)
+    if not tsquery:
+        return {"items": [], "next_cursor": None}
+    params = {
+        "query": tsquery,
+        "options": SNIPPET_OPTIONS,
+        "limit": page.limit + 1,
+    }
+    after_condition = ""
+    if page.after:
+        params["rank"], params["id"] = _get_rank_and_id_from_(page.after)
+        after_condition = "WHERE rank < :rank OR (rank = :rank AND id < :id)"
+    rows_page = make_page(
+        db.execute(
+            text(
+                # Snippets are made only for posts of the page
+                "SELECT id, rank, ts_headline('simple', body, "
+                "to_tsquery('simple', :query), :options) AS snippet FROM ("
+                "SELECT id, body, rank FROM ("
+                "SELECT id, body, "
+                f"ts_rank(({SEARCH_VECTOR_SQL}), query) AS rank "
+                "FROM posts, to_tsquery('simple', :query) AS query "
+                f"WHERE ({SEARCH_VECTOR_SQL}) @@ query"
+                f") AS matches {after_condition} "
+                "ORDER BY rank DESC, id DESC LIMIT :limit"
+                ") AS page ORDER BY rank DESC, id DESC"
+            ),
+            params,
+        ).all(),
+        page.limit,
+        lambda row: (row.rank, row.id),
+    )
+    return _get_posts_page_from_(db, rows_page, summary)
+
+
+def _search_posts_with_like(
+    db: Session, query: str, page: PageParams, summary: bool
+):
+    """Returns page of posts matched by title (other databases, without
+    full-text index, so bodies aren't scanned)."""
+    posts_query = get_posts_query_from_(db.query(models.Post), summary).filter(
+        models.Post.title.ilike(f"%{query}%")
+    )
+    posts_page = paginate(posts_query, models.Post.id, page)
+    posts_page["items"] = [
+        {"post": post, "snippet": None} for post in posts_page["items"]
+    ]
+    return posts_page
+
+
+def search_posts(
+    db: Session, query: str, page: PageParams, summary: bool = False
+):
+    """Returns page of posts (or post summaries) found by given full-text
+    query."""
+    if _is_sqlite(db.get_bind()):
+        return _search_posts_with_fts(db, query, page, summary)
+    if _is_postgresql(db.get_bind()):
+        return _search_posts_with_tsvector(db, query, page, summary)
+    return _search_posts_with_like(db, query, page, summary)
+
+
+def warn_about_unindexed_search() -> None:
+    """Logs warning if database has no full-text search of posts."""
+    if not _is_sqlite(engine) and not _is_postgresql(engine):
+        logger.warning(
+            "Database '%s' has no full-text search index, so posts are "
+            "searched by titles only with 'LIKE' scans",
+            engine.dialect.name,
+        )
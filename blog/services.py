@@ -1,38 +1,328 @@
-from sqlalchemy.orm import Session
+import os
+import math
+from typing import Iterable
+from collections import defaultdict
 
-from models import Post, Tag
+from sqlalchemy import func, select, update, event, inspect
+from sqlalchemy.orm import (
+    Query,
+    Session,
+    load_only,
+    joinedload,
+    selectinload,
+    make_transient_to_detached,
+)
+
+from cache import LRUCache
+from db import get_insert_for_
+from models import (
+    User,
+    Post,
+    Tag,
+    Comment,
+    Like,
+    post_tags,
+    tag_index_version,
+)
 from blog.schemas import PostSchema
+from blog.tag_index import tag_index
 
 
-def _there_is_not_tag_with_such_(title: str, db: Session) -> bool:
-    """Returns True if there is not tag with such title in database."""
-    return not db.query(Tag).filter(Tag.title == title).first()
+TAG_CACHE_SIZE = int(os.getenv("TAG_CACHE_SIZE", 1024))
+EXCERPT_LENGTH = 300
+SUMMARY_BATCH_SIZE = 1000
+WORDS_PER_MINUTE = 200
 
+# Cache of tag title -> tag id (tags are never deleted or renamed)
+tag_id_cache = LRUCache(maxsize=TAG_CACHE_SIZE)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_tag_index_version(db: Session) -> None:
+    """Bumps version of tags and their posts in the committed transaction
+    if it creates tags or changes their posts, so tag indexes of other
+    workers are rebuilt."""
+    if db.info.get("created_tag_ids") or db.info.get("tag_post_changes"):
+        db.execute(
+            update(tag_index_version)
+            .where(tag_index_version.c.id == 1)
+            .values(version=tag_index_version.c.version + 1)
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed_tag_ids(db: Session) -> None:
+    """Caches ids of tags created in the committed transaction and updates
+    tag index."""
+    for tag_title, tag_id in db.info.pop("created_tag_ids", {}).items():
+        tag_id_cache.set(tag_title, tag_id)
+        tag_index.add_tag(tag_id, tag_title, Tag(title=tag_title).slug)
+    if tag_post_changes := db.info.pop("tag_post_changes", None):
+        tag_index.change_tag_posts(
+            # Ids of posts created in the transaction are known after flush
+            (
+                post if isinstance(post, int) else inspect(post).identity[0],
+                tag_titles,
+                is_added,
+            )
+            for post, tag_titles, is_added in tag_post_changes
+        )
 
-def _create_non_existent_tags_from_(
-    tag_titles: list[str], db: Session
-) -> None:
-    """Creates non-existent tags from given list of tag titles."""
-    for tag_title in tag_titles:
-        if _there_is_not_tag_with_such_(tag_title, db):
-            db.add(Tag(title=tag_title))
-    db.commit()
 
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_tag_ids(db: Session) -> None:
+    """Forgets ids of tags created and posts of tags changed in the rolled
+    back transaction."""
+    db.info.pop("created_tag_ids", None)
+    db.info.pop("tag_post_changes", None)
 
-def _get_tag_titles_from_(tags: str, db: Session):
-    """Returns tag titles from the given string."""
+
+def _get_tag_titles_from_(tags: str) -> list[str]:
+    """Returns unique non-empty tag titles from the given string."""
     tag_titles = [tag_title.strip().lower() for tag_title in tags.split(",")]
-    _create_non_existent_tags_from_(tag_titles, db)
-    return tag_titles
+    return list(dict.fromkeys(filter(None, tag_titles)))
+
+
+def _get_tag_ids_from_db(db: Session, tag_titles: list[str]) -> dict:
+    """Returns tag ids by titles with one 'IN' query and caches them."""
+    tag_ids = dict(
+        db.query(Tag.title, Tag.id).filter(Tag.title.in_(tag_titles)).all()
+    )
+    for tag_title, tag_id in tag_ids.items():
+        tag_id_cache.set(tag_title, tag_id)
+    return tag_ids
+
+
+def _create_tags_from_(db: Session, tag_titles: list[str]) -> dict:
+    """Inserts tags ignoring conflicts (in db transaction) and returns ids
+    of tags with given titles."""
+    insert = get_insert_for_(db)
+    tag_ids = dict(
+        db.execute(
+            insert(Tag)
+            .values(
+                [
+                    {"title": tag_title, "slug": Tag(title=tag_title).slug}
+                    for tag_title in tag_titles
+                ]
+            )
+            .on_conflict_do_nothing()
+            .returning(Tag.title, Tag.id)
+        ).all()
+    )
+    db.info.setdefault("created_tag_ids", {}).update(tag_ids)
+    if conflicted_tag_titles := [
+        tag_title for tag_title in tag_titles if tag_title not in tag_ids
+    ]:
+        tag_ids.update(_get_tag_ids_from_db(db, conflicted_tag_titles))
+    return tag_ids
+
+
+def _get_tag_reference(db: Session, tag_id: int, tag_title: str) -> Tag:
+    """Returns persistent tag instance without loading it from database."""
+    tag = Tag(title=tag_title)
+    tag.id = tag_id
+    make_transient_to_detached(tag)
+    return db.merge(tag, load=False)
+
+
+def resolve_tags(db: Session, tag_titles: list[str]) -> list[Tag]:
+    """Returns tags by titles creating missing ones (in db transaction)."""
+    tag_ids = {
+        tag_title: tag_id_cache.get(tag_title) for tag_title in tag_titles
+    }
+    if missing_tag_titles := [
+        tag_title for tag_title, tag_id in tag_ids.items() if tag_id is None
+    ]:
+        tag_ids.update(_get_tag_ids_from_db(db, missing_tag_titles))
+    if non_existent_tag_titles := [
+        tag_title for tag_title in tag_titles if tag_ids.get(tag_title) is None
+    ]:
+        tag_ids.update(_create_tags_from_(db, non_existent_tag_titles))
+    return [
+        _get_tag_reference(db, tag_ids[tag_title], tag_title)
+        for tag_title in tag_titles
+        if tag_ids.get(tag_title) is not None
+    ]
 
 
 def _get_all_tags_for_post_from_(post_schema: PostSchema, db: Session):
     """Returns all tags for post from given post schema."""
     return (
-        [
-            db.query(Tag).filter(Tag.title == tag_title).first()
-            for tag_title in _get_tag_titles_from_(post_schema.tags, db)
-        ]
+        resolve_tags(db, _get_tag_titles_from_(post_schema.tags))
         if post_schema.tags
         else []
     )
+
+
+def change_tag_posts(
+    db: Session, post: Post | int, tag_titles: Iterable[str], is_added: bool
+) -> None:
+    """Adds post (or its id) to or removes it from tags in tag index after
+    commit."""
+    if tag_titles := set(tag_titles):
+        db.info.setdefault("tag_post_changes", []).append(
+            (post, tag_titles, is_added)
+        )
+
+
+def set_post_tags(db: Session, post: Post, tags: list[Tag]) -> None:
+    """Sets tags of post and records the change for tag index."""
+    tag_titles = {tag.title for tag in tags}
+    old_tag_titles = {tag.title for tag in post.tags}
+    change_tag_posts(db, post, old_tag_titles - tag_titles, False)
+    change_tag_posts(db, post, tag_titles - old_tag_titles, True)
+    post.tags = tags
+
+
+def remove_posts_of_user_from_tags(db: Session, user_id: int) -> None:
+    """Removes posts of user from tags in tag index after commit (call
+    before deleting the user)."""
+    tag_titles_by_post_id = defaultdict(set)
+    for post_id, tag_title in (
+        db.query(post_tags.c.post_id, Tag.title)
+        .join(Tag, Tag.id == post_tags.c.tag_id)
+        .join(Post, Post.id == post_tags.c.post_id)
+        .filter(Post.user_id == user_id)
+    ):
+        tag_titles_by_post_id[post_id].add(tag_title)
+    for post_id, tag_titles in tag_titles_by_post_id.items():
+        change_tag_posts(db, post_id, tag_titles, False)
+
+
+def _get_excerpt_from_(body: str) -> str:
+    """Returns post teaser cut at word boundary from the given body."""
+    text = " ".join(body.split())
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    return text[: EXCERPT_LENGTH - 3].rsplit(" ", 1)[0] + "..."
+
+
+def set_post_summary(post: Post) -> None:
+    """Sets post excerpt and reading time (in minutes) from its body."""
+    post.excerpt = _get_excerpt_from_(post.body)
+    post.reading_time = max(
+        1, math.ceil(len(post.body.split()) / WORDS_PER_MINUTE)
+    )
+
+
+def refresh_post_summaries(db: Session) -> int:
+    """Recomputes excerpts and reading times of all posts in batches (one
+    transaction per batch) and returns number of updated posts."""
+    post_count, last_post_id = 0, 0
+    while True:
+        # Posts are paged by id, since open cursor doesn't survive commits
+        posts = (
+            db.query(Post)
+            .options(load_only(Post.id, Post.body))
+            .filter(Post.id > last_post_id)
+            .order_by(Post.id)
+            .limit(SUMMARY_BATCH_SIZE)
+            .all()
+        )
+        if not posts:
+            return post_count
+        for post in posts:
+            set_post_summary(post)
+        post_count, last_post_id = post_count + len(posts), posts[-1].id
+        db.commit()
+
+
+def get_posts_query_from_(query: Query, summary: bool) -> Query:
+    """Returns posts query loading only columns needed by list views if
+    summary is requested."""
+    if not summary:
+        return query
+    return query.options(
+        load_only(
+            Post.id,
+            Post.title,
+            Post.slug,
+            Post.excerpt,
+            Post.reading_time,
+            Post.created,
+            Post.like_count,
+            Post.comment_count,
+            Post.user_id,
+        ),
+        joinedload(Post.user).load_only(User.id, User.username, User.avatar),
+        selectinload(Post.tags),
+    )
+
+
+# Counters are derived data, so changing them doesn't mark posts as updated
+# (otherwise exports since some time would include all liked posts)
+_KEEP_UPDATED = {Post.updated: Post.updated}
+
+
+def _change_post_counter(
+    db: Session, post_id: int, counter, delta: int
+) -> None:
+    """Changes post counter column by delta (in db transaction)."""
+    db.query(Post).filter(Post.id == post_id).update(
+        {counter: counter + delta, **_KEEP_UPDATED}, synchronize_session=False
+    )
+
+
+def change_like_count(db: Session, post_id: int, delta: int) -> None:
+    """Changes post like count by delta (in db transaction)."""
+    _change_post_counter(db, post_id, Post.like_count, delta)
+
+
+def recount_like_counts_of_(db: Session, post_ids: list[int]) -> None:
+    """Recomputes like counts of posts with given ids (in db transaction)."""
+    db.query(Post).filter(Post.id.in_(post_ids)).update(
+        {
+            Post.like_count: (
+                select(func.count(Like.id))
+                .where(Like.post_id == Post.id)
+                .scalar_subquery()
+            ),
+            **_KEEP_UPDATED,
+        },
+        synchronize_session=False,
+    )
+
+
+def recount_comment_counts_of_(db: Session, post_ids: list[int]) -> None:
+    """Recomputes comment counts of posts with given ids (in db
+    transaction)."""
+    db.query(Post).filter(Post.id.in_(post_ids)).update(
+        {
+            Post.comment_count: (
+                select(func.count(Comment.id))
+                .where(Comment.post_id == Post.id)
+                .scalar_subquery()
+            ),
+            **_KEEP_UPDATED,
+        },
+        synchronize_session=False,
+    )
+
+
+def change_comment_count(db: Session, post_id: int, delta: int) -> None:
+    """Changes post comment count by delta (in db transaction)."""
+    _change_post_counter(db, post_id, Post.comment_count, delta)
+
+
+def recount_post_counters(db: Session) -> int:
+    """Recomputes like and comment counts of all posts and returns number
+    of updated posts."""
+    updated_rows = db.query(Post).update(
+        {
+            Post.like_count: (
+                select(func.count(Like.id))
+                .where(Like.post_id == Post.id)
+                .scalar_subquery()
+            ),
+            Post.comment_count: (
+                select(func.count(Comment.id))
+                .where(Comment.post_id == Post.id)
+                .scalar_subquery()
+            ),
+            **_KEEP_UPDATED,
+        },
+        synchronize_session=False,
+    )
+    db.commit()
+    return updated_rows
@@ -0,0 +1,343 @@
+import os
+import heapq
+import asyncio
+import logging
+from array import array
+from bisect import bisect_left, insort
+from threading import Lock
+from typing import Iterable
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from fastapi.exceptions import HTTPException
+
+from metrics import register_metrics
+from db import AsyncSessionLocal
+from models import Tag, post_tags, tag_index_version
+from pagination import PageParams, decode_cursor, make_page, _get_id_from_
+from response_cache import invalidate_responses
+
+
+# Seconds between checks of database for changes made by other processes
+# (0 disables them)
+TAG_INDEX_REFRESH_INTERVAL = float(os.getenv("TAG_INDEX_REFRESH_INTERVAL", 30))
+
+logger = logging.getLogger("itish.tags")
+
+
+def _contains(post_ids: array, post_id: int) -> bool:
+    """Checks if sorted posting list contains post id."""
+    index = bisect_left(post_ids, post_id)
+    return index < len(post_ids) and post_ids[index] == post_id
+
+
+def _iterate_newest_first(post_ids: array, before_id: int | None):
+    """Yields ids of posting list lower than given id (all if it is None)
+    from the newest."""
+    index = (
+        len(post_ids)
+        if before_id is None
+        else bisect_left(post_ids, before_id)
+    )
+    for index in range(index - 1, -1, -1):
+        yield post_ids[index]
+
+
+class TagIndex:
+    """In-memory index of tags with sorted tag titles for prefix search
+    (autocomplete) and sorted post id lists (posting lists) for tag cloud
+    and filtering posts by tags."""
+
+    def __init__(self) -> None:
+        """Creates empty index (it is filled from database on rebuild)."""
+        self._titles = []
+        self._tags = {}
+        self._titles_by_slug = {}
+        self._post_ids = {}
+        self._is_built = False
+        self._version = None
+        self._lock = Lock()
+        self._task = None
+        self.rebuilds = 0
+        self.refreshes = 0
+        self.searches = 0
+        self.filters = 0
+
+    @staticmethod
+    def _get_version(db: Session) -> int | None:
+        """Returns version of tags and their posts in database which is
+        bumped when tags are created or posts are added to (removed from)
+        tags by any process."""
+        return db.execute(
+            select(tag_index_version.c.version).where(
+                tag_index_version.c.id == 1
+            )
+        ).scalar()
+
+    def rebuild(self, db: Session) -> int:
+        """Fills index with all tags and ids of their posts from database
+        and returns number of tags."""
+        # Taken before reading, so changes made meanwhile cause next rebuild
+        version = self._get_version(db)
+        tags, post_ids = {}, {}
+        for tag_id, title, slug in db.query(Tag.id, Tag.title, Tag.slug):
+            tags[title] = {"id": tag_id, "title": title, "slug": slug}
+            post_ids[tag_id] = array("q")
+        # Posting lists are read sorted from 'post_tags' index
+        for tag_id, post_id in db.execute(
+            select(post_tags.c.tag_id, post_tags.c.post_id).order_by(
+                post_tags.c.tag_id, post_tags.c.post_id
+            )
+        ):
+            post_ids[tag_id].append(post_id)
+        with self._lock:
+            self._tags = tags
+            self._titles = sorted(tags)
+            self._titles_by_slug = {
+                tag["slug"]: title for title, tag in tags.items()
+            }
+            self._post_ids = {
+                title: post_ids[tag["id"]] for title, tag in tags.items()
+            }
+            self._is_built = True
+            self._version = version
+            self.rebuilds += 1
+        return len(tags)
+
+    def refresh(self, db: Session) -> bool:
+        """Rebuilds index if tags or their posts were changed in database
+        (e.g. by other workers) and returns if it was rebuilt."""
+        self.refreshes += 1
+        if self._is_built and self._get_version(db) == self._version:
+            return False
+        self.rebuild(db)
+        return True
+
+    def _ensure_built(self, db: Session) -> None:
+        """Rebuilds index from database if it isn't built yet."""
+        if not self._is_built:
+            self.rebuild(db)
+
+    def add_tag(self, tag_id: int, title: str, slug: str) -> None:
+        """Adds created tag to index."""
+        with self._lock:
+            if not self._is_built or title in self._tags:
+                return
+            self._tags[title] = {"id": tag_id, "title": title, "slug": slug}
+            self._titles_by_slug[slug] = title
+            self._post_ids[title] = array("q")
+            insort(self._titles, title)
+
+    def change_tag_posts(
+        self, changes: Iterable[tuple[int, Iterable[str], bool]]
+    ) -> None:
+        """Adds post ids to (or removes them from) posting lists of tags by
+        (post id, tag titles, is added) changes."""
+        with self._lock:
+            if not self._is_built:
+                return
+            for post_id, titles, is_added in changes:
+                for title in titles:
+                    if (post_ids := self._post_ids.get(title)) is None:
+                        continue
+                    index = bisect_left(post_ids, post_id)
+                    is_found = (
+                        index < len(post_ids) and post_ids[index] == post_id
+                    )
+                    # New posts have the greatest ids, so they are appended
+                    if is_added and not is_found:
+                        post_ids.insert(index, post_id)
+                    elif not is_added and is_found:
+                        del post_ids[index]
+
+    async def _refresh_periodically(self) -> None:
+        """Refreshes index from database every interval."""
+        while True:
+            await asyncio.sleep(TAG_INDEX_REFRESH_INTERVAL)
+            try:
+                async with AsyncSessionLocal() as db:
+                    if await db.run_sync(self.refresh):
+                        # Cached tag clouds and filtered posts are outdated
+                        invalidate_responses("posts", "tags")
+            except Exception:
+                logger.exception("Failed to refresh tag index")
+
+    def start_refreshing(self) -> None:
+        """Starts periodic refreshing."""
+        self._task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop_refreshing(self) -> None:
+        """Stops periodic refreshing."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def _get_tag(self, title: str) -> dict:
+        """Returns tag with post count (call with lock)."""
+        return self._tags[title] | {"post_count": len(self._post_ids[title])}
+
+    def get_post_counts(
+        self, db: Session, titles: Iterable[str]
+    ) -> dict[str, int]:
+        """Returns post counts of tags with given titles."""
+        self._ensure_built(db)
+        with self._lock:
+            return {
+                title: len(self._post_ids[title])
+                for title in titles
+                if title in self._tags
+            }
+
+    def search(self, db: Session, prefix: str, page: PageParams) -> dict:
+        """Returns page of tags starting with prefix ordered by post count
+        (the most used first) and title."""
+        self._ensure_built(db)
+        prefix = prefix.strip().lower()
+        with self._lock:
+            self.searches += 1
+            tags, index = [], bisect_left(self._titles, prefix)
+            while index < len(self._titles) and self._titles[index].startswith(
+                prefix
+            ):
+                tags.append(self._get_tag(self._titles[index]))
+                index += 1
+        tags.sort(key=lambda tag: (-tag["post_count"], tag["title"]))
+        if page.after:
+            after = _get_sort_key_from_(page.after)
+            tags = [
+                tag
+                for tag in tags
+                if (-tag["post_count"], tag["title"]) > after
+            ]
+        return make_page(
+            tags[: page.limit + 1],
+            page.limit,
+            lambda tag: (tag["post_count"], tag["title"]),
+        )
+
+    def _filter_post_ids(
+        self,
+        slugs: list[str],
+        match_all: bool,
+        excluded_slugs: list[str],
+        before_id: int | None,
+        limit: int,
+    ) -> list[int]:
+        """Returns up to limit ids (lower than given id) of posts with all
+        or any of tags and without excluded tags from the newest (call with
+        lock)."""
+        titles = [self._titles_by_slug.get(slug) for slug in slugs]
+        if match_all and None in titles:
+            return []
+        posting_lists = [self._post_ids[title] for title in titles if title]
+        excluded_posting_lists = [
+            self._post_ids[self._titles_by_slug[slug]]
+            for slug in excluded_slugs
+            if slug in self._titles_by_slug
+        ]
+        if not posting_lists:
+            return []
+        if match_all:
+            # Candidates are taken from the shortest list, others are probed
+            posting_lists.sort(key=len)
+            candidates = (
+                post_id
+                for post_id in _iterate_newest_first(
+                    posting_lists[0], before_id
+                )
+                if all(
+                    _contains(post_ids, post_id)
+                    for post_ids in posting_lists[1:]
+                )
+            )
+        else:
+            candidates = heapq.merge(
+                *(
+                    _iterate_newest_first(post_ids, before_id)
+                    for post_ids in posting_lists
+                ),
+                reverse=True,
+            )
+        result = []
+        for post_id in candidates:
+            if result and result[-1] == post_id:
+                continue
+            if any(
+                _contains(post_ids, post_id)
+                for post_ids in excluded_posting_lists
+            ):
+                continue
+            result.append(post_id)
+            if len(result) == limit:
+                break
+        return result
+
+    def filter_post_ids(
+        self,
+        db: Session,
+        slugs: list[str],
+        match_all: bool,
+        excluded_slugs: list[str],
+        page: PageParams,
+    ) -> list[int]:
+        """Returns ids of posts of the requested page (with one more id if
+        there is next page) with all or any of tags with given slugs and
+        without excluded tags from the newest."""
+        self._ensure_built(db)
+        before_id = _get_id_from_(page.after) if page.after else None
+        with self._lock:
+            self.filters += 1
+            return self._filter_post_ids(
+                slugs, match_all, excluded_slugs, before_id, page.limit + 1
+            )
+
+    def get_stats(self) -> dict:
+        """Returns index statistics."""
+        return {
+            "tags": len(self._titles),
+            "post_ids": sum(
+                len(post_ids) for post_ids in self._post_ids.values()
+            ),
+            "rebuilds": self.rebuilds,
+            "refreshes": self.refreshes,
+            "searches": self.searches,
+            "filters": self.filters,
+        }
+
+
+def _get_sort_key_from_(cursor: str) -> tuple[int, str]:
+    """Returns sort key of tag from the given opaque cursor."""
+    values = decode_cursor(cursor)
+    if (
+        len(values) != 2
+        or not isinstance(values[0], int)
+        or not isinstance(values[1], str)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return -values[0], values[1]
+
+
+tag_index = TagIndex()
+register_metrics("tag_index", tag_index.get_stats)
+
+
+async def rebuild_tag_index() -> None:
+    """Fills tag index from database."""
+    async with AsyncSessionLocal() as db:
+        await db.run_sync(tag_index.rebuild)
+
+
+async def start_tag_index_refresh() -> None:
+    """Starts periodic refreshing of tag index if it is enabled."""
+    if TAG_INDEX_REFRESH_INTERVAL > 0:
+        tag_index.start_refreshing()
+
+
+async def stop_tag_index_refresh() -> None:
+    """Stops periodic refreshing of tag index."""
+    await tag_index.stop_refreshing()
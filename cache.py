@@ -0,0 +1,86 @@
+import time
+from threading import Lock
+from typing import Any, Callable, Hashable
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe in-process cache bounded by size with optional TTL."""
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float = None,
+        on_evict: Callable[[Hashable], None] = None,
+    ) -> None:
+        """Creates empty cache with given max size and TTL in seconds."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        """Returns number of items in cache."""
+        return len(self._items)
+
+    def _is_expired(self, expires_at: float | None) -> bool:
+        """Checks if item with given expiration time is expired."""
+        return expires_at is not None and expires_at < time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Returns cached value by key or default."""
+        with self._lock:
+            value, expires_at = self._items.get(key, (_MISSING, None))
+            is_expired = value is not _MISSING and self._is_expired(expires_at)
+            if value is _MISSING or is_expired:
+                if is_expired:
+                    del self._items[key]
+                self.misses += 1
+            else:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+        if is_expired and self.on_evict is not None:
+            self.on_evict(key)
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Caches value by key evicting least recently used items."""
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        evicted_keys = []
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                evicted_keys.append(self._items.popitem(last=False)[0])
+        if self.on_evict is not None:
+            for evicted_key in evicted_keys:
+                self.on_evict(evicted_key)
+
+    def delete(self, key: Hashable) -> None:
+        """Removes cached value by key if it exists."""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self) -> None:
+        """Removes all cached values."""
+        with self._lock:
+            self._items.clear()
+
+    def get_stats(self) -> dict:
+        """Returns cache size and hit/miss statistics."""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+            }
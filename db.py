@@ -1,20 +1,282 @@
 import os
+import math
+import time
+from threading import Lock
+from itertools import cycle
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url, event, exc
+from sqlalchemy.engine import URL, Engine
+from sqlalchemy.pool import Pool, QueuePool
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    create_async_engine,
+    async_sessionmaker,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from dotenv import load_dotenv
 
+from cache import LRUCache
+from metrics import register_metrics
+
 
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = str(os.getenv("DATABASE_URL"))
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))  # seconds
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 10))  # seconds
+# PostgreSQL statement timeout in milliseconds, 0 disables it
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 0))
+
+
+class PoolMetrics:
+    """Connection checkout statistics of one engine pool."""
+
+    def __init__(self) -> None:
+        """Creates empty statistics."""
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0  # seconds
+        self.max_wait = 0.0  # seconds
+        self._lock = Lock()
+
+    def record_checkout(self, *args) -> None:
+        """Records connection checkout (pool 'checkout' event listener)."""
+        with self._lock:
+            self.checkouts += 1
+
+    def record_wait(self, wait: float, timed_out: bool) -> None:
+        """Records time spent waiting for connection from pool."""
+        with self._lock:
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.timeouts += timed_out
+
+    def get_stats(self, pool: Pool) -> dict:
+        """Returns checkout statistics and current state of given pool."""
+        with self._lock:
+            stats = {
+                "pool": type(pool).__name__,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": (
+                    self.total_wait / self.checkouts * 1000
+                    if self.checkouts
+                    else 0.0
+                ),
+                "max_wait_ms": self.max_wait * 1000,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=pool.overflow(),
+            )
+        return stats
+
+
+class _TimedPoolMixin:
+    """Mixin for queue pools measuring time of waiting for connection."""
+
+    pool_metrics: PoolMetrics
+
+    def _do_get(self):
+        """Returns connection from pool recording waiting time."""
+        started, timed_out = time.perf_counter(), False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.pool_metrics.record_wait(
+                time.perf_counter() - started, timed_out
+            )
+
+
+def _get_connect_args_for_(url: URL) -> dict:
+    """Returns dialect-specific connection arguments for given URL."""
+    driver = url.get_driver_name()
+    if url.get_backend_name() == "sqlite":
+        return {"check_same_thread": False} if driver == "pysqlite" else {}
+    if url.get_backend_name() != "postgresql":
+        return {}
+    if driver == "asyncpg":
+        connect_args = {"timeout": DB_CONNECT_TIMEOUT}
+        if DB_STATEMENT_TIMEOUT:
+            connect_args["server_settings"] = {
+                "statement_timeout": str(DB_STATEMENT_TIMEOUT)
+            }
+        return connect_args
+    connect_args = {"connect_timeout": DB_CONNECT_TIMEOUT}
+    if DB_STATEMENT_TIMEOUT:
+        connect_args[
+            "options"
+        ] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"
+    return connect_args
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record) -> None:
+    """Enables foreign key constraints (and their cascades) on new SQLite
+    connection ('connect' event listener)."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def create_engine_from_(url: str, name: str, is_async: bool = False):
+    """Returns (async) engine for given URL configured from pool settings
+    and registers metrics of its pool under given name."""
+    url = make_url(url)
+    pool_metrics = PoolMetrics()
+    engine_options = {
+        "connect_args": _get_connect_args_for_(url),
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    pool_class = url.get_dialect().get_pool_class(url)
+    # Other pools (e.g. for SQLite) don't queue connections
+    if issubclass(pool_class, QueuePool):
+        engine_options.update(
+            poolclass=type(
+                f"Timed{pool_class.__name__}",
+                (_TimedPoolMixin, pool_class),
+                {"pool_metrics": pool_metrics},
+            ),
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+    new_engine = (create_async_engine if is_async else create_engine)(
+        url, **engine_options
+    )
+    sync_engine: Engine = getattr(new_engine, "sync_engine", new_engine)
+    event.listen(sync_engine, "checkout", pool_metrics.record_checkout)
+    if url.get_backend_name() == "sqlite":
+        event.listen(sync_engine, "connect", _enable_sqlite_foreign_keys)
+    register_metrics(
+        f"{name}_pool", lambda: pool_metrics.get_stats(sync_engine.pool)
+    )
+    return new_engine
+
+
+engine = create_engine_from_(SQLALCHEMY_DATABASE_URL, name="db")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async drivers for database backends
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+
+def _get_async_url_from_(url: str) -> str:
+    """Returns given database URL with async driver."""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    return str(
+        url.set(drivername=f"{url.get_backend_name()}+{driver}")
+        if driver
+        else url
+    )
+
+
+ASYNC_SQLALCHEMY_DATABASE_URL = str(
+    os.getenv("ASYNC_DATABASE_URL")
+    or _get_async_url_from_(SQLALCHEMY_DATABASE_URL)
+)
+
+async_engine = create_engine_from_(
+    ASYNC_SQLALCHEMY_DATABASE_URL, name="async_db", is_async=True
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False)
+
+# Comma-separated URLs of read replicas of the primary database
+REPLICA_DATABASE_URLS = [
+    url.strip()
+    for url in os.getenv("REPLICA_DATABASE_URLS", "").split(",")
+    if url.strip()
+]
+# Seconds for which clients read from primary after their own writes
+# (should exceed replication lag)
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 5))
+READ_YOUR_WRITES_CLIENTS = int(os.getenv("READ_YOUR_WRITES_CLIENTS", 10000))
+# Cookie with time of the last write of client, so any worker routes its
+# reads to primary
+READ_YOUR_WRITES_COOKIE = "last_write"
+
+replica_engines = [
+    create_engine_from_(
+        _get_async_url_from_(url), name=f"replica{i}_db", is_async=True
+    )
+    for i, url in enumerate(REPLICA_DATABASE_URLS)
+]
+_replica_engine_cycle = cycle(replica_engines)
+_primary_read_clients = LRUCache(
+    maxsize=READ_YOUR_WRITES_CLIENTS, ttl=READ_YOUR_WRITES_WINDOW
+)
+_read_routing_stats = {"primary_reads": 0, "replica_reads": 0}
+
+
+@event.listens_for(Session, "after_commit")
+def _stick_clients_to_primary(db: Session) -> None:
+    """Routes reads of clients who committed write to primary database
+    for read-your-writes window (in this process by client key and in all
+    processes by cookie set on response of the write)."""
+    if not replica_engines:
+        return
+    if (client_key := db.info.get("client_key")) is not None:
+        _primary_read_clients.set(client_key, True)
+    if (response := db.info.get("response")) is not None:
+        response.set_cookie(
+            READ_YOUR_WRITES_COOKIE,
+            f"{time.time():.3f}",
+            max_age=math.ceil(READ_YOUR_WRITES_WINDOW),
+            httponly=True,
+            samesite="lax",
+        )
+
+
+def _is_recent_write(last_write: str | None) -> bool:
+    """Checks if time of the last write (from client cookie) is within
+    read-your-writes window."""
+    try:
+        written_ago = time.time() - float(last_write)
+    except (TypeError, ValueError):
+        return False
+    # Times from the future aren't trusted to pin client to primary
+    return -1 <= written_ago <= READ_YOUR_WRITES_WINDOW
+
+
+def get_read_engine_for_(
+    client_key: str | None, last_write: str | None = None
+) -> AsyncEngine:
+    """Returns replica engine (round robin) or primary one if there are
+    no replicas or client has written recently."""
+    if (
+        not replica_engines
+        or _is_recent_write(last_write)
+        or (client_key is not None and _primary_read_clients.get(client_key))
+    ):
+        _read_routing_stats["primary_reads"] += 1
+        return async_engine
+    _read_routing_stats["replica_reads"] += 1
+    return next(_replica_engine_cycle)
+
+
+register_metrics(
+    "read_routing",
+    lambda: {
+        **_read_routing_stats,
+        "replicas": len(replica_engines),
+        "sticky_clients": len(_primary_read_clients),
+    },
+)
+
 Base = declarative_base()
 
 
@@ -29,3 +291,10 @@ def add_commit_and_refresh(db: Session, model: Base):
     """Adds, commits and refreshes model instance and returns it."""
     db.add(model)
     return commit_and_refresh(db, model)
+
+
+def get_insert_for_(db: Session):
+    """Returns dialect-specific insert supporting 'ON CONFLICT' clauses."""
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert
+    return sqlite.insert
@@ -1,4 +1,5 @@
 from functools import wraps
+from inspect import iscoroutinefunction
 from typing import Callable
 
 from sqlalchemy.orm.exc import NoResultFound
@@ -9,6 +10,21 @@ def catch_model_not_fount(model: str) -> Callable:
     """Returns decorator for catching model not found exception."""
 
     def wrapper(func: Callable) -> Callable:
+        if iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_inner(*args, **kwargs):
+                """Wraps coroutine function for catching model not found
+                exception."""
+                try:
+                    return await func(*args, **kwargs)
+                except NoResultFound:
+                    raise HTTPException(
+                        status_code=404, detail=f"{model} not found"
+                    )
+
+            return async_inner
+
         @wraps(func)
         def inner(*args, **kwargs):
             """Wraps function for catching model not found exception."""
@@ -1,4 +1,14 @@
-from db import SessionLocal
+import hashlib
+
+from fastapi import Query, Request, Response
+
+from db import (
+    SessionLocal,
+    AsyncSessionLocal,
+    READ_YOUR_WRITES_COOKIE,
+    get_read_engine_for_,
+)
+from pagination import PageParams, DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT
 
 
 def get_db():
@@ -7,3 +17,39 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def _get_client_key_from_(request: Request) -> str | None:
+    """Returns key identifying client by its authorization header."""
+    if authorization := request.headers.get("authorization"):
+        return hashlib.blake2b(
+            authorization.encode(), digest_size=16
+        ).hexdigest()
+    return None
+
+
+async def get_async_db(request: Request, response: Response):
+    async with AsyncSessionLocal() as db:
+        # Commits make the client read from primary for a while
+        db.info["client_key"] = _get_client_key_from_(request)
+        db.info["response"] = response
+        yield db
+
+
+async def get_read_db(request: Request):
+    """Yields session of replica (or primary) database for read-only
+    routes."""
+    engine = get_read_engine_for_(
+        _get_client_key_from_(request),
+        request.cookies.get(READ_YOUR_WRITES_COOKIE),
+    )
+    async with AsyncSessionLocal(bind=engine) as db:
+        yield db
+
+
+def get_page_params(
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    after: str = None,
+) -> PageParams:
+    """Returns parameters of the requested page from query string."""
+    return PageParams(limit=limit, after=after)
@@ -0,0 +1,120 @@
+import os
+import json
+from datetime import datetime
+from collections import defaultdict
+from typing import AsyncIterator
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import APIRouter, Depends
+from fastapi.exceptions import HTTPException
+from fastapi.responses import StreamingResponse
+
+from db import AsyncSessionLocal, get_read_engine_for_
+from models import User, Post, Tag, Comment, post_tags
+from auth.dependencies import get_current_user
+
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+
+export_router = APIRouter()
+
+# Export name -> (record type, exported columns, column of 'since' filter)
+EXPORTS = {
+    "posts": (
+        "post",
+        (
+            Post.id,
+            Post.title,
+            Post.slug,
+            Post.body,
+            Post.excerpt,
+            Post.reading_time,
+            Post.created,
+            Post.updated,
+            Post.like_count,
+            Post.comment_count,
+            Post.user_id,
+        ),
+        Post.updated,
+    ),
+    "comments": (
+        "comment",
+        (
+            Comment.id,
+            Comment.body,
+            Comment.created,
+            Comment.updated,
+            Comment.user_id,
+            Comment.post_id,
+        ),
+        Comment.updated,
+    ),
+    "tags": ("tag", (Tag.id, Tag.title, Tag.slug, Tag.created), Tag.created),
+    # Without password hashes and emails
+    "users": (
+        "user",
+        (User.id, User.username, User.avatar, User.created, User.updated),
+        User.updated,
+    ),
+}
+
+
+def _encode(value) -> str:
+    """Returns JSON representation of values unknown to JSON encoder."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def _add_tags_to_(db: AsyncSession, posts: list[dict]) -> None:
+    """Adds comma-separated tag titles to given post rows."""
+    tag_titles = defaultdict(list)
+    for post_id, tag_title in await db.execute(
+        select(post_tags.c.post_id, Tag.title)
+        .join(Tag, Tag.id == post_tags.c.tag_id)
+        .where(post_tags.c.post_id.in_([post["id"] for post in posts]))
+    ):
+        tag_titles[post_id].append(tag_title)
+    for post in posts:
+        post["tags"] = ", ".join(tag_titles[post["id"]])
+
+
+async def _get_ndjson_lines(
+    name: str, since: datetime | None
+) -> AsyncIterator[bytes]:
+    """Yields chunks of NDJSON lines read with server-side cursor."""
+    record_type, columns, since_column = EXPORTS[name]
+    query = select(*columns).order_by(columns[0])
+    if since is not None:
+        query = query.where(since_column >= since)
+    # Session outlives request dependencies while response is streamed
+    async with AsyncSessionLocal(bind=get_read_engine_for_(None)) as db:
+        result = await db.stream(
+            query.execution_options(yield_per=EXPORT_CHUNK_SIZE)
+        )
+        async for rows in result.partitions():
+            rows = [dict(row._mapping) for row in rows]
+            if record_type == "post":
+                await _add_tags_to_(db, rows)
+            yield "".join(
+                json.dumps({"type": record_type, **row}, default=_encode)
+                + "\n"
+                for row in rows
+            ).encode()
+
+
+@export_router.get("/{name}")
+async def export(
+    name: str, since: datetime = None, user=Depends(get_current_user)
+):
+    """Streams posts, comments, tags or users (changed since given time)
+    as NDJSON."""
+    if name not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if since is not None and since.tzinfo is not None:
+        # Times are stored as naive local times
+        since = since.astimezone().replace(tzinfo=None)
+    return StreamingResponse(
+        _get_ndjson_lines(name, since), media_type="application/x-ndjson"
+    )
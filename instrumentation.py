@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import heapq
+import logging
+from threading import Lock
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from metrics import register_metrics
+from db import engine, async_engine, replica_engines
+
+
+SQL_SLOWEST_STATEMENTS = int(os.getenv("SQL_SLOWEST_STATEMENTS", 3))
+# Dev/test mode: flag statements repeated at least this many times in one
+# request (N+1 pattern), 0 disables the detector
+SQL_REPEATED_STATEMENT_THRESHOLD = int(
+    os.getenv("SQL_REPEATED_STATEMENT_THRESHOLD", 0)
+)
+
+logger = logging.getLogger("itish.sql")
+
+
+class QueryStats:
+    """SQL statistics of one request."""
+
+    def __init__(self) -> None:
+        """Creates empty statistics."""
+        self.count = 0
+        self.duration = 0.0  # seconds
+        self.statements = Counter()
+        self.slowest = []  # min-heap of (duration, statement)
+
+    def add(self, statement: str, duration: float) -> None:
+        """Records executed statement with its duration."""
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+        item = (duration, statement)
+        if len(self.slowest) < SQL_SLOWEST_STATEMENTS:
+            heapq.heappush(self.slowest, item)
+        elif SQL_SLOWEST_STATEMENTS:
+            heapq.heappushpop(self.slowest, item)
+
+    def get_repeated_statements(self, threshold: int) -> dict[str, int]:
+        """Returns statements executed at least threshold times."""
+        return {
+            statement: count
+            for statement, count in self.statements.items()
+            if count >= threshold
+        }
+
+
+_query_stats: ContextVar[QueryStats | None] = ContextVar(
+    "query_stats", default=None
+)
+
+# Route -> statement -> max times it was repeated in one request
+_repeated_statements_by_route = defaultdict(dict)
+_repeated_statements_lock = Lock()
+
+
+def _before_cursor_execute(conn, cursor, statement, params, context, many):
+    """Remembers time when statement execution started."""
+    context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, params, context, many):
+    """Records executed statement in statistics of current request."""
+    if (query_stats := _query_stats.get()) is not None:
+        query_stats.add(
+            statement, time.perf_counter() - context._query_started
+        )
+
+
+for _engine in (
+    engine,
+    async_engine.sync_engine,
+    *(replica_engine.sync_engine for replica_engine in replica_engines),
+):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _flag_repeated_statements(route: str, query_stats: QueryStats) -> None:
+    """Logs and remembers statements repeated in request (N+1 pattern)."""
+    repeated_statements = query_stats.get_repeated_statements(
+        SQL_REPEATED_STATEMENT_THRESHOLD
+    )
+    for statement, count in repeated_statements.items():
+        logger.warning(
+            json.dumps(
+                {
+                    "event": "repeated_statement",
+                    "route": route,
+                    "count": count,
+                    "statement": statement,
+                }
+            )
+        )
+        with _repeated_statements_lock:
+            route_statements = _repeated_statements_by_route[route]
+            route_statements[statement] = max(
+                count, route_statements.get(statement, 0)
+            )
+
+
+def get_repeated_statements() -> dict:
+    """Returns statements repeated in one request by route."""
+    with _repeated_statements_lock:
+        return {
+            route: dict(statements)
+            for route, statements in _repeated_statements_by_route.items()
+        }
+
+
+register_metrics("sql_repeated_statements", get_repeated_statements)
+
+
+def _get_server_timing(query_stats: QueryStats) -> bytes:
+    """Returns 'Server-Timing' header value with database metrics."""
+    return (
+        f"db;dur={query_stats.duration * 1000:.2f};"
+        f'desc="{query_stats.count} queries"'
+    ).encode()
+
+
+def _log_request(
+    scope: dict, route: str, status: int, query_stats: QueryStats
+) -> None:
+    """Writes structured log record with SQL statistics of request."""
+    logger.info(
+        json.dumps(
+            {
+                "event": "request_sql",
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route,
+                "status": status,
+                "queries": query_stats.count,
+                "db_ms": round(query_stats.duration * 1000, 3),
+                "slowest": [
+                    {"ms": round(duration * 1000, 3), "statement": statement}
+                    for duration, statement in sorted(
+                        query_stats.slowest, reverse=True
+                    )
+                ],
+            }
+        )
+    )
+
+
+class SQLInstrumentationMiddleware:
+    """ASGI middleware recording SQL statistics of every HTTP request."""
+
+    def __init__(self, app) -> None:
+        """Wraps given ASGI application."""
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        """Records SQL statistics of request and emits them as
+        'Server-Timing' header and structured log record."""
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        query_stats = QueryStats()
+        token = _query_stats.set(query_stats)
+        status = None
+
+        async def send_with_server_timing(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = [
+                    *message["headers"],
+                    (b"server-timing", _get_server_timing(query_stats)),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_server_timing)
+        finally:
+            _query_stats.reset(token)
+            route = getattr(scope.get("route"), "path", scope["path"])
+            _log_request(scope, route, status, query_stats)
+            if SQL_REPEATED_STATEMENT_THRESHOLD:
+                _flag_repeated_statements(
+                    f"{scope['method']} {route}", query_stats
+                )
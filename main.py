@@ -1,19 +1,42 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from db import Base, engine
 from blog.router import blog_router
 from user.router import user_router
 from auth.router import auth_router
+from metrics import metrics_router
+from export import export_router
+from auth.hashing import hashing_service
+from blog.tag_index import (
+    rebuild_tag_index,
+    start_tag_index_refresh,
+    stop_tag_index_refresh,
+)
+from blog.like_buffer import start_like_buffer, stop_like_buffer
+from blog.events import close_event_streams
+from blog.search import warn_about_unindexed_search
+from migrations import check_schema_version
+from rate_limit import RateLimitMiddleware
+from instrumentation import SQLInstrumentationMiddleware
 
 
-Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="ITish API",
     description="API for ITish blog site",
     version="1.0.0",
 )
+app.add_event_handler("startup", check_schema_version)
+app.add_event_handler("startup", hashing_service.start)
+app.add_event_handler("startup", warn_about_unindexed_search)
+app.add_event_handler("startup", rebuild_tag_index)
+app.add_event_handler("startup", start_tag_index_refresh)
+app.add_event_handler("startup", start_like_buffer)
+app.add_event_handler("shutdown", stop_tag_index_refresh)
+app.add_event_handler("shutdown", stop_like_buffer)
+app.add_event_handler("shutdown", close_event_streams)
+app.add_event_handler("shutdown", hashing_service.shutdown)
+app.add_middleware(SQLInstrumentationMiddleware)
+app.add_middleware(RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],
@@ -24,3 +47,5 @@ app.add_middleware(
 app.include_router(blog_router, prefix="/api/blog", tags=["blog"])
 app.include_router(user_router, prefix="/api/user", tags=["user"])
 app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
+app.include_router(export_router, prefix="/api/export", tags=["export"])
+app.include_router(metrics_router, prefix="/api/metrics", tags=["metrics"])
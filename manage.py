@@ -0,0 +1,89 @@
+import json
+import asyncio
+import argparse
+
+from sqlalchemy import text
+
+from metrics import get_all_metrics
+from migrations import migrate
+from db import SessionLocal, AsyncSessionLocal
+from blog.search import rebuild_search_index
+from blog.services import recount_post_counters, refresh_post_summaries
+
+
+def migrate_database() -> None:
+    """Applies pending schema migrations."""
+    for migration in migrate():
+        print(f"Applied migration {migration.version}: {migration.name}.")
+    print("Database schema is up to date.")
+
+
+def recount_counters() -> None:
+    """Recomputes denormalized like and comment counts of posts."""
+    db = SessionLocal()
+    try:
+        print(f"Recounted counters of {recount_post_counters(db)} posts.")
+    finally:
+        db.close()
+
+
+def rebuild_search() -> None:
+    """Refills full-text search index of posts."""
+    db = SessionLocal()
+    try:
+        rebuild_search_index(db)
+        print("Rebuilt search index of posts.")
+    finally:
+        db.close()
+
+
+def refresh_summaries() -> None:
+    """Recomputes excerpts and reading times of posts."""
+    db = SessionLocal()
+    try:
+        print(f"Refreshed summaries of {refresh_post_summaries(db)} posts.")
+    finally:
+        db.close()
+
+
+async def _ping_async_database() -> None:
+    """Runs trivial query through async engine."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("SELECT 1"))
+
+
+def check_database() -> None:
+    """Checks connection of sync and async engines and prints pool metrics."""
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+    finally:
+        db.close()
+    asyncio.run(_ping_async_database())
+    metrics = get_all_metrics()
+    print(
+        json.dumps(
+            {name: metrics[name] for name in ("db_pool", "async_db_pool")},
+            indent=2,
+        )
+    )
+
+
+COMMANDS = {
+    "migrate": migrate_database,
+    "recount-counters": recount_counters,
+    "rebuild-search-index": rebuild_search,
+    "refresh-post-summaries": refresh_summaries,
+    "check-database": check_database,
+}
+
+
+def main() -> None:
+    """Runs management command given in command line arguments."""
+    parser = argparse.ArgumentParser(description="ITish API management")
+    parser.add_argument("command", choices=COMMANDS)
+    COMMANDS[parser.parse_args().command]()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import hmac
+from typing import Callable
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+
+# Bearer token of monitoring clients (metrics aren't served without it)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+metrics_router = APIRouter()
+
+_metric_getters: dict[str, Callable[[], dict]] = {}
+
+
+def register_metrics(name: str, get_metrics: Callable[[], dict]) -> None:
+    """Registers function returning metrics of the given subsystem."""
+    _metric_getters[name] = get_metrics
+
+
+def get_all_metrics() -> dict:
+    """Returns metrics of all registered subsystems."""
+    return {
+        name: get_metrics() for name, get_metrics in _metric_getters.items()
+    }
+
+
+def check_metrics_token(authorization: str = Header(None)) -> None:
+    """Checks that request carries metrics bearer token (metrics are hidden
+    if the token isn't set)."""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(
+        (authorization or "").encode(), f"Bearer {METRICS_TOKEN}".encode()
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@metrics_router.get("/", dependencies=[Depends(check_metrics_token)])
+def get_metrics():
+    """Returns in-process metrics of all registered subsystems."""
+    return get_all_metrics()
@@ -0,0 +1,268 @@
+from datetime import datetime
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import (
+    MetaData,
+    Table,
+    Column,
+    Integer,
+    String,
+    DateTime,
+    inspect,
+    select,
+    insert,
+    text,
+    func,
+)
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateColumn
+
+import models
+from db import Base, engine, async_engine
+from blog import services, search  # 'search' creates full-text search table
+
+
+# Key of PostgreSQL advisory lock held while migrations are applied
+MIGRATION_LOCK_ID = 20230801
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied", DateTime, nullable=False),
+)
+
+
+@dataclass
+class Migration:
+    """Versioned schema change (it must be safe to apply to database
+    created from current models, e.g. by the first migration)."""
+
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+
+
+def _add_missing_columns(
+    connection: Connection, table: Table, *column_names: str
+) -> None:
+    """Adds columns of model table missing in database."""
+    existing_column_names = {
+        column["name"]
+        for column in inspect(connection).get_columns(table.name)
+    }
+    for column_name in column_names:
+        if column_name in existing_column_names:
+            continue
+        column_ddl = CreateColumn(table.c[column_name]).compile(
+            dialect=connection.dialect
+        )
+        connection.exec_driver_sql(
+            f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"
+        )
+
+
+def _create_missing_indexes(
+    connection: Connection, table: Table, column_names: set[str] = None
+) -> None:
+    """Creates indexes of model table (only on given columns if they are
+    given) missing in database."""
+    for index in table.indexes:
+        if column_names is None or set(index.columns.keys()) <= column_names:
+            index.create(connection, checkfirst=True)
+
+
+def _create_unique_index(
+    connection: Connection, table: Table, name: str, *column_names: str
+) -> None:
+    """Creates unique index unless table has unique constraint or index
+    with the same name."""
+    inspector = inspect(connection)
+    if name in {
+        constraint["name"]
+        for constraint in inspector.get_unique_constraints(table.name)
+    } | {index["name"] for index in inspector.get_indexes(table.name)}:
+        return
+    connection.exec_driver_sql(
+        f"CREATE UNIQUE INDEX {name} ON {table.name} "
+        f"({', '.join(column_names)})"
+    )
+
+
+def _create_tables(connection: Connection) -> None:
+    """Creates missing tables (with indexes) and full-text search table."""
+    Base.metadata.create_all(connection)
+
+
+def _add_post_counters(connection: Connection) -> None:
+    """Adds denormalized like and comment counts of posts."""
+    _add_missing_columns(
+        connection, models.Post.__table__, "like_count", "comment_count"
+    )
+    with Session(bind=connection) as db:
+        services.recount_post_counters(db)
+
+
+def _add_post_summaries(connection: Connection) -> None:
+    """Adds excerpts and reading times of posts."""
+    _add_missing_columns(
+        connection, models.Post.__table__, "excerpt", "reading_time"
+    )
+    with Session(bind=connection) as db:
+        services.refresh_post_summaries(db)
+
+
+def _add_update_times(connection: Connection) -> None:
+    """Adds update times of users, posts and comments and creation times of
+    tags (with indexes)."""
+    for model, column_name in (
+        (models.User, "updated"),
+        (models.Post, "updated"),
+        (models.Comment, "updated"),
+        (models.Tag, "created"),
+    ):
+        _add_missing_columns(connection, model.__table__, column_name)
+        _create_missing_indexes(connection, model.__table__, {column_name})
+
+
+def _delete_duplicate_post_tags(connection: Connection) -> None:
+    """Leaves one row of each duplicated post tag."""
+    post_tags = models.post_tags
+    duplicates = connection.execute(
+        select(post_tags.c.post_id, post_tags.c.tag_id)
+        .group_by(post_tags.c.post_id, post_tags.c.tag_id)
+        .having(func.count() > 1)
+    ).all()
+    for post_id, tag_id in duplicates:
+        where = (post_tags.c.post_id == post_id) & (
+            post_tags.c.tag_id == tag_id
+        )
+        connection.execute(post_tags.delete().where(where))
+        connection.execute(
+            post_tags.insert().values(post_id=post_id, tag_id=tag_id)
+        )
+
+
+def _add_indexes_and_unique_likes(connection: Connection) -> None:
+    """Removes duplicate likes and post tags, then indexes foreign keys and
+    makes likes and post tags unique."""
+    connection.exec_driver_sql(
+        "DELETE FROM likes WHERE id NOT IN "
+        "(SELECT MIN(id) FROM likes GROUP BY user_id, post_id)"
+    )
+    _delete_duplicate_post_tags(connection)
+    with Session(bind=connection) as db:
+        services.recount_post_counters(db)
+    for table in Base.metadata.sorted_tables:
+        _create_missing_indexes(connection, table)
+    _create_unique_index(
+        connection,
+        models.Like.__table__,
+        "uq_likes_user_id_post_id",
+        "user_id",
+        "post_id",
+    )
+    if not inspect(connection).get_pk_constraint("post_tags")[
+        "constrained_columns"
+    ]:
+        # Primary key can't be added to existing SQLite table
+        _create_unique_index(
+            connection,
+            models.post_tags,
+            "uq_post_tags_post_id_tag_id",
+            "post_id",
+            "tag_id",
+        )
+
+
+def _add_follows_and_timelines(connection: Connection) -> None:
+    """Adds follower counts of tags, follows and timelines tables."""
+    _add_missing_columns(connection, models.Tag.__table__, "follower_count")
+    Base.metadata.create_all(
+        connection,
+        tables=[
+            models.tag_follows,
+            models.user_follows,
+            models.timeline_entries,
+            models.timelines,
+        ],
+    )
+
+
+def _add_tag_index_version(connection: Connection) -> None:
+    """Adds version of tags and their posts checked by tag indexes."""
+    table = models.tag_index_version
+    table.create(connection, checkfirst=True)
+    if connection.execute(select(func.count()).select_from(table)).scalar():
+        return
+    connection.execute(insert(table).values(id=1, version=0))
+
+
+# Update times go first as updates of posts set them
+MIGRATIONS = [
+    Migration(1, "create tables", _create_tables),
+    Migration(2, "add update times", _add_update_times),
+    Migration(3, "add post counters", _add_post_counters),
+    Migration(4, "add post summaries", _add_post_summaries),
+    Migration(
+        5, "add indexes and unique likes", _add_indexes_and_unique_likes
+    ),
+    Migration(6, "add follows and timelines", _add_follows_and_timelines),
+    Migration(7, "add search index", search.create_search_index),
+    Migration(8, "add tag index version", _add_tag_index_version),
+]
+
+
+def get_pending_migrations(connection: Connection) -> list[Migration]:
+    """Returns migrations not applied to database yet."""
+    if not inspect(connection).has_table(schema_migrations.name):
+        return MIGRATIONS
+    applied_versions = set(
+        connection.execute(select(schema_migrations.c.version)).scalars()
+    )
+    return [
+        migration
+        for migration in MIGRATIONS
+        if migration.version not in applied_versions
+    ]
+
+
+def migrate(engine: Engine = engine) -> list[Migration]:
+    """Applies pending migrations (each in its own transaction) and returns
+    them."""
+    applied_migrations = []
+    for migration in MIGRATIONS:
+        with engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                # Concurrent runs wait instead of applying migration twice
+                connection.execute(
+                    text("SELECT pg_advisory_xact_lock(:id)"),
+                    {"id": MIGRATION_LOCK_ID},
+                )
+            schema_migrations.create(connection, checkfirst=True)
+            if migration not in get_pending_migrations(connection):
+                continue
+            migration.apply(connection)
+            connection.execute(
+                insert(schema_migrations).values(
+                    version=migration.version,
+                    name=migration.name,
+                    applied=datetime.today(),
+                )
+            )
+        applied_migrations.append(migration)
+    return applied_migrations
+
+
+async def check_schema_version() -> None:
+    """Checks that all migrations are applied to database."""
+    async with async_engine.connect() as connection:
+        pending_migrations = await connection.run_sync(get_pending_migrations)
+    if pending_migrations:
+        raise RuntimeError(
+            f"Database has {len(pending_migrations)} pending migrations, "
+            "run 'python manage.py migrate'"
+        )
@@ -4,6 +4,8 @@ from datetime import datetime
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy import (
     Table,
+    Index,
+    UniqueConstraint,
     Column,
     Integer,
     String,
@@ -27,6 +29,9 @@ class User(Base):
     password = Column(String(110), nullable=False)
     created = Column(DateTime, default=datetime.today())
     avatar = Column(String, nullable=True, default="media/avatars/default.png")
+    updated = Column(
+        DateTime, default=datetime.today, onupdate=datetime.today, index=True
+    )
 
     posts = relationship(
         "Post",
@@ -47,10 +52,10 @@ class User(Base):
         passive_deletes=True,
     )
 
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(self, *args, hashed_password: str = None, **kwargs) -> None:
         """Adds hashed password to user instance."""
         super(User, self).__init__(*args, **kwargs)
-        self.password = get_hashed_password(self.password)
+        self.password = hashed_password or get_hashed_password(self.password)
 
     def is_valid_(self, password: str) -> bool:
         """Checks if given password is valid."""
@@ -81,8 +86,9 @@ class _ModelWithSlug:
 post_tags = Table(
     "post_tags",
     Base.metadata,
-    Column("post_id", Integer, ForeignKey("posts.id")),
-    Column("tag_id", Integer, ForeignKey("tags.id")),
+    Column("post_id", Integer, ForeignKey("posts.id"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id"), primary_key=True),
+    Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),
 )
 
 
@@ -90,12 +96,24 @@ class Post(_ModelWithSlug, Base):
     """Model for storing information about posts"""
 
     __tablename__ = "posts"
+    __table_args__ = (Index("ix_posts_user_id_id", "user_id", "id"),)
 
     id = Column(Integer, primary_key=True)
     title = Column(String(70), nullable=False, unique=True)
     slug = Column(String(70), nullable=True, unique=True)
     body = Column(Text, nullable=False)
+    excerpt = Column(String(300), nullable=True)
+    reading_time = Column(
+        Integer, nullable=False, default=1, server_default="1"
+    )
     created = Column(DateTime, default=datetime.today())
+    updated = Column(
+        DateTime, default=datetime.today, onupdate=datetime.today, index=True
+    )
+    like_count = Column(Integer, nullable=False, default=0, server_default="0")
+    comment_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
     user_id = Column(
         Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
@@ -129,6 +147,10 @@ class Tag(_ModelWithSlug, Base):
     id = Column(Integer, primary_key=True)
     title = Column(String(30), nullable=False, unique=True)
     slug = Column(String(30), nullable=False, unique=True)
+    created = Column(DateTime, default=datetime.today, index=True)
+    follower_count = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )
 
     def __init__(self, *args, **kwargs) -> None:
         """For setting correct slug during initializing"""
@@ -140,10 +162,17 @@ class Comment(Base):
     """Model for storing information about comments"""
 
     __tablename__ = "comments"
+    __table_args__ = (
+        Index("ix_comments_post_id_id", "post_id", "id"),
+        Index("ix_comments_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     body = Column(Text, nullable=False)
     created = Column(DateTime, default=datetime.today())
+    updated = Column(
+        DateTime, default=datetime.today, onupdate=datetime.today, index=True
+    )
     user_id = Column(
         Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
@@ -156,6 +185,13 @@ class Like(Base):
     """Model for storing information about likes"""
 
     __tablename__ = "likes"
+    __table_args__ = (
+        UniqueConstraint(
+            "user_id", "post_id", name="uq_likes_user_id_post_id"
+        ),
+        Index("ix_likes_post_id_id", "post_id", "id"),
+        Index("ix_likes_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     created = Column(DateTime, default=datetime.today())
@@ -165,3 +201,82 @@ class Like(Base):
     post_id = Column(
         Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False
     )
+
+
+# Tables of users following tags and other users
+tag_follows = Table(
+    "tag_follows",
+    Base.metadata,
+    Column(
+        "user_id",
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column(
+        "tag_id",
+        Integer,
+        ForeignKey("tags.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Index("ix_tag_follows_tag_id_user_id", "tag_id", "user_id"),
+)
+user_follows = Table(
+    "user_follows",
+    Base.metadata,
+    Column(
+        "follower_id",
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column(
+        "followed_id",
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Index(
+        "ix_user_follows_followed_id_follower_id", "followed_id", "follower_id"
+    ),
+)
+
+# Precomputed feeds: ids of posts in timeline of each user and (approximate)
+# number of them, used for trimming timelines
+timeline_entries = Table(
+    "timeline_entries",
+    Base.metadata,
+    Column(
+        "user_id",
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column(
+        "post_id",
+        Integer,
+        ForeignKey("posts.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Index("ix_timeline_entries_post_id", "post_id"),
+)
+timelines = Table(
+    "timelines",
+    Base.metadata,
+    Column(
+        "user_id",
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column("size", Integer, nullable=False, default=0),
+)
+
+# Single row with version of tags and their posts, bumped by transactions
+# changing them, so workers know when to rebuild their tag indexes
+tag_index_version = Table(
+    "tag_index_version",
+    Base.metadata,
+    Column("id", Integer, primary_key=True),
+    Column("version", Integer, nullable=False, default=0),
+)
@@ -0,0 +1,70 @@
+import json
+import base64
+import binascii
+from typing import Any
+from dataclasses import dataclass
+
+from sqlalchemy.orm import Query
+from fastapi.exceptions import HTTPException
+
+
+DEFAULT_PAGE_LIMIT = 20
+MAX_PAGE_LIMIT = 100
+
+
+@dataclass
+class PageParams:
+    """Parameters of the requested page."""
+
+    limit: int = DEFAULT_PAGE_LIMIT
+    after: str = None
+
+
+def encode_cursor(*values: Any) -> str:
+    """Returns opaque cursor from the given key values."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Returns key values from the given opaque cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        values = None
+    if not isinstance(values, list) or not values:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def _get_id_from_(cursor: str) -> int:
+    """Returns row id from the given opaque cursor."""
+    values = decode_cursor(cursor)
+    if not isinstance(values[0], int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values[0]
+
+
+def make_page(items: list, limit: int, get_cursor_values) -> dict:
+    """Returns page from the given items fetched with 'limit + 1' rows."""
+    has_next_page = len(items) > limit
+    items = items[:limit]
+    return {
+        "items": items,
+        "next_cursor": (
+            encode_cursor(*get_cursor_values(items[-1]))
+            if has_next_page
+            else None
+        ),
+    }
+
+
+def paginate(query: Query, id_column, page: PageParams) -> dict:
+    """Returns page of the given query using keyset pagination by id desc."""
+    if page.after:
+        query = query.filter(id_column < _get_id_from_(page.after))
+    items = query.order_by(id_column.desc()).limit(page.limit + 1).all()
+    return make_page(
+        items, page.limit, lambda item: (getattr(item, id_column.key),)
+    )
@@ -0,0 +1,224 @@
+import os
+import json
+import math
+import time
+import asyncio
+from collections import Counter
+
+from jose import jwt
+
+from cache import LRUCache
+from auth.utils import ALGORITHM, JWT_SECRET_KEY
+from metrics import register_metrics
+
+
+def _parse_rate(rate: str) -> tuple[int, float] | None:
+    """Returns bucket capacity and refill rate (tokens per second) from
+    'requests/seconds' string or None if limit is disabled."""
+    requests, _, seconds = rate.partition("/")
+    if not int(requests):
+        return None
+    return int(requests), int(requests) / float(seconds or 1)
+
+
+# Route class -> 'requests/seconds' per client ('0' disables the limit)
+RATE_LIMITS = {
+    route_class: _parse_rate(
+        os.getenv(f"RATE_LIMIT_{route_class.upper()}", default)
+    )
+    for route_class, default in (
+        ("auth", "10/60"),
+        ("write", "120/60"),
+        ("read", "600/60"),
+    )
+}
+RATE_LIMIT_CLIENTS = int(os.getenv("RATE_LIMIT_CLIENTS", 10000))
+# Requests handled at once (0 disables admission control)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 64))
+MAX_QUEUED_REQUESTS = int(os.getenv("MAX_QUEUED_REQUESTS", 128))
+REQUEST_QUEUE_TIMEOUT = float(os.getenv("REQUEST_QUEUE_TIMEOUT", 5))  # sec
+
+# Monitoring must work when server is overloaded, so it doesn't wait in queue
+UNQUEUED_PATH_PREFIXES = ("/api/metrics",)
+# Long-lived event streams don't take request slots (broker limits them)
+UNQUEUED_PATH_SUFFIXES = ("/events",)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously up to its capacity."""
+
+    def __init__(self, capacity: int, refill_rate: float) -> None:
+        """Creates full bucket."""
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes token and returns 0 or returns seconds until token is
+        available if bucket is empty."""
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.refill_rate,
+        )
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.refill_rate
+
+
+def _get_route_class_of_(scope: dict) -> str:
+    """Returns class of requested route: 'auth' (password hashing),
+    'write' (database transaction) or 'read'."""
+    if scope["method"] in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    if scope["path"].startswith("/api/auth/"):
+        return "auth"
+    return "write"
+
+
+def _get_subject_from_(authorization: bytes) -> str | None:
+    """Returns subject of valid bearer access token or None."""
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    try:
+        # Expiration is checked too
+        return jwt.decode(token, JWT_SECRET_KEY, algorithms=[ALGORITHM]).get(
+            "sub"
+        )
+    except jwt.JWTError:
+        return None
+
+
+def _get_client_key_from_(scope: dict, route_class: str) -> str:
+    """Returns key of client: subject of verified access token (user) or IP
+    address (always for 'auth' routes, so forged tokens don't get fresh
+    buckets)."""
+    if route_class != "auth":
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                if subject := _get_subject_from_(value):
+                    return f"user:{subject}"
+                break
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+async def _send_error(
+    send, status: int, detail: str, retry_after: float
+) -> None:
+    """Sends JSON error response with 'Retry-After' header."""
+    body = json.dumps({"detail": detail}).encode()
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """ASGI middleware limiting request rate per client and route class
+    and number of concurrently handled requests."""
+
+    def __init__(self, app) -> None:
+        """Wraps given ASGI application."""
+        self.app = app
+        self._buckets = LRUCache(RATE_LIMIT_CLIENTS)
+        self._semaphore = None
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.limited = Counter()
+        self.shed = Counter()
+        register_metrics("rate_limit", self.get_stats)
+
+    def _get_retry_after(self, route_class: str, client_key: str) -> float:
+        """Takes token from client bucket of route class and returns 0 or
+        seconds until request is allowed."""
+        if (rate := RATE_LIMITS[route_class]) is None:
+            return 0
+        key = (route_class, client_key)
+        if (bucket := self._buckets.get(key)) is None:
+            bucket = TokenBucket(*rate)
+            self._buckets.set(key, bucket)
+        return bucket.take()
+
+    async def _admit(self) -> str | None:
+        """Waits for free request slot and returns None or reason why
+        request is shed."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        if self._semaphore.locked():
+            if self.queued >= MAX_QUEUED_REQUESTS:
+                return "queue_full"
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            try:
+                await asyncio.wait_for(
+                    self._semaphore.acquire(), REQUEST_QUEUE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                return "queue_timeout"
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        return None
+
+    async def __call__(self, scope, receive, send) -> None:
+        """Rejects request with '429' if client exceeds its rate limit or
+        with '503' if too many requests wait, otherwise handles it."""
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route_class = _get_route_class_of_(scope)
+        if retry_after := self._get_retry_after(
+            route_class, _get_client_key_from_(scope, route_class)
+        ):
+            self.limited[route_class] += 1
+            return await _send_error(
+                send, 429, "Too many requests", retry_after
+            )
+        if (
+            not MAX_CONCURRENT_REQUESTS
+            or scope["path"].startswith(UNQUEUED_PATH_PREFIXES)
+            or scope["path"].endswith(UNQUEUED_PATH_SUFFIXES)
+        ):
+            return await self.app(scope, receive, send)
+        if reason := await self._admit():
+            self.shed[reason] += 1
+            return await _send_error(
+                send,
+                503,
+                "Server is overloaded, try again later",
+                REQUEST_QUEUE_TIMEOUT,
+            )
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def get_stats(self) -> dict:
+        """Returns numbers of limited and shed requests and queue depth."""
+        return {
+            "limited": {
+                route_class: self.limited[route_class]
+                for route_class in RATE_LIMITS
+            },
+            "shed": dict(self.shed),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "clients": len(self._buckets),
+        }
@@ -0,0 +1,183 @@
+import os
+import hashlib
+from threading import Lock
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Hashable, Iterable
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+
+from cache import LRUCache
+from metrics import register_metrics
+from models import Base, User, Post
+from db import READ_YOUR_WRITES_WINDOW, replica_engines
+
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 2048))
+# Invalidation reaches only the writing process, so other workers serve
+# stale responses for up to this time (in seconds)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 10))
+# Replicas may serve stale content for a while after invalidation
+RESPONSE_CACHE_SETTLE_TIME = READ_YOUR_WRITES_WINDOW if replica_engines else 0
+
+
+class ResponseCache:
+    """LRU cache of serialized responses invalidated by tags."""
+
+    def __init__(
+        self, maxsize: int, ttl: float = None, settle_time: float = 0
+    ) -> None:
+        """Creates empty cache with given max number of responses, their
+        TTL and time (in seconds) for which responses with just invalidated
+        tags are not cached."""
+        self._responses = LRUCache(
+            maxsize, ttl=ttl, on_evict=self._forget_tags_of
+        )
+        self._recently_invalidated_tags = (
+            LRUCache(maxsize, ttl=settle_time) if settle_time else None
+        )
+        self._keys_by_tag = defaultdict(set)
+        self._tags_by_key = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    @property
+    def generation(self) -> int:
+        """Returns number of invalidations made so far."""
+        return self._generation
+
+    def _forget_tags_of(self, key: Hashable) -> None:
+        """Removes key from tag index."""
+        with self._lock:
+            for tag in self._tags_by_key.pop(key, ()):
+                self._keys_by_tag[tag].discard(key)
+                if not self._keys_by_tag[tag]:
+                    del self._keys_by_tag[tag]
+
+    def get(self, key: Hashable) -> tuple[str, bytes] | None:
+        """Returns cached ETag and body by key."""
+        return self._responses.get(key)
+
+    def set(
+        self,
+        key: Hashable,
+        etag: str,
+        body: bytes,
+        tags: Iterable[str],
+        generation: int,
+    ) -> None:
+        """Caches response if nothing was invalidated since generation and
+        its tags are settled."""
+        tags = set(tags)
+        if self._recently_invalidated_tags is not None and any(
+            self._recently_invalidated_tags.get(tag) for tag in tags
+        ):
+            return
+        self._forget_tags_of(key)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._tags_by_key[key] = tags
+            for tag in self._tags_by_key[key]:
+                self._keys_by_tag[tag].add(key)
+        self._responses.set(key, (etag, body))
+
+    def invalidate(self, *tags: str) -> None:
+        """Removes cached responses marked with any of given tags."""
+        if self._recently_invalidated_tags is not None:
+            for tag in tags:
+                self._recently_invalidated_tags.set(tag, True)
+        with self._lock:
+            self._generation += 1
+            keys = set().union(
+                *(self._keys_by_tag.get(tag, ()) for tag in tags)
+            )
+        for key in keys:
+            self._responses.delete(key)
+            self._forget_tags_of(key)
+
+    def clear(self) -> None:
+        """Removes all cached responses."""
+        with self._lock:
+            self._generation += 1
+            self._keys_by_tag.clear()
+            self._tags_by_key.clear()
+        self._responses.clear()
+
+    def get_stats(self) -> dict:
+        """Returns cache statistics."""
+        return {
+            **self._responses.get_stats(),
+            "invalidations": self._generation,
+        }
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SETTLE_TIME
+)
+register_metrics("response_cache", response_cache.get_stats)
+
+
+def invalidate_responses(*tags: str) -> None:
+    """Removes cached responses marked with any of given tags (call it
+    after commit)."""
+    response_cache.invalidate(*tags)
+
+
+def get_tags_of_(content: Any) -> set[str]:
+    """Returns invalidation tags of posts and users in given content."""
+    if isinstance(content, dict):
+        return set().union(*map(get_tags_of_, content.values()))
+    if isinstance(content, (list, tuple)):
+        return set().union(*map(get_tags_of_, content))
+    if not isinstance(content, Base):
+        return set()
+    tags = get_tags_of_(
+        [value for key, value in vars(content).items() if key[0] != "_"]
+    )
+    if isinstance(content, Post):
+        tags.add(f"post:{content.id}")
+    elif isinstance(content, User):
+        tags.add(f"user:{content.id}")
+    return tags
+
+
+def _get_etag_of_(body: bytes) -> str:
+    """Returns strong ETag of given response body."""
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Checks if request 'If-None-Match' header matches given ETag."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    )
+
+
+def _make_response(request: Request, etag: str, body: bytes) -> Response:
+    """Returns response with body or '304 Not Modified' if ETag matches."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def get_cached_response(
+    request: Request,
+    get_content: Callable[[], Awaitable[tuple[Any, Iterable[str]]]],
+) -> Response:
+    """Returns cached response for request or caches response with content
+    and tags returned by given function."""
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())))
+    if (cached := response_cache.get(key)) is not None:
+        return _make_response(request, *cached)
+    generation = response_cache.generation
+    content, tags = await get_content()
+    body = JSONResponse(jsonable_encoder(content)).body
+    etag = _get_etag_of_(body)
+    response_cache.set(key, etag, body, tags, generation)
+    return _make_response(request, etag, body)
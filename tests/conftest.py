@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+
+# App modules read settings on import, so they are set before importing
+_directory = tempfile.mkdtemp(prefix="itish-tests-")
+PRIMARY_PATH = os.path.join(_directory, "primary.db")
+REPLICA_PATH = os.path.join(_directory, "replica.db")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{PRIMARY_PATH}",
+    REPLICA_DATABASE_URLS=f"sqlite:///{REPLICA_PATH}",
+    JWT_SECRET_KEY="test-secret",
+    JWT_REFRESH_SECRET_KEY="test-refresh-secret",
+    BCRYPT_ROUNDS="4",
+    RATE_LIMIT_AUTH="0",
+    RATE_LIMIT_WRITE="0",
+    RATE_LIMIT_READ="0",
+    METRICS_TOKEN="test-metrics-token",
+)
+
+import pytest
+from fastapi.testclient import TestClient
+
+from migrations import migrate
+
+
+@pytest.fixture(scope="session")
+def app():
+    """Returns app using migrated primary database and its copy as a
+    replica which never receives writes (an endlessly lagging one)."""
+    migrate()
+    shutil.copyfile(PRIMARY_PATH, REPLICA_PATH)
+    from main import app
+
+    return app
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    """Yields client of started app."""
+    with TestClient(app) as client:
+        yield client
+    shutil.rmtree(_directory, ignore_errors=True)
+
+
+@pytest.fixture
+def log_in(client):
+    """Returns function signing user up and returning its authorization
+    headers."""
+
+    def log_in(username: str) -> dict:
+        client.post(
+            "/api/auth/signup",
+            json={
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": "password",
+            },
+        )
+        response = client.post(
+            "/api/auth/login",
+            data={
+                "username": f"{username}@example.com",
+                "password": "password",
+            },
+        )
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    return log_in
@@ -0,0 +1,65 @@
+from sqlalchemy import func, select
+
+from db import SessionLocal
+from models import Post, Comment, Like, post_tags
+
+
+def _count_rows_of_(table, *where) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(table).where(*where))
+
+
+def test_foreign_keys_are_enforced_on_sqlite(app):
+    with SessionLocal() as db:
+        assert db.connection().exec_driver_sql("PRAGMA foreign_keys").scalar()
+
+
+def test_comments_and_likes_of_missing_post_are_not_found(client, log_in):
+    headers = log_in("orphan")
+    response = client.post(
+        "/api/blog/comment",
+        json={"body": "comment", "post_id": 10**9},
+        headers=headers,
+    )
+    assert response.status_code == 404
+    response = client.post(
+        "/api/blog/like",
+        json={"post_id": 10**9, "user_id": 0},
+        headers=headers,
+    )
+    assert response.status_code == 404
+
+
+def test_deleting_posts_and_users_removes_their_rows(client, log_in):
+    author_headers, reader_headers = log_in("author"), log_in("reader")
+    post_ids = []
+    for title in ("Deleted with post", "Deleted with author"):
+        response = client.post(
+            "/api/blog/post",
+            json={"title": title, "body": "body", "tags": "cascade"},
+            headers=author_headers,
+        )
+        post_id = response.json()["id"]
+        post_ids.append(post_id)
+        client.post(
+            "/api/blog/comment",
+            json={"body": "comment", "post_id": post_id},
+            headers=reader_headers,
+        )
+        client.post(
+            "/api/blog/like",
+            json={"post_id": post_id, "user_id": 0},
+            headers=reader_headers,
+        )
+
+    response = client.delete(
+        "/api/blog/post/deleted-with-post", headers=author_headers
+    )
+    assert response.status_code == 200
+    response = client.delete("/api/user/me", headers=author_headers)
+    assert response.status_code == 200
+
+    assert not _count_rows_of_(Post, Post.id.in_(post_ids))
+    assert not _count_rows_of_(post_tags, post_tags.c.post_id.in_(post_ids))
+    assert not _count_rows_of_(Comment, Comment.post_id.in_(post_ids))
+    assert not _count_rows_of_(Like, Like.post_id.in_(post_ids))
@@ -0,0 +1,21 @@
+import metrics
+
+
+def test_metrics_require_token(client):
+    assert client.get("/api/metrics/").status_code == 401
+    response = client.get(
+        "/api/metrics/", headers={"Authorization": "Bearer wrong"}
+    )
+    assert response.status_code == 401
+
+    response = client.get(
+        "/api/metrics/",
+        headers={"Authorization": f"Bearer {metrics.METRICS_TOKEN}"},
+    )
+    assert response.status_code == 200
+    assert "rate_limit" in response.json()
+
+
+def test_metrics_are_hidden_without_token(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TOKEN", "")
+    assert client.get("/api/metrics/").status_code == 404
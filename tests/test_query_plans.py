@@ -0,0 +1,25 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import models
+from db import Base
+from benchmark.query_plans import QueryPlanRecorder, check_query_plans
+
+
+def test_recorder_reports_full_table_scans(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'scans.db'}")
+    Base.metadata.create_all(engine)
+    recorder = QueryPlanRecorder(engine)
+    with Session(engine) as db:
+        db.query(models.Post).filter(models.Post.body == "body").all()
+        db.query(models.Post).filter(models.Post.slug == "slug").all()
+    assert [table for table, _ in recorder.reset()] == ["posts"]
+    engine.dispose()
+
+
+def test_crud_queries_dont_scan_whole_tables():
+    unexpected_scans = check_query_plans()
+    assert not unexpected_scans, "\n".join(
+        f"{case_name}: full scan of '{table}' in {statement}"
+        for case_name, table, statement in unexpected_scans
+    )
@@ -0,0 +1,34 @@
+import time
+
+from fastapi.testclient import TestClient
+
+import db
+
+
+def test_read_after_write_within_window_is_served_by_primary(
+    app, client, log_in
+):
+    headers = log_in("writer")
+    response = client.post(
+        "/api/blog/post",
+        json={"title": "Read your writes", "body": "body"},
+        headers=headers,
+    )
+    assert db.READ_YOUR_WRITES_COOKIE in response.cookies
+    slug = response.json()["slug"]
+    # Read lands on another worker, which only sees the client cookie
+    db._primary_read_clients.clear()
+
+    assert TestClient(app).get(f"/api/blog/post/{slug}").status_code == 404
+    response = client.get(f"/api/blog/post/{slug}")
+    assert response.status_code == 200
+    assert response.json()["title"] == "Read your writes"
+
+
+def test_only_recent_writes_pin_reads_to_primary():
+    now = time.time()
+    assert db._is_recent_write(str(now))
+    assert not db._is_recent_write(str(now - db.READ_YOUR_WRITES_WINDOW - 1))
+    assert not db._is_recent_write(str(now + 60))
+    assert not db._is_recent_write("not a time")
+    assert not db._is_recent_write(None)
@@ -0,0 +1,40 @@
+from blog import services
+from blog.tag_index import TagIndex
+from db import SessionLocal
+from models import User, Post
+from pagination import PageParams
+
+
+def _get_post_ids_of_(index: TagIndex, db, slug: str) -> list[int]:
+    return index.filter_post_ids(db, [slug], True, [], PageParams(limit=10))
+
+
+def test_refresh_rebuilds_index_after_tags_are_swapped_between_posts(app):
+    with SessionLocal() as db:
+        user = User(
+            username="tagger",
+            email="tagger@example.com",
+            hashed_password="hash",
+        )
+        first_post = Post(title="First tagged", body="body", user=user)
+        second_post = Post(title="Second tagged", body="body", user=user)
+        for post in (first_post, second_post):
+            post.generate_slug()
+        first_tag, second_tag = services.resolve_tags(db, ["swap-a", "swap-b"])
+        services.set_post_tags(db, first_post, [first_tag])
+        services.set_post_tags(db, second_post, [second_tag])
+        db.add_all([first_post, second_post])
+        db.commit()
+        # Index of another worker, which doesn't see changes of this one
+        index = TagIndex()
+        index.rebuild(db)
+        assert not index.refresh(db)
+
+        # Tag ids and post ids of 'post_tags' keep their sums and count
+        services.set_post_tags(db, first_post, [second_tag])
+        services.set_post_tags(db, second_post, [first_tag])
+        db.commit()
+
+        assert index.refresh(db)
+        assert _get_post_ids_of_(index, db, "swap-a") == [second_post.id]
+        assert _get_post_ids_of_(index, db, "swap-b") == [first_post.id]
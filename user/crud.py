@@ -1,9 +1,17 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, delete
+from sqlalchemy.orm import Session, noload, joinedload, load_only
 from sqlalchemy.orm.exc import NoResultFound
 
 import models
+from blog import services, search
+from blog.like_buffer import like_buffer
+from pagination import PageParams, paginate
+from user import feed
 from user.schemas import UserSchema
 from auth.utils import get_hashed_password
+from auth.services import invalidate_principal
+from response_cache import invalidate_responses
+from user.services import avatar_path_cache
 
 
 def get_user_by_id(db: Session, id: int):
@@ -24,17 +32,134 @@ def get_user_by_username(db: Session, user: str):
     return user
 
 
-def update_user(db: Session, username: str, user_schema: UserSchema):
+def get_user_id_by_username(db: Session, username: str) -> int:
+    """Returns id of user from database by username."""
+    user_id = (
+        db.query(models.User.id)
+        .filter(models.User.username == username)
+        .scalar()
+    )
+    if user_id is None:
+        raise NoResultFound
+    return user_id
+
+
+def _count_of_user_(model: models.Base):
+    """Returns subquery counting rows of model made by user."""
+    return (
+        select(func.count(model.id))
+        .where(model.user_id == models.User.id)
+        .scalar_subquery()
+    )
+
+
+def _get_activity_query_of_user(db: Session, model, user_id: int):
+    """Returns query of comments or likes of user with titles of their
+    posts (author of them is the user)."""
+    return (
+        db.query(model)
+        .filter(model.user_id == user_id)
+        .options(
+            noload(model.user),
+            joinedload(model.post).options(
+                load_only(models.Post.id, models.Post.title, models.Post.slug),
+                noload(models.Post.user),
+            ),
+        )
+    )
+
+
+def get_user_profile(db: Session, username: str, limit: int) -> dict:
+    """Returns public fields of user with numbers of their posts, comments
+    and likes (in one query) and the first pages of their post summaries,
+    comments and likes."""
+    row = (
+        db.query(
+            models.User.id,
+            models.User.username,
+            models.User.avatar,
+            models.User.created,
+            _count_of_user_(models.Post).label("post_count"),
+            _count_of_user_(models.Comment).label("comment_count"),
+            _count_of_user_(models.Like).label("like_count"),
+        )
+        .filter(models.User.username == username)
+        .first()
+    )
+    if row is None:
+        raise NoResultFound
+    user_id, page = row.id, PageParams(limit=limit)
+    posts_page = paginate(
+        services.get_posts_query_from_(
+            db.query(models.Post).filter(models.Post.user_id == user_id),
+            summary=True,
+        ),
+        models.Post.id,
+        page,
+    )
+    like_buffer.overlay_like_counts(posts_page["items"])
+    return {
+        **row._asdict(),
+        "posts": posts_page,
+        "comments": paginate(
+            _get_activity_query_of_user(db, models.Comment, user_id),
+            models.Comment.id,
+            page,
+        ),
+        "likes": paginate(
+            _get_activity_query_of_user(db, models.Like, user_id),
+            models.Like.id,
+            page,
+        ),
+    }
+
+
+def _get_avatar_by_(db: Session, cache_key: str, **filters) -> str:
+    """Returns user avatar path using avatar path cache."""
+    if (avatar := avatar_path_cache.get(cache_key)) is not None:
+        return avatar
+    avatar = db.query(models.User.avatar).filter_by(**filters).scalar()
+    if avatar is None:
+        raise NoResultFound
+    avatar_path_cache.set(cache_key, avatar)
+    return avatar
+
+
+def get_avatar_by_id(db: Session, id: int) -> str:
+    """Returns user avatar path by user id."""
+    return _get_avatar_by_(db, f"id:{id}", id=id)
+
+
+def get_avatar_by_username(db: Session, username: str) -> str:
+    """Returns user avatar path by username."""
+    return _get_avatar_by_(db, f"username:{username}", username=username)
+
+
+def _invalidate_avatar_of_(user_id: int, username: str) -> None:
+    """Removes cached avatar path of given user (call it after commit)."""
+    avatar_path_cache.delete(f"id:{user_id}")
+    avatar_path_cache.delete(f"username:{username}")
+
+
+def update_user(
+    db: Session,
+    username: str,
+    user_schema: UserSchema,
+    hashed_password: str = None,
+):
     """Updates user in database by username."""
     user = get_user_by_username(db, username)
+    old_email, old_username = user.email, user.username
     user.username = user_schema.username
     user.email = user_schema.email
-    user.password = (
-        user.password
-        if len(user_schema.password) == 60
-        else get_hashed_password(user_schema.password)
-    )
+    if hashed_password is None and len(user_schema.password) != 60:
+        hashed_password = get_hashed_password(user_schema.password)
+    user.password = hashed_password or user.password
+    user_id, new_email = user.id, user.email
     db.commit()
+    _invalidate_avatar_of_(user_id, old_username)
+    invalidate_principal(old_email, new_email)
+    invalidate_responses(f"user:{user_id}")
     return user
 
 
@@ -42,12 +167,69 @@ def update_user_avatar(db: Session, username: str, file_name: str):
     """Updates user avatar."""
     user = get_user_by_username(db, username)
     user.avatar = file_name
+    user_id, username, email = user.id, user.username, user.email
     db.commit()
+    _invalidate_avatar_of_(user_id, username)
+    invalidate_principal(email)
+    invalidate_responses(f"user:{user_id}")
+
+
+def _delete_likes_and_comments_of_(db: Session, user_id: int) -> set[int]:
+    """Deletes likes and comments of user, recounts them on posts and
+    returns ids of the posts (in db transaction)."""
+    post_ids = set()
+    for model in (models.Like, models.Comment):
+        post_ids.update(
+            db.execute(
+                delete(model)
+                .where(model.user_id == user_id)
+                .returning(model.post_id)
+            ).scalars()
+        )
+    if post_ids:
+        services.recount_like_counts_of_(db, list(post_ids))
+        services.recount_comment_counts_of_(db, list(post_ids))
+    return post_ids
+
+
+def _delete_posts_of_(db: Session, user_id: int) -> list[int]:
+    """Deletes posts of user with their tag links and search entries and
+    returns ids of the posts (in db transaction)."""
+    post_ids = list(
+        db.scalars(
+            select(models.Post.id).where(models.Post.user_id == user_id)
+        )
+    )
+    if post_ids:
+        # 'post_tags' rows don't cascade, so they would block deleting posts
+        db.execute(
+            delete(models.post_tags).where(
+                models.post_tags.c.post_id.in_(post_ids)
+            )
+        )
+        search.remove_posts_from_index(db, post_ids)
+        db.execute(delete(models.Post).where(models.Post.user_id == user_id))
+    return post_ids
 
 
 def delete_user_by_username(db: Session, username: str):
     """Deletes user from database by username."""
     user = get_user_by_username(db, username)
+    user_id, username, email = user.id, user.username, user.email
+    services.remove_posts_of_user_from_tags(db, user_id)
+    feed.forget_follows_of_(db, user_id)
+    post_ids = _delete_likes_and_comments_of_(db, user_id)
+    deleted_post_ids = _delete_posts_of_(db, user_id)
+    post_ids.update(deleted_post_ids)
     db.delete(user)
     db.commit()
+    like_buffer.forget_intents_of_(deleted_post_ids, user_id)
+    _invalidate_avatar_of_(user_id, username)
+    invalidate_principal(email)
+    invalidate_responses(
+        "posts",
+        "tags",
+        f"user:{user_id}",
+        *(f"post:{post_id}" for post_id in post_ids),
+    )
     return user
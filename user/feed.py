@@ -0,0 +1,354 @@
+import os
+from collections import Counter, defaultdict
+
+from sqlalchemy import select, delete, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import NoResultFound
+from fastapi.exceptions import HTTPException
+
+from models import (
+    User,
+    Post,
+    Tag,
+    post_tags,
+    tag_follows,
+    user_follows,
+    timeline_entries,
+    timelines,
+)
+from db import commit_and_refresh, get_insert_for_
+from blog.services import get_posts_query_from_
+from blog.like_buffer import like_buffer
+from pagination import PageParams, make_page, _get_id_from_
+
+
+FEED_LENGTH = int(os.getenv("FEED_LENGTH", 500))
+# Posts of tags with more followers are merged into feeds on read
+FEED_FAN_OUT_MAX_FOLLOWERS = int(os.getenv("FEED_FAN_OUT_MAX_FOLLOWERS", 1000))
+
+
+def _is_popular(tag: Tag) -> bool:
+    """Checks if posts of tag are merged into feeds on read."""
+    return tag.follower_count > FEED_FAN_OUT_MAX_FOLLOWERS
+
+
+def _trim_timeline_of_(db: Session, user_id: int) -> None:
+    """Leaves only the newest posts in timeline of user (in db
+    transaction)."""
+    oldest_post_id = db.execute(
+        select(timeline_entries.c.post_id)
+        .where(timeline_entries.c.user_id == user_id)
+        .order_by(timeline_entries.c.post_id.desc())
+        .offset(FEED_LENGTH - 1)
+        .limit(1)
+    ).scalar()
+    if oldest_post_id is not None:
+        db.execute(
+            delete(timeline_entries).where(
+                timeline_entries.c.user_id == user_id,
+                timeline_entries.c.post_id < oldest_post_id,
+            )
+        )
+    db.execute(
+        update(timelines)
+        .where(timelines.c.user_id == user_id)
+        .values(size=FEED_LENGTH)
+    )
+
+
+def _add_timeline_entries(db: Session, entries: set[tuple[int, int]]) -> None:
+    """Adds (user id, post id) entries to timelines and trims timelines
+    grown twice longer than feed (in db transaction)."""
+    if not entries:
+        return
+    insert = get_insert_for_(db)
+    db.execute(
+        insert(timeline_entries).on_conflict_do_nothing(),
+        [
+            {"user_id": user_id, "post_id": post_id}
+            for user_id, post_id in entries
+        ],
+    )
+    sizes = Counter(user_id for user_id, _ in entries)
+    size_insert = insert(timelines)
+    db.execute(
+        size_insert.on_conflict_do_update(
+            index_elements=[timelines.c.user_id],
+            set_={"size": timelines.c.size + size_insert.excluded.size},
+        ),
+        [
+            {"user_id": user_id, "size": size}
+            for user_id, size in sizes.items()
+        ],
+    )
+    # Trimming reads whole timeline, so it is done once per feed length
+    for user_id in db.execute(
+        select(timelines.c.user_id).where(
+            timelines.c.user_id.in_(sizes),
+            timelines.c.size > 2 * FEED_LENGTH,
+        )
+    ).scalars():
+        _trim_timeline_of_(db, user_id)
+
+
+def fan_out_posts(db: Session, posts: list[Post]) -> None:
+    """Adds new posts to timelines of followers of their authors and not
+    popular tags (in db transaction)."""
+    if not posts:
+        return
+    db.flush()
+    followers_by_author = defaultdict(set)
+    for followed_id, follower_id in db.execute(
+        select(user_follows.c.followed_id, user_follows.c.follower_id).where(
+            user_follows.c.followed_id.in_({post.user_id for post in posts})
+        )
+    ):
+        followers_by_author[followed_id].add(follower_id)
+    followers_by_tag = defaultdict(set)
+    if tag_ids := {tag.id for post in posts for tag in post.tags}:
+        for tag_id, user_id in db.execute(
+            select(tag_follows.c.tag_id, tag_follows.c.user_id)
+            .join(Tag, Tag.id == tag_follows.c.tag_id)
+            .where(
+                tag_follows.c.tag_id.in_(tag_ids),
+                Tag.follower_count <= FEED_FAN_OUT_MAX_FOLLOWERS,
+            )
+        ):
+            followers_by_tag[tag_id].add(user_id)
+    _add_timeline_entries(
+        db,
+        {
+            (user_id, post.id)
+            for post in posts
+            for user_id in followers_by_author[post.user_id].union(
+                *(followers_by_tag[tag.id] for tag in post.tags)
+            )
+        },
+    )
+
+
+def remove_post_from_timelines(db: Session, post_id: int) -> None:
+    """Removes post from all timelines (in db transaction)."""
+    db.execute(
+        delete(timeline_entries).where(timeline_entries.c.post_id == post_id)
+    )
+
+
+def _backfill_timeline_of_(db: Session, user_id: int, post_ids) -> None:
+    """Adds the newest posts selected by query to timeline of user (in db
+    transaction)."""
+    _add_timeline_entries(
+        db,
+        {
+            (user_id, post_id)
+            for post_id in db.execute(
+                post_ids.order_by(post_ids.selected_columns[0].desc()).limit(
+                    FEED_LENGTH
+                )
+            ).scalars()
+        },
+    )
+
+
+def _get_tag_by_slug(db: Session, slug: str) -> Tag:
+    """Returns tag from database by slug."""
+    tag = db.query(Tag).filter(Tag.slug == slug).first()
+    if tag is None:
+        raise NoResultFound
+    return tag
+
+
+def _get_user_by_username(db: Session, username: str) -> User:
+    """Returns user from database by username."""
+    user = db.query(User).filter(User.username == username).first()
+    if user is None:
+        raise NoResultFound
+    return user
+
+
+def _get_followed_user(user: User) -> dict:
+    """Returns public fields of followed user."""
+    return {"id": user.id, "username": user.username, "avatar": user.avatar}
+
+
+def _change_follower_count(db: Session, tag_id: int, delta: int) -> None:
+    """Changes tag follower count by delta (in db transaction)."""
+    db.query(Tag).filter(Tag.id == tag_id).update(
+        {Tag.follower_count: Tag.follower_count + delta},
+        synchronize_session=False,
+    )
+
+
+def follow_tag(db: Session, user_id: int, slug: str) -> Tag:
+    """Makes user follow tag and adds its posts to user timeline."""
+    tag = _get_tag_by_slug(db, slug)
+    insert = get_insert_for_(db)
+    is_created = (
+        db.execute(
+            insert(tag_follows)
+            .values(user_id=user_id, tag_id=tag.id)
+            .on_conflict_do_nothing()
+            .returning(tag_follows.c.tag_id)
+        ).first()
+        is not None
+    )
+    if is_created:
+        _change_follower_count(db, tag.id, 1)
+        if not _is_popular(tag):
+            _backfill_timeline_of_(
+                db,
+                user_id,
+                select(post_tags.c.post_id).where(
+                    post_tags.c.tag_id == tag.id
+                ),
+            )
+    return commit_and_refresh(db, tag)
+
+
+def unfollow_tag(db: Session, user_id: int, slug: str) -> Tag:
+    """Makes user stop following tag (posts already in user timeline
+    stay there)."""
+    tag = _get_tag_by_slug(db, slug)
+    if not db.execute(
+        delete(tag_follows).where(
+            tag_follows.c.user_id == user_id, tag_follows.c.tag_id == tag.id
+        )
+    ).rowcount:
+        raise HTTPException(status_code=404, detail="Follow not found")
+    _change_follower_count(db, tag.id, -1)
+    return commit_and_refresh(db, tag)
+
+
+def follow_user(db: Session, user_id: int, username: str) -> dict:
+    """Makes user follow another user and adds their posts to user
+    timeline."""
+    followed_user = _get_user_by_username(db, username)
+    if followed_user.id == user_id:
+        raise HTTPException(status_code=400, detail="Can't follow yourself")
+    insert = get_insert_for_(db)
+    if (
+        db.execute(
+            insert(user_follows)
+            .values(follower_id=user_id, followed_id=followed_user.id)
+            .on_conflict_do_nothing()
+            .returning(user_follows.c.followed_id)
+        ).first()
+        is not None
+    ):
+        _backfill_timeline_of_(
+            db,
+            user_id,
+            select(Post.id).where(Post.user_id == followed_user.id),
+        )
+    db.commit()
+    return _get_followed_user(followed_user)
+
+
+def unfollow_user(db: Session, user_id: int, username: str) -> dict:
+    """Makes user stop following another user (posts already in user
+    timeline stay there)."""
+    followed_user = _get_user_by_username(db, username)
+    if not db.execute(
+        delete(user_follows).where(
+            user_follows.c.follower_id == user_id,
+            user_follows.c.followed_id == followed_user.id,
+        )
+    ).rowcount:
+        raise HTTPException(status_code=404, detail="Follow not found")
+    db.commit()
+    return _get_followed_user(followed_user)
+
+
+def get_following(db: Session, user_id: int) -> dict:
+    """Returns tags and users followed by user."""
+    return {
+        "tags": db.query(Tag)
+        .join(tag_follows, tag_follows.c.tag_id == Tag.id)
+        .filter(tag_follows.c.user_id == user_id)
+        .order_by(Tag.title)
+        .all(),
+        "users": [
+            _get_followed_user(user)
+            for user in db.query(User)
+            .join(user_follows, user_follows.c.followed_id == User.id)
+            .filter(user_follows.c.follower_id == user_id)
+            .order_by(User.username)
+        ],
+    }
+
+
+def forget_follows_of_(db: Session, user_id: int) -> None:
+    """Removes follows and timeline of user (call before deleting the
+    user)."""
+    db.execute(
+        update(Tag)
+        .where(
+            Tag.id.in_(
+                select(tag_follows.c.tag_id).where(
+                    tag_follows.c.user_id == user_id
+                )
+            )
+        )
+        .values(follower_count=Tag.follower_count - 1)
+    )
+    for table, column in (
+        (tag_follows, tag_follows.c.user_id),
+        (user_follows, user_follows.c.follower_id),
+        (user_follows, user_follows.c.followed_id),
+        (timeline_entries, timeline_entries.c.user_id),
+        (timelines, timelines.c.user_id),
+    ):
+        db.execute(delete(table).where(column == user_id))
+
+
+def get_feed(
+    db: Session, user_id: int, page: PageParams, summary: bool = False
+) -> dict:
+    """Returns page of posts from user timeline merged with the newest
+    posts of followed popular tags (newest first)."""
+    after_id = _get_id_from_(page.after) if page.after else None
+    queries = [
+        select(timeline_entries.c.post_id).where(
+            timeline_entries.c.user_id == user_id
+        )
+    ]
+    popular_tag_ids = (
+        db.execute(
+            select(tag_follows.c.tag_id)
+            .join(Tag, Tag.id == tag_follows.c.tag_id)
+            .where(
+                tag_follows.c.user_id == user_id,
+                Tag.follower_count > FEED_FAN_OUT_MAX_FOLLOWERS,
+            )
+        )
+        .scalars()
+        .all()
+    )
+    if popular_tag_ids:
+        queries.append(
+            select(post_tags.c.post_id)
+            .where(post_tags.c.tag_id.in_(popular_tag_ids))
+            .distinct()
+        )
+    post_ids = set()
+    for query in queries:
+        post_id_column = query.selected_columns[0]
+        if after_id is not None:
+            query = query.where(post_id_column < after_id)
+        post_ids.update(
+            db.execute(
+                query.order_by(post_id_column.desc()).limit(page.limit + 1)
+            ).scalars()
+        )
+    post_ids = sorted(post_ids, reverse=True)[: page.limit + 1]
+    posts = (
+        get_posts_query_from_(
+            db.query(Post).filter(Post.id.in_(post_ids)), summary
+        )
+        .order_by(Post.id.desc())
+        .all()
+        if post_ids
+        else []
+    )
+    like_buffer.overlay_like_counts(posts)
+    return make_page(posts, page.limit, lambda post: (post.id,))
@@ -1,122 +1,320 @@
+import os
 from typing import Callable, NoReturn
 
 from sqlalchemy.orm import Session
-from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
 from fastapi.exceptions import HTTPException
-from fastapi import APIRouter, UploadFile, BackgroundTasks, Depends, File
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    Query,
+    Request,
+)
 
-from models import User
-from dependencies import get_db
+from models import User, Post, Comment, Like
+from dependencies import get_async_db, get_read_db, get_page_params
+from pagination import PageParams, paginate, DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT
 from decorators import catch_model_not_fount
-from user import crud, services, schemas
+from user import crud, services, schemas, feed
+from blog.services import get_posts_query_from_
+from auth.hashing import hash_password
 from auth.dependencies import get_current_user
+from response_cache import get_cached_response, get_tags_of_, etag_matches
 
 
 user_router = APIRouter()
 
+AVATAR_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
-def _get_user_overview(user: str, db: Session = Depends(get_db)):
+
+def _get_user_overview(db: Session, user_id: int, page: PageParams):
     """Returns user overview."""
-    return crud.get_user_by_username(db, user)
+    return crud.get_user_by_id(db, user_id)
+
 
+def _get_user_posts(db: Session, user_id: int, page: PageParams):
+    """Returns page of user posts."""
+    return paginate(
+        db.query(Post).filter(Post.user_id == user_id), Post.id, page
+    )
 
-def _get_user_posts(user: str, db: Session = Depends(get_db)):
-    """Returns user posts."""
-    return crud.get_user_by_username(db, user).posts.all()
 
+def _get_user_post_summaries(db: Session, user_id: int, page: PageParams):
+    """Returns page of user post summaries (user isn't loaded before, so
+    posts get only public fields of their author)."""
+    return paginate(
+        get_posts_query_from_(
+            db.query(Post).filter(Post.user_id == user_id), summary=True
+        ),
+        Post.id,
+        page,
+    )
 
-def _get_user_comments(user: str, db: Session = Depends(get_db)):
-    """Returns user comments."""
-    return crud.get_user_by_username(db, user).comments.all()
 
+def _get_user_comments(db: Session, user_id: int, page: PageParams):
+    """Returns page of user comments."""
+    return paginate(
+        db.query(Comment).filter(Comment.user_id == user_id), Comment.id, page
+    )
 
-def _get_user_liked_posts(user: str, db: Session = Depends(get_db)):
-    """Returns user liked posts."""
-    return crud.get_user_by_username(db, user).likes.all()
 
+def _get_user_liked_posts(db: Session, user_id: int, page: PageParams):
+    """Returns page of user liked posts."""
+    return paginate(
+        db.query(Like).filter(Like.user_id == user_id), Like.id, page
+    )
 
-def _get_process_function(tab: str) -> Callable | NoReturn:
+
+def _get_process_function(
+    tab: str, summary: bool = False
+) -> Callable | NoReturn:
     """Returns function for processing tab."""
     if tab not in ("", "overview", "posts", "comments", "likes"):
         raise HTTPException(status_code=404, detail="Tab not found")
     return {
         "": _get_user_overview,
         "overview": _get_user_overview,
-        "posts": _get_user_posts,
+        "posts": _get_user_post_summaries if summary else _get_user_posts,
         "comments": _get_user_comments,
         "likes": _get_user_liked_posts,
     }.get(tab)
 
 
 @user_router.get("/me")
-def get_me(
+async def get_me(
     tab: str = "overview",
+    summary: bool = False,
+    page: PageParams = Depends(get_page_params),
     user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    return _get_process_function(tab)(user, db)
+    return await db.run_sync(
+        _get_process_function(tab, summary), user.id, page
+    )
 
 
 @user_router.put("/me")
 @catch_model_not_fount("User")
-def update_user(
+async def update_user(
     user_schema: schemas.UserSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
     """Updates user by username and returns user."""
-    return crud.update_user(db, user, user_schema)
+    hashed_password = (
+        await hash_password(user_schema.password)
+        if len(user_schema.password) != 60
+        else None
+    )
+    return await db.run_sync(
+        crud.update_user, user, user_schema, hashed_password
+    )
+
+
+# * Feed ----------------------------------------------------------------------
+
+
+@user_router.get("/me/feed")
+async def get_feed(
+    summary: bool = False,
+    page: PageParams = Depends(get_page_params),
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Returns page of posts (or post summaries) of followed tags and users
+    (the newest first)."""
+    return await db.run_sync(feed.get_feed, user.id, page, summary)
+
+
+@user_router.get("/me/following")
+async def get_following(
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Returns tags and users followed by current user."""
+    return await db.run_sync(feed.get_following, user.id)
+
+
+@user_router.post("/me/following/tags/{slug}")
+@catch_model_not_fount("Tag")
+async def follow_tag(
+    slug: str,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Makes current user follow tag by slug."""
+    return await db.run_sync(feed.follow_tag, user.id, slug)
+
+
+@user_router.delete("/me/following/tags/{slug}")
+@catch_model_not_fount("Tag")
+async def unfollow_tag(
+    slug: str,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Makes current user stop following tag by slug."""
+    return await db.run_sync(feed.unfollow_tag, user.id, slug)
+
+
+@user_router.post("/me/following/users/{username}")
+@catch_model_not_fount("User")
+async def follow_user(
+    username: str,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Makes current user follow user by username."""
+    return await db.run_sync(feed.follow_user, user.id, username)
+
+
+@user_router.delete("/me/following/users/{username}")
+@catch_model_not_fount("User")
+async def unfollow_user(
+    username: str,
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Makes current user stop following user by username."""
+    return await db.run_sync(feed.unfollow_user, user.id, username)
+
+
+# * Avatar --------------------------------------------------------------------
+
+
+def _get_avatar_response(
+    request: Request, avatar: str, size: int | None, cache_control: str
+) -> Response:
+    """Returns avatar (or its resized variant) file response with ETag or
+    '304 Not Modified' if ETag matches."""
+    if size is not None and services.is_content_addressed(avatar):
+        avatar = services.get_avatar_variant_path(avatar, size)
+    etag = services.get_avatar_etag(avatar)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(avatar, headers=headers)
+
+
+def _check_avatar_size(size: int = None) -> int | None | NoReturn:
+    """Returns requested avatar size if it is one of pre-generated."""
+    if size is not None and size not in services.AVATAR_SIZES:
+        raise HTTPException(status_code=404, detail="Avatar size not found")
+    return size
 
 
 @user_router.get("/me/avatar")
 @catch_model_not_fount("User")
-def get_current_user_avatar(id: int, db: Session = Depends(get_db)):
+async def get_current_user_avatar(
+    id: int,
+    request: Request,
+    size: int = Depends(_check_avatar_size),
+    db: AsyncSession = Depends(get_async_db),
+):
     """Returns user avatar by id."""
-    user = crud.get_user_by_id(db, id)
-    return FileResponse(user.avatar)
+    avatar = await db.run_sync(crud.get_avatar_by_id, id)
+    return _get_avatar_response(request, avatar, size, "no-cache")
 
 
 @user_router.put("/me/avatar")
 @catch_model_not_fount("User")
-def update_user_avatar(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
+async def update_user_avatar(
+    request: Request,
+    content_length: int = Header(None),
+    db: AsyncSession = Depends(get_async_db),
     user: User = Depends(get_current_user),
 ):
-    """Updates user avatar by username."""
-    file_format = file.content_type.split("/")[-1]
-    if file_format not in ("png", "jpg", "jpeg"):
-        raise HTTPException(status_code=400, detail="Invalid file format")
-
-    file_name = f"media/avatars/{user.username}.{file_format}"
-    background_tasks.add_task(services.write_avatar, file_name, file)
+    """Updates user avatar by username (from 'file' field of multipart
+    form, which is read with size limit)."""
+    services.check_avatar_upload_size(content_length)
+    file = await services.read_avatar_upload(request)
+    try:
+        file_format = file.content_type.split("/")[-1]
+        if file_format not in ("png", "jpg", "jpeg"):
+            raise HTTPException(status_code=400, detail="Invalid file format")
 
-    crud.update_user_avatar(db, user, file_name)
+        file_name = await run_in_threadpool(
+            services.write_avatar, file.file, file_format
+        )
+    finally:
+        await file.close()
+    await db.run_sync(crud.update_user_avatar, user, file_name)
     return {"avatar": file_name}
 
 
+@user_router.get("/avatars/{file_name}")
+async def get_avatar_file(file_name: str, request: Request):
+    """Returns content-addressed avatar file (cached forever)."""
+    path = f"{services.AVATARS_DIR}/{file_name}"
+    if not services.is_content_addressed(file_name) or not os.path.isfile(
+        path
+    ):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    return _get_avatar_response(
+        request, path, None, AVATAR_IMMUTABLE_CACHE_CONTROL
+    )
+
+
 @user_router.delete("/me")
 @catch_model_not_fount("User")
-def delete_user(
-    user: User = Depends(get_current_user), db: Session = Depends(get_db)
+async def delete_user(
+    user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
 ):
     """Deletes user by username."""
-    return crud.delete_user_by_username(db, user)
+    return await db.run_sync(crud.delete_user_by_username, user)
 
 
 @user_router.get("/{username}")
 @catch_model_not_fount("User")
-def user_home_page(
-    username: str, tab: str = "overview", db: Session = Depends(get_db)
+async def user_home_page(
+    username: str,
+    request: Request,
+    tab: str = "overview",
+    summary: bool = False,
+    page: PageParams = Depends(get_page_params),
+    db: AsyncSession = Depends(get_read_db),
 ):
     """Returns user by username."""
-    return _get_process_function(tab)(username, db)
+    process_function = _get_process_function(tab, summary)
+
+    async def get_user_tab():
+        user_id = await db.run_sync(crud.get_user_id_by_username, username)
+        content = await db.run_sync(process_function, user_id, page)
+        return content, {f"user:{user_id}"} | get_tags_of_(content)
+
+    return await get_cached_response(request, get_user_tab)
+
+
+@user_router.get("/{username}/profile")
+@catch_model_not_fount("User")
+async def get_user_profile(
+    username: str,
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Returns user with numbers of posts, comments and likes and the first
+    pages of all tabs (next pages are requested by tab)."""
+
+    async def get_profile():
+        profile = await db.run_sync(crud.get_user_profile, username, limit)
+        return profile, {f"user:{profile['id']}"} | get_tags_of_(profile)
+
+    return await get_cached_response(request, get_profile)
 
 
 @user_router.get("/{username}/avatar")
 @catch_model_not_fount("User")
-def get_user_avatar(username: str, db: Session = Depends(get_db)):
+async def get_user_avatar(
+    username: str,
+    request: Request,
+    size: int = Depends(_check_avatar_size),
+    db: AsyncSession = Depends(get_async_db),
+):
     """Returns user avatar by username."""
-    user = crud.get_user_by_username(db, username)
-    return FileResponse(user.avatar)
+    avatar = await db.run_sync(crud.get_avatar_by_username, username)
+    return _get_avatar_response(request, avatar, size, "no-cache")
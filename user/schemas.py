@@ -6,4 +6,4 @@ class UserSchema(BaseModel):
 
     username: str
     email: str
-    password: str
\ No newline at end of file
+    password: str
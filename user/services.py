@@ -1,8 +1,128 @@
-import shutil
+import os
+import re
+import hashlib
+import tempfile
+from typing import BinaryIO
 
-from fastapi import UploadFile
+from PIL import Image, UnidentifiedImageError
+from fastapi import Request
+from fastapi.exceptions import HTTPException
+from starlette.datastructures import UploadFile
 
+from cache import LRUCache
 
-def write_avatar(file_name: str, file: UploadFile):
-    with open(file_name, "wb") as bugger:
-        shutil.copyfileobj(file.file, bugger)
+
+AVATARS_DIR = "media/avatars"
+AVATAR_MAX_SIZE = int(os.getenv("AVATAR_MAX_SIZE", 2 * 1024 * 1024))  # bytes
+AVATAR_CHUNK_SIZE = 64 * 1024  # bytes
+AVATAR_MULTIPART_OVERHEAD = 16 * 1024  # bytes of form around the file
+AVATAR_SIZES = (64, 128, 256)  # pixels
+AVATAR_CACHE_SIZE = int(os.getenv("AVATAR_CACHE_SIZE", 4096))
+# Changes made by other workers are seen after this time (in seconds)
+AVATAR_CACHE_TTL = float(os.getenv("AVATAR_CACHE_TTL", 60))
+
+# Content-addressed avatar file name: '<hash>.<format>' or '<hash>_<size>...'
+AVATAR_FILE_NAME_PATTERN = re.compile(r"^[0-9a-f]{32}(_\d+)?\.(png|jpg|jpeg)$")
+
+# Cache of 'username:<username>' or 'id:<id>' -> avatar path
+avatar_path_cache = LRUCache(maxsize=AVATAR_CACHE_SIZE, ttl=AVATAR_CACHE_TTL)
+
+
+def _raise_too_large() -> None:
+    """Raises 413 error about too large avatar."""
+    raise HTTPException(
+        status_code=413,
+        detail=f"Avatar must not be larger than {AVATAR_MAX_SIZE} bytes",
+    )
+
+
+def check_avatar_upload_size(content_length: int | None) -> None:
+    """Rejects upload early if request body is surely too large."""
+    if (
+        content_length
+        and content_length > AVATAR_MAX_SIZE + AVATAR_MULTIPART_OVERHEAD
+    ):
+        _raise_too_large()
+
+
+async def read_avatar_upload(request: Request) -> UploadFile:
+    """Returns avatar file from multipart form of request stopping to read
+    body (with 413 error) as soon as it gets too large (Content-Length of
+    request isn't trusted)."""
+    received_size = 0
+
+    async def receive() -> dict:
+        """Receives body chunk counting received bytes."""
+        nonlocal received_size
+        message = await request.receive()
+        received_size += len(message.get("body", b""))
+        if received_size > AVATAR_MAX_SIZE + AVATAR_MULTIPART_OVERHEAD:
+            _raise_too_large()
+        return message
+
+    form = await Request(request.scope, receive).form()
+    file = form.get("file")
+    if not isinstance(file, UploadFile):
+        await form.close()
+        raise HTTPException(status_code=400, detail="Avatar file is required")
+    return file
+
+
+def get_avatar_variant_path(file_name: str, size: int) -> str:
+    """Returns path of avatar resized to given size."""
+    stem, extension = os.path.splitext(file_name)
+    return f"{stem}_{size}{extension}"
+
+
+def _write_avatar_variants(source_path: str, file_name: str) -> None:
+    """Writes resized avatar variants (raises 400 for invalid image)."""
+    try:
+        with Image.open(source_path) as image:
+            for size in AVATAR_SIZES:
+                variant = image.copy()
+                variant.thumbnail((size, size))
+                variant.save(
+                    get_avatar_variant_path(file_name, size),
+                    format=image.format,
+                )
+    except (UnidentifiedImageError, OSError):
+        raise HTTPException(status_code=400, detail="Invalid image")
+
+
+def write_avatar(file: BinaryIO, file_format: str) -> str:
+    """Writes avatar by chunks with size limit under content-addressed name
+    with resized variants and returns its path."""
+    os.makedirs(AVATARS_DIR, exist_ok=True)
+    digest, size = hashlib.sha256(), 0
+    file_descriptor, temp_path = tempfile.mkstemp(
+        dir=AVATARS_DIR, suffix=".part"
+    )
+    try:
+        with os.fdopen(file_descriptor, "wb") as buffer:
+            while chunk := file.read(AVATAR_CHUNK_SIZE):
+                size += len(chunk)
+                if size > AVATAR_MAX_SIZE:
+                    _raise_too_large()
+                digest.update(chunk)
+                buffer.write(chunk)
+        file_name = f"{AVATARS_DIR}/{digest.hexdigest()[:32]}.{file_format}"
+        if not os.path.exists(file_name):
+            _write_avatar_variants(temp_path, file_name)
+            os.replace(temp_path, file_name)
+        return file_name
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def is_content_addressed(file_name: str) -> bool:
+    """Checks if avatar file name is derived from its content."""
+    return bool(AVATAR_FILE_NAME_PATTERN.match(os.path.basename(file_name)))
+
+
+def get_avatar_etag(path: str) -> str:
+    """Returns strong ETag of avatar file."""
+    if is_content_addressed(path):
+        return f'"{os.path.splitext(os.path.basename(path))[0]}"'
+    stat = os.stat(path)
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'